@@ -0,0 +1,304 @@
+"""Loads several states and levels in one run on a bounded pool of loaders.
+
+For every state and level the geography, graph and population loads are run as
+subprocesses (`load_test_geo.py`, `load_test_graph.py`, `load_test_pop.py` with
+`--file`). At most `--workers` loaders run at once. Graph and population loads
+of a state and level only start once its geographies have loaded, and are
+skipped if that load failed.
+
+Input files are looked up in `--data-dir` (by default `./<ST>_data`, like
+`./WY_data`):
+
+    <fips>_<level>_<year>--<sha256>.parquet   geographies
+    <fips>_<level>_<year>.pkl                 graph (or <...>_graph.pkl)
+    <fips>_<level>_<year>_P1.parquet          population tables
+
+Every load is appended to `--phase-results` with its wall-clock time, the number
+of rows in its input and the rows (geographies) loaded per second, and a
+per-state summary is printed at the end. A loader fails when it exits nonzero;
+the run then exits nonzero too.
+
+Usage:
+
+    python batch_load.py --states WY,VT,TX --levels county,block --workers 4
+"""
+
+import glob
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+import click
+import pyarrow.parquet as pq
+
+from benchmark import append_phase
+from states_and_territories import states_and_territories
+
+LOADERS = {
+    "geo": "load_test_geo.py",
+    "graph": "load_test_graph.py",
+    "pop": "load_test_pop.py",
+}
+
+
+@dataclass
+class LoadJob:
+    """A single loader run for one state, level and kind of data."""
+
+    kind: str
+    fips: str
+    state: str
+    level: str
+    file: str
+    rows: Optional[int] = None
+    extra_args: list = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}_{self.state.lower()}_{self.level}"
+
+
+def resolve_states(states: str) -> list[tuple[str, str]]:
+    """Turns comma-separated FIPS codes or postal abbreviations (or "all") into
+    `(fips, abbreviation)` pairs."""
+    if states == "all":
+        return sorted(states_and_territories.items())
+
+    fips_by_abbr = {abbr: fips for fips, abbr in states_and_territories.items()}
+    resolved = []
+    for state in states.split(","):
+        state = state.strip().upper()
+        if state in states_and_territories:
+            resolved.append((state, states_and_territories[state]))
+        elif state in fips_by_abbr:
+            resolved.append((fips_by_abbr[state], state))
+        else:
+            raise click.BadParameter(f'Unknown state "{state}".')
+    return resolved
+
+
+GRAPH_SUFFIXES = (".pkl", "_graph.pkl")
+
+
+def find_jobs(
+    fips: str, abbr: str, level: str, year: str, data_dir: str, loader_args: dict
+) -> dict[str, LoadJob]:
+    """Finds the input files of a state and level; kinds without a file are left
+    out."""
+    data_dir = data_dir.format(state=abbr)
+    prefix = os.path.join(data_dir, f"{fips}_{level}_{year}")
+    jobs = {}
+
+    geo_files = sorted(glob.glob(f"{prefix}--*.parquet"))
+    if geo_files:
+        jobs["geo"] = LoadJob(
+            "geo",
+            fips,
+            abbr,
+            level,
+            geo_files[0],
+            rows=pq.ParquetFile(geo_files[0]).metadata.num_rows,
+        )
+    graph_files = [
+        f"{prefix}{suffix}"
+        for suffix in GRAPH_SUFFIXES
+        if os.path.exists(f"{prefix}{suffix}")
+    ]
+    if graph_files:
+        jobs["graph"] = LoadJob("graph", fips, abbr, level, graph_files[0])
+    if os.path.exists(f"{prefix}_P1.parquet"):
+        jobs["pop"] = LoadJob(
+            "pop",
+            fips,
+            abbr,
+            level,
+            f"{prefix}_P1.parquet",
+            rows=pq.ParquetFile(f"{prefix}_P1.parquet").metadata.num_rows,
+        )
+
+    for kind, job in jobs.items():
+        job.extra_args = loader_args[kind]
+    return jobs
+
+
+def run_job(job: LoadJob, log_dir: str) -> dict:
+    """Runs a loader and returns its phase record."""
+    log_path = os.path.join(log_dir, f"LOG_{job.name}.log")
+    command = [
+        sys.executable,
+        LOADERS[job.kind],
+        "--file",
+        job.file,
+        *job.extra_args,
+    ]
+
+    started_at = datetime.now(timezone.utc)
+    t_start = time.perf_counter()
+    with open(log_path, "w") as log_fp:
+        returncode = subprocess.call(
+            command, stdout=log_fp, stderr=subprocess.STDOUT
+        )
+    wall_s = time.perf_counter() - t_start
+
+    record = {
+        "phase": f"batch_{job.kind}_load",
+        "started_at": started_at.isoformat(),
+        "wall_s": wall_s,
+        "status": "ok" if returncode == 0 else "failed",
+        "returncode": returncode,
+        **asdict(job),
+        "rows_per_s": job.rows / wall_s if job.rows else None,
+        "log": log_path,
+    }
+    record.pop("extra_args")
+    return record
+
+
+@click.command()
+@click.option(
+    "--states",
+    required=True,
+    help='Comma-separated FIPS codes or postal abbreviations, or "all".',
+)
+@click.option(
+    "--levels",
+    default="county,block",
+    show_default=True,
+    help="Comma-separated geographic levels.",
+)
+@click.option("--year", default="2010", show_default=True)
+@click.option(
+    "--data-dir",
+    default="./{state}_data",
+    show_default=True,
+    help="Input directory of a state; {state} is its postal abbreviation.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=2,
+    show_default=True,
+    help="Maximum number of loaders running at once.",
+)
+@click.option(
+    "--kinds",
+    default="geo,graph,pop",
+    show_default=True,
+    help="Comma-separated loads to run (geo, graph, pop).",
+)
+@click.option("--geo-args", default="", help="Extra arguments for load_test_geo.py.")
+@click.option(
+    "--graph-args", default="", help="Extra arguments for load_test_graph.py."
+)
+@click.option("--pop-args", default="", help="Extra arguments for load_test_pop.py.")
+@click.option(
+    "--phase-results",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="JSON lines file to append one record per load to. Defaults to "
+    "./results/batch_load_<timestamp>/phases.jsonl.",
+)
+def main(
+    states,
+    levels,
+    year,
+    data_dir,
+    workers,
+    kinds,
+    geo_args,
+    graph_args,
+    pop_args,
+    phase_results,
+):
+    if phase_results is None:
+        timestamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        phase_results = os.path.join(
+            "results", f"batch_load_{timestamp}", "phases.jsonl"
+        )
+    log_dir = os.path.dirname(phase_results) or "."
+    os.makedirs(log_dir, exist_ok=True)
+
+    kinds = kinds.split(",")
+    loader_args = {
+        "geo": shlex.split(geo_args),
+        "graph": shlex.split(graph_args),
+        "pop": shlex.split(pop_args),
+    }
+
+    # Dependent loads are queued per geo load and submitted once it succeeds.
+    independent = []
+    dependents = {}
+    for fips, abbr in resolve_states(states):
+        for level in levels.split(","):
+            jobs = find_jobs(fips, abbr, level, year, data_dir, loader_args)
+            jobs = {kind: job for kind, job in jobs.items() if kind in kinds}
+            for kind in kinds:
+                if kind not in jobs:
+                    print(f"No {kind} input file for {abbr} {level}.", flush=True)
+            if not jobs:
+                print(f"No input files for {abbr} {level}; skipping.", flush=True)
+                continue
+
+            if "geo" in jobs:
+                independent.append(jobs["geo"])
+                dependents[jobs["geo"].name] = [
+                    job for kind, job in jobs.items() if kind != "geo"
+                ]
+            else:
+                independent.extend(jobs.values())
+
+    records = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(run_job, job, log_dir): job for job in independent}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                record = future.result()
+                append_phase(phase_results, record)
+                records.append(record)
+
+                rate = (
+                    f", {record['rows_per_s']:.0f} rows/s"
+                    if record["rows_per_s"]
+                    else ""
+                )
+                print(
+                    f"{job.name}: {record['status']} in {record['wall_s']:.1f} s{rate}",
+                    flush=True,
+                )
+
+                for dependent in dependents.pop(job.name, []):
+                    if record["status"] == "ok":
+                        pending[pool.submit(run_job, dependent, log_dir)] = dependent
+                    else:
+                        print(
+                            f"{dependent.name}: skipped ({job.name} failed)",
+                            flush=True,
+                        )
+
+    print("\nGeographies loaded per second, by state and level:")
+    geo_records = sorted(
+        (record for record in records if record["kind"] == "geo"),
+        key=lambda record: record["rows"] or 0,
+    )
+    for record in geo_records:
+        rate = f"{record['rows_per_s']:.0f}/s" if record["rows_per_s"] else "n/a"
+        print(
+            f"\t{record['state']} {record['level']:>8}: {record['rows'] or 0:>9} "
+            f"rows in {record['wall_s']:8.1f} s ({rate}) [{record['status']}]"
+        )
+    print(f"Phase results written to {phase_results}")
+
+    if any(record["status"] != "ok" for record in records):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Timing helpers shared by the GerryDB speed test benchmarks.
+
+Each benchmark runs a callable a configurable number of warmup (cold) and timed
+(warm) iterations, records every sample with `time.perf_counter` and summarizes
+the timed samples. Results are written as JSON (full samples) or CSV (one
+summary row per benchmark) so runs can be compared across server builds.
+
+Coarser phases of a speed test run (bootstrap, loads, view benchmarks) are
+appended as JSON lines to a single phase results file; see `phase_timer.py`.
+"""
+
+import csv
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+
+@dataclass
+class BenchmarkResult:
+    """Samples (in seconds) recorded for a single benchmark."""
+
+    name: str
+    dataset: str
+    warmup_samples: list = field(default_factory=list)
+    samples: list = field(default_factory=list)
+    extra: dict = field(default_factory=dict)
+
+    def summary(self) -> dict:
+        return {
+            "name": self.name,
+            "dataset": self.dataset,
+            "warmup": len(self.warmup_samples),
+            "cold": self.warmup_samples[0] if self.warmup_samples else None,
+            **summarize(self.samples),
+            **self.extra,
+        }
+
+
+def percentile(samples: list, q: float) -> float:
+    """Returns the `q`-th percentile (0-100) of `samples` with linear interpolation."""
+    if not samples:
+        return math.nan
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * q / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples: list) -> dict:
+    """Computes min/median/p95/stddev (and friends) over timed samples."""
+    if not samples:
+        return {
+            "n": 0,
+            "min": None,
+            "median": None,
+            "mean": None,
+            "p95": None,
+            "max": None,
+            "stddev": None,
+        }
+    return {
+        "n": len(samples),
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "p95": percentile(samples, 95),
+        "max": max(samples),
+        "stddev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def run_benchmark(
+    name: str,
+    fn: Callable[[str], object],
+    warmup: int = 1,
+    iterations: int = 3,
+    dataset: str = "",
+    progress: bool = True,
+    **extra,
+) -> BenchmarkResult:
+    """Times `fn` over `warmup` untimed-in-summary runs and `iterations` timed runs.
+
+    `fn` is passed a unique tag for every call (e.g. `"warmup_0"`, `"2"`) so that
+    callers creating server-side objects can derive distinct paths from it.
+    """
+    result = BenchmarkResult(name=name, dataset=dataset, extra=extra)
+
+    for i in range(warmup):
+        t_start = time.perf_counter()
+        fn(f"warmup_{i}")
+        result.warmup_samples.append(time.perf_counter() - t_start)
+        if progress:
+            print(
+                f"\t[{name}] warmup {i + 1}/{warmup}: "
+                f"{result.warmup_samples[-1]:.3f} s",
+                flush=True,
+            )
+
+    for i in range(iterations):
+        t_start = time.perf_counter()
+        fn(str(i))
+        result.samples.append(time.perf_counter() - t_start)
+        if progress:
+            print(
+                f"\t[{name}] iteration {i + 1}/{iterations}: "
+                f"{result.samples[-1]:.3f} s",
+                flush=True,
+            )
+
+    return result
+
+
+def format_summary(result: BenchmarkResult) -> str:
+    """Formats a one-line, human-readable summary of a benchmark."""
+    s = result.summary()
+    if not s["n"]:
+        return f"{result.name}: no timed samples"
+    cold = f"cold={s['cold']:.3f}s " if s["cold"] is not None else ""
+    return (
+        f"{result.name}: {cold}n={s['n']} min={s['min']:.3f}s "
+        f"median={s['median']:.3f}s p95={s['p95']:.3f}s "
+        f"stddev={s['stddev']:.3f}s"
+    )
+
+
+def parse_server_timing(header: str) -> dict:
+    """Parses a `Server-Timing` header into `{metric: duration in seconds}`."""
+    timings = {}
+    for metric in header.split(","):
+        name, *params = (part.strip() for part in metric.split(";"))
+        for param in params:
+            if param.startswith("dur="):
+                timings[name] = float(param[4:]) / 1e3
+    return timings
+
+
+def server_timing_breakdown(samples: list, timings: list) -> dict:
+    """Splits the mean client-side latency into the mean server-side phases.
+
+    `timings` are parsed `Server-Timing` headers of the timed requests. Whatever
+    the server did not account for (network, client-side parsing) is reported as
+    `client_network_s`.
+    """
+    if not samples or not timings:
+        return {}
+    names = sorted({name for timing in timings for name in timing})
+    breakdown = {
+        f"server_{name}_s": statistics.fmean(
+            timing.get(name, 0.0) for timing in timings
+        )
+        for name in names
+    }
+    if "server_total_s" in breakdown:
+        breakdown["client_network_s"] = (
+            statistics.fmean(samples) - breakdown["server_total_s"]
+        )
+    return breakdown
+
+
+def run_metadata() -> dict:
+    """Metadata identifying the machine and time a set of results came from."""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "server_build": os.getenv("GERRYDB_SERVER_BUILD"),
+    }
+
+
+def write_results(
+    results: list, path: str, metadata: Optional[dict] = None
+) -> None:
+    """Writes benchmark results to `path` as CSV (`.csv`) or JSON (anything else)."""
+    metadata = {**run_metadata(), **(metadata or {})}
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if path.endswith(".csv"):
+        rows = [{**metadata, **result.summary()} for result in results]
+        fieldnames = []
+        for row in rows:
+            fieldnames.extend(key for key in row if key not in fieldnames)
+        with open(path, "w", newline="") as fp:
+            writer = csv.DictWriter(fp, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        return
+
+    with open(path, "w") as fp:
+        json.dump(
+            {
+                "metadata": metadata,
+                "results": [
+                    {"summary": result.summary(), **asdict(result)}
+                    for result in results
+                ],
+            },
+            fp,
+            indent=2,
+        )
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident set size of this process (or its reaped children) in MiB."""
+    max_rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+def append_phase(path: str, record: dict) -> None:
+    """Appends a phase record to the JSON lines phase results file at `path`."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a") as fp:
+        print(json.dumps(record), file=fp, flush=True)
+
+
+class PhaseTimer:
+    """Records wall-clock, CPU time and peak RSS of an in-process phase.
+
+    The record is appended to `path` when the block exits, including when it
+    exits with an exception (with `status` set to `"failed"`). When `path` is
+    `None` nothing is written.
+    """
+
+    def __init__(self, phase: str, path: Optional[str], **extra):
+        self.phase = phase
+        self.path = path
+        self.extra = extra
+        self.record = None
+
+    def __enter__(self):
+        self._started_at = datetime.now(timezone.utc)
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record = {
+            "phase": self.phase,
+            "started_at": self._started_at.isoformat(),
+            "wall_s": time.perf_counter() - self._wall_start,
+            "cpu_s": time.process_time() - self._cpu_start,
+            "peak_rss_mb": peak_rss_mb(),
+            "status": "ok" if exc_type is None else "failed",
+            **self.extra,
+        }
+        if exc_type is not None:
+            self.record["error"] = repr(exc)
+        if self.path is not None:
+            append_phase(self.path, self.record)
+        return False
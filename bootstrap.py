@@ -0,0 +1,125 @@
+"""Bootstraps Census namespaces, geographic layers and columns in one process.
+
+Replaces one `python -m gerrydb.create ...` (or `python -m gerrydb_etl...`)
+process per namespace, layer, column template and year with a single interpreter
+driven by a declarative manifest (`bootstrap.yaml`). Namespaces and layers share
+one GerryDB session (one pooled HTTP client). Columns are created by calling the
+gerrydb_etl bootstraps (`templated_columns`, `pl_pop_table_columns`) in-process;
+those open their own GerryDB client and write context per call, so the shared
+session does not cover them.
+Years are independent of each other and are bootstrapped concurrently; within a
+year the namespace is created first, then its geographic layers and columns.
+
+Usage:
+
+    python bootstrap.py --manifest bootstrap.yaml --phase-results phases.jsonl
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import yaml
+from gerrydb import GerryDB
+from gerrydb_etl import config_logger
+from gerrydb_etl.bootstrap import pl_pop_table_columns, templated_columns
+
+from benchmark import PhaseTimer
+
+log = logging.getLogger()
+
+
+def create_geo_layers(ctx, manifest: dict, namespace: str, year: int):
+    for layer in manifest["geo_layers"]:
+        ctx.geo_layers.create(
+            path=layer["path"],
+            namespace=namespace,
+            description=layer["description"].format(year=year),
+            source_url=layer.get("source_url", manifest["source_url"]),
+        )
+    log.info(
+        f"Created {len(manifest['geo_layers'])} geographic layers in {namespace}"
+    )
+
+
+def create_geo_columns(ctx, manifest: dict, namespace: str, year: int):
+    """Creates the columns of the manifest's column template (see `pl_geo.yaml`)
+    through gerrydb_etl's `templated_columns` bootstrap, which uses its own
+    GerryDB client and context (`ctx` is unused)."""
+    templated_columns.main.callback(
+        namespace=namespace,
+        template=manifest["geo_columns"],
+        yr=str(year)[2:],
+        year=year,
+    )
+    log.info(f"Created geographic columns in {namespace}")
+
+
+def create_pop_columns(ctx, manifest: dict, namespace: str, year: int):
+    """Creates the PL 94-171 population columns and column sets through
+    gerrydb_etl's `pl_pop_table_columns` bootstrap, which uses its own GerryDB
+    client and context (`ctx` is unused)."""
+    pl_pop_table_columns.main.callback(namespace=namespace, year=year)
+    log.info(f"Created population columns in {namespace}")
+
+
+def bootstrap_year(db: GerryDB, manifest: dict, year: int, phase_results: str):
+    """Creates the namespace of `year`, then its layers and columns concurrently."""
+    namespace = manifest["namespace"]["path"].format(year=year)
+
+    with db.context(notes=f"Bootstrapping {namespace} (bootstrap.py)") as ctx:
+        with PhaseTimer("bootstrap_namespaces", phase_results, year=year):
+            ctx.namespaces.create(
+                path=namespace,
+                description=manifest["namespace"]["description"].format(year=year),
+                public=manifest["namespace"].get("public", True),
+            )
+
+        def timed(phase, fn):
+            with PhaseTimer(phase, phase_results, year=year):
+                fn(ctx, manifest, namespace, year)
+
+        steps = [("bootstrap_geo_layers", create_geo_layers)]
+        if manifest.get("geo_columns"):
+            steps.append(("bootstrap_geo_columns", create_geo_columns))
+        if manifest.get("pop_columns"):
+            steps.append(("bootstrap_pop_columns", create_pop_columns))
+        with ThreadPoolExecutor(max_workers=len(steps)) as pool:
+            futures = [pool.submit(timed, phase, fn) for phase, fn in steps]
+            for future in futures:
+                future.result()
+
+
+@click.command()
+@click.option(
+    "--manifest",
+    type=click.Path(exists=True, dir_okay=False),
+    default="bootstrap.yaml",
+    show_default=True,
+    help="Bootstrap manifest.",
+)
+@click.option(
+    "--phase-results",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="JSON lines phase results file to append one record per step to.",
+)
+def main(manifest, phase_results):
+    config_logger(log)
+
+    with open(manifest) as manifest_fp:
+        manifest = yaml.safe_load(manifest_fp)
+    years = manifest["years"]
+
+    db = GerryDB()
+    with ThreadPoolExecutor(max_workers=len(years)) as pool:
+        futures = [
+            pool.submit(bootstrap_year, db, manifest, year, phase_results)
+            for year in years
+        ]
+        for future in futures:
+            future.result()
+
+
+if __name__ == "__main__":
+    main()
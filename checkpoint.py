@@ -0,0 +1,64 @@
+"""Progress manifests for resumable loads.
+
+A checkpointed load commits its input in independent units (a county, a chunk of
+rows, ...) and records every committed unit in a JSON manifest. Rerunning the
+load with the same manifest skips the units already recorded, so a failure hours
+into a large import only costs the unit that was in flight.
+
+The manifest also stores a description of the load (input file, namespace, unit
+size, ...). Resuming with a manifest written for a different load is an error
+rather than a silent skip. The manifest describes the database it was written
+against: delete it when the database is reset.
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+
+
+class LoadManifest:
+    """The committed units of a load, persisted to `path` after every unit."""
+
+    def __init__(self, path: str, load: dict):
+        self.path = path
+        self.load = load
+        self.units = {}
+
+        if os.path.exists(path):
+            with open(path) as fp:
+                manifest = json.load(fp)
+            if manifest["load"] != load:
+                raise ValueError(
+                    f"Checkpoint {path} belongs to a different load "
+                    f"({manifest['load']}, expected {load})."
+                )
+            self.units = manifest["units"]
+
+    def __contains__(self, unit: str) -> bool:
+        return unit in self.units
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    @property
+    def rows(self) -> int:
+        """Rows committed across all units."""
+        return sum(unit.get("rows", 0) for unit in self.units.values())
+
+    def mark_done(self, unit: str, **info) -> None:
+        """Records `unit` as committed and persists the manifest."""
+        self.units[unit] = {
+            "committed_at": datetime.now(timezone.utc).isoformat(),
+            **info,
+        }
+        self.save()
+
+    def save(self) -> None:
+        """Writes the manifest atomically, so a crash never leaves it truncated."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump({"load": self.load, "units": self.units}, fp, indent=2)
+        os.replace(tmp_path, self.path)
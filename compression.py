@@ -0,0 +1,335 @@
+"""Configurable response compression for the API server.
+
+Replaces Starlette's `GZipMiddleware` with a middleware that
+
+    * negotiates zstd, brotli or gzip from the client's `Accept-Encoding`
+      (zstd and brotli only when `zstandard`/`brotli` are installed),
+    * leaves responses smaller than a minimum size uncompressed,
+    * uses a configurable compression level,
+    * can pass responses to localhost clients through uncompressed, and
+    * optionally appends per-response statistics (bytes in/out and CPU time
+      spent compressing) to a JSON lines file, so benchmarks can report them,
+      and reports compression time to a callback (see `server_timing.py`).
+
+Configuration is read from environment variables (see `config_from_env`) so
+that every server worker process picks up the same settings.
+"""
+
+import json
+import os
+import time
+import zlib
+from typing import Callable, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+LOCALHOST_ADDRESSES = ("127.0.0.1", "::1", "localhost")
+
+# Codec recorded in the statistics for responses sent uncompressed.
+IDENTITY = "identity"
+
+
+def available_codecs() -> list:
+    """Codecs supported by this installation, in default order of preference."""
+    codecs = []
+    if zstandard is not None:
+        codecs.append("zstd")
+    if brotli is not None:
+        codecs.append("br")
+    codecs.append("gzip")
+    return codecs
+
+
+def config_from_env() -> dict:
+    """Reads `CompressionMiddleware` settings from `GERRYDB_COMPRESSION_*` variables."""
+    codecs = os.getenv("GERRYDB_COMPRESSION_CODECS")
+    level = os.getenv("GERRYDB_COMPRESSION_LEVEL")
+    return {
+        "minimum_size": int(os.getenv("GERRYDB_COMPRESSION_MIN_SIZE", "1024")),
+        "level": int(level) if level else None,
+        "codecs": codecs.split(",") if codecs else None,
+        "localhost_passthrough": os.getenv("GERRYDB_COMPRESSION_LOCALHOST_PASSTHROUGH")
+        == "1",
+        "stats_path": os.getenv("GERRYDB_COMPRESSION_STATS") or None,
+    }
+
+
+def negotiate(accept_encoding: str, codecs: list) -> Optional[str]:
+    """Picks the best codec in `codecs` that the client accepts (q > 0)."""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+
+    wildcard = accepted.get("*", 0.0)
+    best = None
+    best_q = 0.0
+    for codec in codecs:
+        q = accepted.get(codec, wildcard)
+        if q > best_q:
+            best, best_q = codec, q
+    return best
+
+
+class _Compressor:
+    """Incremental compressor with a uniform interface across codecs."""
+
+    def __init__(self, codec: str, level: Optional[int]):
+        self.codec = codec
+        if codec == "zstd":
+            self._obj = zstandard.ZstdCompressor(
+                level=3 if level is None else level
+            ).compressobj()
+        elif codec == "br":
+            self._obj = brotli.Compressor(quality=4 if level is None else level)
+        else:
+            self._obj = zlib.compressobj(
+                6 if level is None else level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+
+    def compress(self, data: bytes) -> bytes:
+        if self.codec == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        if self.codec == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with the best codec the client accepts.
+
+    Bodies are compressed chunk by chunk as they are streamed; only the first
+    `minimum_size` bytes are held back to decide whether compressing is worth it.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        level: Optional[int] = None,
+        codecs: Optional[list] = None,
+        localhost_passthrough: bool = False,
+        stats_path: Optional[str] = None,
+        record_time: Optional[Callable[[float], None]] = None,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        supported = available_codecs()
+        self.codecs = [codec for codec in (codecs or supported) if codec in supported]
+        self.localhost_passthrough = localhost_passthrough
+        self.stats_path = stats_path
+        self.record_time = record_time
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        if self.localhost_passthrough and client and client[0] in LOCALHOST_ADDRESSES:
+            codec = None
+        else:
+            headers = dict(scope["headers"])
+            codec = negotiate(
+                headers.get(b"accept-encoding", b"").decode("latin-1"), self.codecs
+            )
+        if codec is None:
+            if self.stats_path is None:
+                await self.app(scope, receive, send)
+            else:
+                # Still recorded, so that response sizes are reported.
+                responder = _CompressionResponder(self, scope, IDENTITY, send)
+                await self.app(scope, receive, responder.send_uncompressed)
+            return
+
+        responder = _CompressionResponder(self, scope, codec, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """Per-response state of `CompressionMiddleware`."""
+
+    def __init__(self, middleware: CompressionMiddleware, scope, codec: str, send):
+        self.middleware = middleware
+        self.scope = scope
+        self.codec = codec
+        self.downstream_send = send
+        self.start_message = None
+        self.pending = bytearray()
+        self.compressor = None
+        self.started = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_s = 0.0
+
+    async def send_uncompressed(self, message):
+        """Passes a response through unchanged, counting its body."""
+        await self.downstream_send(message)
+        if message["type"] == "http.response.body":
+            self.bytes_in += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                self._record(codec=IDENTITY)
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self.downstream_send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.started:
+            await self._send_compressed(body, more_body)
+            return
+
+        self.pending.extend(body)
+        if more_body and len(self.pending) < self.middleware.minimum_size:
+            return
+
+        response_headers = dict(self.start_message["headers"])
+        if (
+            len(self.pending) < self.middleware.minimum_size
+            or b"content-encoding" in response_headers
+        ):
+            # Too small to be worth compressing (or already encoded): pass through.
+            self.started = True
+            self.bytes_in += len(self.pending)
+            await self.downstream_send(self.start_message)
+            await self.downstream_send(
+                {
+                    "type": "http.response.body",
+                    "body": bytes(self.pending),
+                    "more_body": more_body,
+                }
+            )
+            if not more_body:
+                self._record(codec=IDENTITY)
+            self.pending = bytearray()
+            return
+
+        self.compressor = _Compressor(self.codec, self.middleware.level)
+        self.started = True
+        headers = [
+            (name, value)
+            for name, value in self.start_message["headers"]
+            if name.lower() != b"content-length"
+        ]
+        headers.append((b"content-encoding", self.codec.encode()))
+        headers.append((b"vary", b"Accept-Encoding"))
+
+        if not more_body:
+            # The whole body is known, so a Content-Length can still be sent.
+            compressed = self._compress(bytes(self.pending), final=True)
+            headers.append((b"content-length", str(len(compressed)).encode()))
+            await self.downstream_send({**self.start_message, "headers": headers})
+            await self.downstream_send(
+                {"type": "http.response.body", "body": compressed}
+            )
+            self._record(codec=self.codec)
+            return
+
+        await self.downstream_send({**self.start_message, "headers": headers})
+        pending = bytes(self.pending)
+        self.pending = bytearray()
+        await self._send_compressed(pending, more_body)
+
+    async def _send_compressed(self, body: bytes, more_body: bool):
+        if self.compressor is None:
+            # Passing through uncompressed.
+            self.bytes_in += len(body)
+            await self.downstream_send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+            if not more_body:
+                self._record(codec=IDENTITY)
+            return
+
+        compressed = self._compress(body, final=not more_body)
+        await self.downstream_send(
+            {"type": "http.response.body", "body": compressed, "more_body": more_body}
+        )
+        if not more_body:
+            self._record(codec=self.codec)
+
+    def _compress(self, body: bytes, final: bool) -> bytes:
+        t_start = time.thread_time()
+        compressed = self.compressor.compress(body)
+        if final:
+            compressed += self.compressor.flush()
+        elapsed = time.thread_time() - t_start
+        self.cpu_s += elapsed
+        if self.middleware.record_time is not None:
+            self.middleware.record_time(elapsed)
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        return compressed
+
+    def _record(self, codec: str):
+        if self.middleware.stats_path is None:
+            return
+        record = {
+            "time": time.time(),
+            "method": self.scope["method"],
+            "path": self.scope["path"],
+            "codec": codec,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_in if codec == IDENTITY else self.bytes_out,
+            "compress_cpu_s": self.cpu_s,
+        }
+        with open(self.middleware.stats_path, "a") as fp:
+            print(json.dumps(record), file=fp)
+
+
+def read_stats(path: str, offset: int = 0) -> tuple[list, int]:
+    """Reads the statistics records appended to `path` after byte `offset`.
+
+    Returns the records and the new offset, so a client can diff the file around
+    a benchmark.
+    """
+    if not os.path.exists(path):
+        return [], offset
+    with open(path) as fp:
+        fp.seek(offset)
+        records = [json.loads(line) for line in fp if line.strip()]
+        return records, fp.tell()
+
+
+def summarize_stats(records: list) -> dict:
+    """Mean body size, bytes on the wire and compression CPU time per response."""
+    if not records:
+        return {}
+    n = len(records)
+    bytes_in = sum(record["bytes_in"] for record in records)
+    bytes_out = sum(record["bytes_out"] for record in records)
+    return {
+        "responses": n,
+        "codecs": sorted({str(record["codec"]) for record in records}),
+        "body_bytes": bytes_in / n,
+        "wire_bytes": bytes_out / n,
+        "compression_ratio": bytes_in / bytes_out if bytes_out else None,
+        "compress_cpu_s": sum(record["compress_cpu_s"] for record in records) / n,
+    }
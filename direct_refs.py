@@ -0,0 +1,59 @@
+"""Reference lookups shared by the loaders that write straight to the database.
+
+Loaders running in a `DirectTransactionContext` bypass the API, so they resolve
+the geographies and columns they write to themselves, with bulk lookups rather
+than one query per row.
+"""
+
+import pandas as pd
+
+try:
+    from gerrydb_meta import crud, models
+    from sqlalchemy import select
+except ImportError:
+    crud = None
+
+
+def resolve_refs(
+    ctx, namespace: str, geoids: pd.Index, table_cols: dict
+) -> tuple[dict, dict]:
+    """Looks up the geographies `geoids` with a single bulk lookup and the columns
+    of all tables in `table_cols` with a single query.
+
+    Returns the geographies by path and the columns by canonical path.
+    """
+    if crud is None:
+        raise RuntimeError("gerrydb_meta must be available to resolve references.")
+
+    namespace_obj = crud.namespace.get(db=ctx.db, path=namespace)
+    assert namespace_obj is not None
+
+    geographies = crud.geography.get_bulk(
+        db=ctx.db,
+        namespaced_paths=[(namespace, idx) for idx in geoids],
+    )
+    if len(geographies) < len(geoids):
+        raise ValueError(
+            f"Cannot perform bulk import (expected {len(geoids)} "
+            f"geographies, found {len(geographies)})."
+        )
+    geos_by_path = {geo.path: geo for geo in geographies}
+
+    raw_cols = (
+        ctx.db.query(models.DataColumn)
+        .filter(
+            models.DataColumn.col_id.in_(
+                select(models.ColumnRef.col_id).filter(
+                    models.ColumnRef.path.in_(
+                        col.path
+                        for cols in table_cols.values()
+                        for col in cols.values()
+                    ),
+                    models.ColumnRef.namespace_id == namespace_obj.namespace_id,
+                )
+            )
+        )
+        .all()
+    )
+    cols_by_canonical_path = {col.canonical_ref.path: col for col in raw_cols}
+    return geos_by_path, cols_by_canonical_path
@@ -0,0 +1,114 @@
+"""Wire encodings for geometry payloads.
+
+Geo imports currently send each geometry as its own WKB value. This module
+implements bulk alternatives for a batch of geometries, each serialized to a
+single Arrow IPC buffer that can be decoded in one vectorized call:
+
+    * `wkb`           - WKB values in an Arrow binary array.
+    * `wkb_zstd`      - the same, with zstd-compressed IPC buffers.
+    * `geoarrow`      - native GeoArrow multipolygons (interleaved coordinates
+                        and nested offsets), decoded without parsing WKB.
+    * `geoarrow_zstd` - the same, with zstd-compressed IPC buffers.
+
+`quantize` snaps coordinates to a grid before encoding. It does not shrink
+uncompressed WKB or GeoArrow (coordinates stay float64), but makes coordinates
+far more compressible.
+"""
+
+import numpy as np
+import pyarrow as pa
+import shapely
+
+ENCODINGS = ("wkb", "wkb_zstd", "geoarrow", "geoarrow_zstd")
+
+GEOARROW_MULTIPOLYGON = "geoarrow.multipolygon"
+
+
+def quantize(geometries: np.ndarray, grid_size: float) -> np.ndarray:
+    """Snaps coordinates to a grid of `grid_size` (in the layer's CRS units),
+    keeping the geometries valid."""
+    if not grid_size:
+        return geometries
+    return shapely.set_precision(geometries, grid_size)
+
+
+def _to_multipolygons(geometries: np.ndarray) -> np.ndarray:
+    """Promotes polygons to single-part multipolygons, so that a mixed polygon
+    layer can be written as one GeoArrow type."""
+    geometries = np.asarray(geometries, dtype=object)
+    is_polygon = shapely.get_type_id(geometries) == shapely.GeometryType.POLYGON
+    if is_polygon.any():
+        geometries = geometries.copy()
+        polygons = geometries[is_polygon]
+        geometries[is_polygon] = shapely.multipolygons(
+            polygons, indices=np.arange(len(polygons))
+        )
+    return geometries
+
+
+def _write_ipc(array: pa.Array, field: pa.Field, compression) -> bytes:
+    batch = pa.record_batch([array], schema=pa.schema([field]))
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.ipc.new_stream(sink, batch.schema, options=options) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def _read_ipc(payload: bytes) -> pa.Array:
+    with pa.ipc.open_stream(payload) as reader:
+        return reader.read_all().column(0).combine_chunks()
+
+
+def encode(geometries: np.ndarray, encoding: str) -> bytes:
+    """Serializes an array of (multi)polygons with `encoding`."""
+    compression = "zstd" if encoding.endswith("_zstd") else None
+
+    if encoding.startswith("wkb"):
+        array = pa.array(shapely.to_wkb(geometries), type=pa.binary())
+        return _write_ipc(array, pa.field("geometry", pa.binary()), compression)
+
+    if encoding.startswith("geoarrow"):
+        geom_type, coords, (ring_offsets, polygon_offsets, geom_offsets) = (
+            shapely.to_ragged_array(_to_multipolygons(geometries))
+        )
+        assert geom_type == shapely.GeometryType.MULTIPOLYGON
+        points = pa.FixedSizeListArray.from_arrays(pa.array(coords.ravel()), 2)
+        rings = pa.ListArray.from_arrays(pa.array(ring_offsets, pa.int32()), points)
+        polygons = pa.ListArray.from_arrays(
+            pa.array(polygon_offsets, pa.int32()), rings
+        )
+        array = pa.ListArray.from_arrays(pa.array(geom_offsets, pa.int32()), polygons)
+        field = pa.field(
+            "geometry",
+            array.type,
+            metadata={"ARROW:extension:name": GEOARROW_MULTIPOLYGON},
+        )
+        return _write_ipc(array, field, compression)
+
+    raise ValueError(f'Unknown encoding "{encoding}" (expected one of {ENCODINGS}).')
+
+
+def decode(payload: bytes, encoding: str) -> np.ndarray:
+    """Decodes a payload written by `encode` back into shapely geometries, the
+    way a server would bulk-decode it."""
+    array = _read_ipc(payload)
+
+    if encoding.startswith("wkb"):
+        return shapely.from_wkb(array.to_numpy(zero_copy_only=False))
+
+    if encoding.startswith("geoarrow"):
+        polygons = array.values
+        rings = polygons.values
+        coords = rings.values.values.to_numpy().reshape(-1, 2)
+        return shapely.from_ragged_array(
+            shapely.GeometryType.MULTIPOLYGON,
+            coords,
+            (
+                rings.offsets.to_numpy(),
+                polygons.offsets.to_numpy(),
+                array.offsets.to_numpy(),
+            ),
+        )
+
+    raise ValueError(f'Unknown encoding "{encoding}" (expected one of {ENCODINGS}).')
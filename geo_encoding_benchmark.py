@@ -0,0 +1,118 @@
+"""Benchmarks geometry wire encodings (see `geo_encoding.py`) on a Census layer.
+
+For every encoding and quantization grid size the payload size, serialization
+time and bulk decoding time (what the server would spend ingesting the payload)
+are reported. The current per-geometry WKB upload is the `wkb` baseline.
+
+Usage:
+
+    python geo_encoding_benchmark.py --large=1 --precision 0,1e-7,1e-6
+"""
+
+import os
+from datetime import datetime
+
+import click
+import geopandas as gpd
+
+from benchmark import format_summary, run_benchmark, write_results
+from geo_encoding import ENCODINGS, decode, encode, quantize
+
+
+@click.command()
+@click.option("--large", type=int, help="Run on large data set.")
+@click.option("--extreme", type=int, help="Run on extreme data set.")
+@click.option(
+    "--encodings",
+    default=",".join(ENCODINGS),
+    show_default=True,
+    help="Comma-separated encodings to benchmark.",
+)
+@click.option(
+    "--precision",
+    default="0,1e-7,1e-6",
+    show_default=True,
+    help="Comma-separated quantization grid sizes in degrees (0 = unquantized).",
+)
+@click.option("--iterations", type=int, default=3, show_default=True)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Results file (.json or .csv). "
+    "Defaults to ./results/geo_encoding_<dataset>_<timestamp>.json.",
+)
+def main(large, extreme, encodings, precision, iterations, output):
+
+    # convert int to bool
+    large = large == 1
+    extreme = extreme == 1
+
+    file = "./WY_data/56_county_2010--707029ed009370e99b66c9f83300bdb6f2fe936f97be8bcb6de127a06a123d1b.parquet"
+    dataset = "wy_county"
+
+    if large:
+        file = "./WY_data/56_block_2010--ef36f7336669e0ef5a758b8fba0441ac1dfb8cfc531ad4ee14731480039c708b.parquet"
+        dataset = "wy_block"
+
+    if extreme:
+        file = "./TX_data/48_block_2010--167bc0750535ffae8f14dd3e58d921a8439fcedd86b5fe576cbe82d7eb8f8d80.parquet"
+        dataset = "tx_block"
+
+    if output is None:
+        timestamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join("results", f"geo_encoding_{dataset}_{timestamp}.json")
+
+    geometries = gpd.read_parquet(file, columns=["geometry"]).geometry.to_numpy()
+    print(f"Benchmarking {len(geometries)} geometries from {file}", flush=True)
+
+    results = []
+    for grid_size in (float(size) for size in precision.split(",")):
+        quantized = quantize(geometries, grid_size)
+
+        for encoding in encodings.split(","):
+            name = f"{encoding}_grid{grid_size:g}"
+            payload = encode(quantized, encoding)
+
+            encode_result = run_benchmark(
+                f"encode_{name}",
+                lambda tag, geoms=quantized, encoding=encoding: encode(
+                    geoms, encoding
+                ),
+                warmup=1,
+                iterations=iterations,
+                dataset=dataset,
+                encoding=encoding,
+                grid_size=grid_size,
+                bytes=len(payload),
+                bytes_per_geometry=len(payload) / len(geometries),
+            )
+            decode_result = run_benchmark(
+                f"decode_{name}",
+                lambda tag, payload=payload, encoding=encoding: decode(
+                    payload, encoding
+                ),
+                warmup=1,
+                iterations=iterations,
+                dataset=dataset,
+                encoding=encoding,
+                grid_size=grid_size,
+                bytes=len(payload),
+                bytes_per_geometry=len(payload) / len(geometries),
+            )
+
+            print(f"{name}: {len(payload) / 1e6:.1f} MB", flush=True)
+            print(format_summary(encode_result), flush=True)
+            print(format_summary(decode_result), flush=True)
+            results.extend([encode_result, decode_result])
+
+    write_results(
+        results,
+        output,
+        metadata={"dataset": dataset, "geometries": len(geometries)},
+    )
+    print(f"Wrote encoding benchmark results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Client-side cache of GerryDB graphs, validated against the server with ETags.
+
+Graphs are stored on disk in the compact CSR format from `graph_format.py`
+together with the ETag the server reported for them. Every lookup sends a
+conditional request (`If-None-Match`); when the server answers
+`304 Not Modified` the graph is read from disk instead of being downloaded and
+parsed again.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from graph_format import CSRGraph, edges_to_csr, load_csr, save_csr
+
+
+@dataclass
+class CachedGraph:
+    """A graph fetched through `GraphCache`.
+
+    Can be passed wherever the client accepts a graph (e.g. `views.create`): like
+    a client `Graph`, it carries the graph's `namespace` and `path`.
+    """
+
+    namespace: str
+    path: str
+    etag: Optional[str]
+    csr: CSRGraph
+    meta: dict
+    from_cache: bool
+
+
+class GraphCache:
+    """On-disk cache of graphs keyed by namespace, path and server ETag."""
+
+    def __init__(self, directory: str = "./.graph_cache"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, namespace: str, path: str) -> tuple[str, str]:
+        key = hashlib.sha256(f"{namespace}/{path}".encode()).hexdigest()
+        base = os.path.join(self.directory, key)
+        return f"{base}.npz", f"{base}.json"
+
+    def get(self, db, path: str, namespace: Optional[str] = None) -> CachedGraph:
+        """Fetches graph `path` through `db`'s HTTP client, reusing the cached copy
+        if the server reports that it has not changed."""
+        namespace = namespace or db.namespace
+        csr_path, meta_path = self._paths(namespace, path)
+
+        cached_meta = None
+        if os.path.exists(csr_path) and os.path.exists(meta_path):
+            with open(meta_path) as fp:
+                cached_meta = json.load(fp)
+
+        headers = {}
+        if cached_meta is not None and cached_meta.get("etag"):
+            headers["If-None-Match"] = cached_meta["etag"]
+
+        response = db.client.get(f"/graphs/{namespace}/{path}", headers=headers)
+        if response.status_code == 304 and cached_meta is not None:
+            return CachedGraph(
+                namespace=namespace,
+                path=path,
+                etag=cached_meta["etag"],
+                csr=load_csr(csr_path),
+                meta=cached_meta["meta"],
+                from_cache=True,
+            )
+        response.raise_for_status()
+
+        graph_json = response.json()
+        csr = edges_to_csr(graph_json.pop("edges"))
+        etag = response.headers.get("ETag")
+
+        # Write to temporary paths first so an interrupted write never leaves a
+        # graph on disk that does not match its ETag.
+        save_csr(csr, f"{csr_path}.tmp")
+        with open(f"{meta_path}.tmp", "w") as fp:
+            json.dump({"etag": etag, "meta": graph_json}, fp)
+        os.replace(f"{csr_path}.tmp", csr_path)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+        return CachedGraph(
+            namespace=namespace,
+            path=path,
+            etag=etag,
+            csr=csr,
+            meta=graph_json,
+            from_cache=False,
+        )
@@ -0,0 +1,141 @@
+"""Compact CSR (compressed sparse row) interchange format for dual graphs.
+
+A graph is stored as three arrays in an `.npz` file:
+
+    * `geoids`    - string table of node geoids, indexed by node index.
+    * `offsets`   - int64 array of length `n_nodes + 1`; the neighbors of node
+                    `i` are `neighbors[offsets[i]:offsets[i + 1]]`.
+    * `neighbors` - int32 array of neighbor node indices (every undirected edge
+                    appears once in each direction).
+
+Loading a CSR file costs the size of these arrays rather than the several GB of
+Python objects an unpickled networkx graph takes for TX blocks. Edge attributes
+are not stored.
+
+Usage:
+
+    python graph_format.py ./TX_data/48_block_2010.pkl ./TX_data/48_block_2010.npz
+"""
+
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import click
+import numpy as np
+
+
+@dataclass
+class CSRGraph:
+    """An undirected graph in CSR form."""
+
+    geoids: np.ndarray
+    offsets: np.ndarray
+    neighbors: np.ndarray
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.geoids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.neighbors) // 2
+
+    def iter_edge_chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        """Yields `(k, 2)` arrays of node index pairs, each undirected edge once."""
+        sources = np.repeat(
+            np.arange(self.n_nodes, dtype=self.neighbors.dtype), np.diff(self.offsets)
+        )
+        mask = sources < self.neighbors
+        edges = np.column_stack((sources[mask], self.neighbors[mask]))
+        for start in range(0, len(edges), chunk_size):
+            yield edges[start : start + chunk_size]
+
+
+def graph_to_csr(graph, geoid_attr: Optional[str] = None) -> CSRGraph:
+    """Converts a networkx (or gerrychain) graph to CSR form.
+
+    Node geoids are the node labels, or the node attribute `geoid_attr` if given.
+    """
+    nodes = list(graph.nodes)
+    index = {node: idx for idx, node in enumerate(nodes)}
+
+    if geoid_attr is None:
+        geoids = [str(node) for node in nodes]
+    else:
+        geoids = [str(graph.nodes[node][geoid_attr]) for node in nodes]
+
+    offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    neighbors = []
+    for idx, node in enumerate(nodes):
+        node_neighbors = sorted(index[neighbor] for neighbor in graph.adj[node])
+        neighbors.extend(node_neighbors)
+        offsets[idx + 1] = offsets[idx] + len(node_neighbors)
+
+    return CSRGraph(
+        geoids=np.array(geoids, dtype=str),
+        offsets=offsets,
+        neighbors=np.array(neighbors, dtype=np.int32),
+    )
+
+
+def edges_to_csr(edges: list) -> CSRGraph:
+    """Builds a CSR graph from `(geoid_u, geoid_v, ...)` edge records.
+
+    Only nodes that appear in at least one edge are included.
+    """
+    endpoints = np.array([(edge[0], edge[1]) for edge in edges], dtype=str).reshape(
+        -1, 2
+    )
+    geoids, node_idx = np.unique(endpoints, return_inverse=True)
+    node_idx = node_idx.reshape(-1, 2).astype(np.int32)
+
+    sources = np.concatenate((node_idx[:, 0], node_idx[:, 1]))
+    targets = np.concatenate((node_idx[:, 1], node_idx[:, 0]))
+    order = np.lexsort((targets, sources))
+
+    offsets = np.zeros(len(geoids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(geoids)), out=offsets[1:])
+
+    return CSRGraph(geoids=geoids, offsets=offsets, neighbors=targets[order])
+
+
+def save_csr(csr: CSRGraph, path: str) -> None:
+    """Writes a CSR graph to an `.npz` file."""
+    with open(path, "wb") as fp:
+        np.savez(
+            fp, geoids=csr.geoids, offsets=csr.offsets, neighbors=csr.neighbors
+        )
+
+
+def load_csr(path: str) -> CSRGraph:
+    """Reads a CSR graph written by `save_csr` (without unpickling anything)."""
+    with np.load(path, allow_pickle=False) as arrays:
+        return CSRGraph(
+            geoids=arrays["geoids"],
+            offsets=arrays["offsets"],
+            neighbors=arrays["neighbors"],
+        )
+
+
+@click.command()
+@click.argument("pickle_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("csr_file", type=click.Path(dir_okay=False))
+@click.option(
+    "--geoid-attr",
+    default=None,
+    help="Node attribute holding the geoid (defaults to the node label).",
+)
+def main(pickle_file, csr_file, geoid_attr):
+    """Converts a pickled graph to the CSR format."""
+    import pickle
+
+    with open(pickle_file, "rb") as f:
+        graph = pickle.load(f)
+
+    csr = graph_to_csr(graph, geoid_attr=geoid_attr)
+    save_csr(csr, csr_file)
+    print(f"Wrote {csr.n_nodes} nodes and {csr.n_edges} edges to {csr_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 """Imports base Census geographies."""
 
+import json
 import logging
 import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime, timezone
+from typing import Optional
 import geopandas as gpd
+import pyarrow.parquet as pq
 import shapely.wkb
 import yaml
 from gerrydb import GerryDB
@@ -15,12 +22,24 @@ from gerrydb_etl.bootstrap.pl_config import (
     MissingDataset,
 )
 from jinja2 import Template
-from shapely import Point
 import geopandas as gpd
 import click
 
+from benchmark import PhaseTimer
+from checkpoint import LoadManifest
+from geo_encoding import quantize
+from preprocess import (
+    PreprocessCache,
+    cache_key,
+    file_sha256,
+    merge_res_trust_collisions,
+    sanitize_paths,
+)
+
 try:
-    from gerrydb_meta import crud
+    from gerrydb_etl.db import DirectTransactionContext
+    from gerrydb_meta import crud, models
+    from sqlalchemy import create_engine, insert, text, update
 except ImportError:
     crud = None
 
@@ -60,51 +79,21 @@ LAYER_URLS = {
 }
 
 
-def load_geo(
+def prepare_layer(
     fips: str,
     level: str,
     year: str,
-    namespace: str,
     layer_gdf: gpd.GeoDataFrame,
-    layer_hash: str,
-):
-    """Imports base Census geographies.
+) -> tuple[gpd.GeoDataFrame, dict]:
+    """Cleans a raw Census layer into a load-ready frame indexed by geoid.
 
-    Preconditions:
-        * A `Locality` aliased to `fips` exists.
-        * `namespace` exists.
-        * A `GeoLayer` with path `<level>/<year>` exists in the namespace.
+    Returns the prepared layer and a mapping from county FIPS code to the
+    geoids in that county (empty for layers without a county column).
     """
-    log.info(f"LOADING GEO FOR {fips} {level} {year}")
-
-    # Some geographies have a '/' in the geoid, which will mess up the path, so we remove it
-    # and replace all instances of '/' with '--' in the dataframe
-    try:
-        layer_gdf = layer_gdf.applymap(
-            lambda x: x.replace("/", "--") if isinstance(x, str) else x
-        )
-    except Exception as e:
-        if "Unable to avoid copy" in str(e):
-            log.error("Bad version of Numpy installed. Downgrade to 1.26.4")
-        raise RuntimeError
-
-    if MissingDataset(fips=fips, level=level, year=year) in MISSING_DATASETS:
-        log.warning("Dataset not published by Census. Nothing to do.")
-        exit()
-
-    if os.getenv("GERRYDB_BULK_IMPORT") and crud is None:
-        raise RuntimeError("gerrydb_meta must be available in bulk import mode.")
-
-    db = GerryDB(namespace=namespace)
-    root_loc = db.localities[fips]
-    layer = db.geo_layers[level]
-
-    with open(COLUMN_CONFIG_PATH) as config_fp:
-        config_template = Template(config_fp.read())
-    rendered_config = config_template.render(yr=year[2:], year=year)
-    config = TabularConfig(**yaml.safe_load(rendered_config))
+    # Some geographies have a '/' in the geoid, which will mess up the path, so we
+    # replace all instances of '/' with '--' in the string columns of the dataframe
+    layer_gdf = sanitize_paths(layer_gdf)
 
-    layer_url = LAYER_URLS[f"{level}/{year}"].format(fips=fips)
     index_col = "GEOID" + year[2:]
     county_col = "COUNTYFP" + year[2:]
 
@@ -130,66 +119,26 @@ def load_geo(
         # remove the r,t that stands for reservation, trust which only appears
         # at geo level, but not in pop data
         if level == "aiannh":
-
-            def categorize_trust_res(x):
-                if x[-1].lower() == "t":
-                    return "trust"
-                elif x[-1].lower() == "r":
-                    return "reservation"
-                else:
-                    raise ValueError(f"Not a trust or reservation at geoid {x}")
-
-            layer_gdf["res_trust_class"] = layer_gdf[index_col].apply(
-                lambda x: categorize_trust_res(x)
+            res_trust_class = (
+                layer_gdf[index_col]
+                .str[-1]
+                .str.lower()
+                .map({"t": "trust", "r": "reservation"})
             )
-            layer_gdf[index_col] = layer_gdf[index_col].apply(
-                lambda x: f"{level}:" + x.rstrip("rtRT") + f":fips{fips}"
+            if res_trust_class.isna().any():
+                bad_geoid = layer_gdf.loc[res_trust_class.isna(), index_col].iloc[0]
+                raise ValueError(f"Not a trust or reservation at geoid {bad_geoid}")
+
+            layer_gdf["res_trust_class"] = res_trust_class
+            layer_gdf[index_col] = (
+                f"{level}:" + layer_gdf[index_col].str.rstrip("rtRT") + f":fips{fips}"
             )
             yr = year[2:]
 
             # if there was a geoid with both an R and T tag
-            if len(layer_gdf[index_col]) != len(set(layer_gdf[index_col])):
-                new_rows = {}
-
-                for row, data in layer_gdf.iterrows():
-                    if data[index_col] not in new_rows:
-                        new_rows[data[index_col]] = data
-                        new_rows[data[index_col]]["collision_count"] = 0
+            if layer_gdf[index_col].duplicated().any():
+                layer_gdf = merge_res_trust_collisions(layer_gdf, index_col, yr)
 
-                    # if geoid already exists, indicates R/T collision
-                    else:
-                        new_rows[data[index_col]]["collision_count"] += 1
-                        if new_rows[data[index_col]]["collision_count"] > 1:
-                            raise ValueError(
-                                f"There has been a collision of 3 geoids {data[index_col]}"
-                            )
-
-                        # add land and water, change res/trust class, union geometry
-                        new_rows[data[index_col]][f"ALAND{yr}"] += data[f"ALAND{yr}"]
-                        new_rows[data[index_col]][f"AWATER{yr}"] += data[f"AWATER{yr}"]
-                        new_rows[data[index_col]]["res_trust_class"] = "union"
-                        new_rows[data[index_col]]["geometry"] = shapely.unary_union(
-                            [new_rows[data[index_col]]["geometry"], data["geometry"]]
-                        )
-
-                        if new_rows[data[index_col]][f"NAME{yr}"] != data[f"NAME{yr}"]:
-                            if data[index_col] in [
-                                "aiannh:1075:fips32",
-                                "aiannh:1070:fips32",
-                            ]:
-                                # the Fallon Paiute-Shoshone name has an extra (Reservation/Colony) appended
-                                pass
-                            else:
-                                print("geoid", (data[index_col]))
-                                print("name 1", new_rows[data[index_col]][f"NAME{yr}"])
-                                print("name 2", data[f"NAME{yr}"])
-                                raise ValueError(
-                                    f"NAME{yr} does not match across R and T land in geoid {data[index_col]}"
-                                )
-
-                layer_gdf = gpd.GeoDataFrame.from_dict(
-                    new_rows, orient="index"
-                ).set_crs(layer_gdf.crs)
             layer_gdf = layer_gdf[
                 [
                     f"NAME{yr}",
@@ -210,18 +159,89 @@ def load_geo(
 
     layer_gdf = layer_gdf.set_index(index_col)
 
+    # A geometry column (rather than an object column of points), so that it
+    # survives the preprocessing cache's Feather round trip.
+    layer_gdf["internal_point"] = gpd.points_from_xy(
+        layer_gdf[f"INTPTLON{year[2:]}"].astype(float),
+        layer_gdf[f"INTPTLAT{year[2:]}"].astype(float),
+        crs=layer_gdf.crs,
+    )
+
+    return layer_gdf, geos_by_county
+
+
+def iter_layer_batches(file: str, batch_size: int):
+    """Yields GeoDataFrames of at most `batch_size` rows read from a GeoParquet file.
+
+    Only one Arrow record batch (plus its decoded geometries) is held in memory
+    at a time.
+    """
+    parquet_file = pq.ParquetFile(file)
+    geo_metadata = json.loads(parquet_file.schema_arrow.metadata[b"geo"])
+    geometry_col = geo_metadata["primary_column"]
+    # GeoParquet defines a missing CRS as OGC:CRS84.
+    crs = geo_metadata["columns"][geometry_col].get("crs", "OGC:CRS84")
+
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        batch_df = batch.to_pandas()
+        batch_df[geometry_col] = gpd.GeoSeries.from_wkb(batch_df[geometry_col], crs=crs)
+        yield gpd.GeoDataFrame(batch_df, geometry=geometry_col, crs=crs)
+
+
+def load_geo(
+    fips: str,
+    level: str,
+    year: str,
+    namespace: str,
+    layer_gdf: gpd.GeoDataFrame,
+    layer_hash: str,
+    bulk_map: bool = False,
+    user_email: Optional[str] = None,
+    phase_results: Optional[str] = None,
+    geos_by_county: Optional[dict] = None,
+    grid_size: Optional[float] = None,
+):
+    """Imports base Census geographies.
+
+    When `bulk_map` is set, the county localities are mapped with
+    `map_localities_bulk` instead of one API call per county; the geographies
+    are loaded through the API either way. The time spent mapping localities is
+    appended to `phase_results`, with the `grid_size` the geometries were
+    quantized to.
+
+    When `geos_by_county` is given, `layer_gdf` has already been through
+    `prepare_layer` (e.g. it was read from the preprocessing cache).
+
+    Preconditions:
+        * A `Locality` aliased to `fips` exists.
+        * `namespace` exists.
+        * A `GeoLayer` with path `<level>/<year>` exists in the namespace.
+    """
+    log.info(f"LOADING GEO FOR {fips} {level} {year}")
+
+    if MissingDataset(fips=fips, level=level, year=year) in MISSING_DATASETS:
+        log.warning("Dataset not published by Census. Nothing to do.")
+        exit()
+
+    if os.getenv("GERRYDB_BULK_IMPORT") and crud is None:
+        raise RuntimeError("gerrydb_meta must be available in bulk import mode.")
+
+    db = GerryDB(namespace=namespace)
+    root_loc = db.localities[fips]
+    layer = db.geo_layers[level]
+
+    config = load_column_config(year)
+    layer_url = LAYER_URLS[f"{level}/{year}"].format(fips=fips)
+
+    if geos_by_county is None:
+        layer_gdf, geos_by_county = prepare_layer(fips, level, year, layer_gdf)
+
     columns = {
         col.source: db.columns[col.target]
         for col in config.columns
         if col.source in layer_gdf.columns
     }
 
-    internal_latitudes = layer_gdf[f"INTPTLAT{year[2:]}"].apply(float)
-    internal_longitudes = layer_gdf[f"INTPTLON{year[2:]}"].apply(float)
-    layer_gdf["internal_point"] = [
-        Point(long, lat) for long, lat in zip(internal_longitudes, internal_latitudes)
-    ]
-
     import_notes = (
         f"Loaded by ETL script pl_geo.py from {year} U.S. Census {level} "
         f"shapefile {layer_url} (SHA256: {layer_hash})"
@@ -237,29 +257,654 @@ def load_geo(
             layer=layer,
         )
 
+        if bulk_map:
+            map_localities_bulk(
+                namespace,
+                level,
+                fips,
+                geos_by_county,
+                import_notes,
+                user_email,
+                phase_results,
+                grid_size,
+            )
+        else:
+            map_localities(ctx, layer, fips, geos_by_county, phase_results, grid_size)
+
+
+def load_geo_streaming(
+    fips: str,
+    level: str,
+    year: str,
+    namespace: str,
+    file: str,
+    layer_hash: str,
+    batch_size: int,
+    bulk_map: bool = False,
+    user_email: Optional[str] = None,
+    phase_results: Optional[str] = None,
+    grid_size: Optional[float] = None,
+):
+    """Imports base Census geographies from `file` in batches of `batch_size` rows.
+
+    All batches are loaded inside a single import context, so the import is still
+    all-or-nothing, but the client only ever holds one batch of geometries in
+    memory. Batches are loaded without a locality: the state and county locality
+    mappings are accumulated across batches and created once all geographies are
+    loaded (mapping per batch would replace the state's geography set with the
+    last batch). With `bulk_map`, the counties are mapped as in `load_geo`.
+
+    Auxiliary levels are not supported, as R/T collisions in AIANNH geographies
+    can only be merged with the whole layer in memory.
+    """
+    log.info(f"STREAMING GEO FOR {fips} {level} {year} IN BATCHES OF {batch_size}")
+
+    if level in AUXILIARY_LEVELS:
+        raise ValueError(f'Streaming import is not supported for level "{level}".')
+
+    if MissingDataset(fips=fips, level=level, year=year) in MISSING_DATASETS:
+        log.warning("Dataset not published by Census. Nothing to do.")
+        exit()
+
+    if os.getenv("GERRYDB_BULK_IMPORT") and crud is None:
+        raise RuntimeError("gerrydb_meta must be available in bulk import mode.")
+
+    db = GerryDB(namespace=namespace)
+    root_loc = db.localities[fips]
+    layer = db.geo_layers[level]
+
+    config = load_column_config(year)
+    layer_url = LAYER_URLS[f"{level}/{year}"].format(fips=fips)
+    n_total = pq.ParquetFile(file).metadata.num_rows
+
+    import_notes = (
+        f"Loaded by ETL script pl_geo.py from {year} U.S. Census {level} "
+        f"shapefile {layer_url} (SHA256: {layer_hash})"
+    )
+
+    columns = None
+    loaded_geoids = set()
+    geos_by_county = defaultdict(list)
+    n_loaded = 0
+    t_start = time.perf_counter()
+
+    with db.context(notes=import_notes) as ctx:
+        for batch_idx, batch_gdf in enumerate(iter_layer_batches(file, batch_size)):
+            t_batch_start = time.perf_counter()
+            batch_gdf, batch_geos_by_county = prepare_layer(
+                fips, level, year, batch_gdf
+            )
+            if grid_size:
+                batch_gdf.geometry = quantize(batch_gdf.geometry.values, grid_size)
+
+            # `drop_duplicates` only sees one batch at a time, so duplicate rows
+            # split across batches are caught by geoid here.
+            duplicated = batch_gdf.index.isin(loaded_geoids)
+            if duplicated.any():
+                log.info(f"\tDropped {duplicated.sum()} duplicate rows")
+                batch_gdf = batch_gdf[~duplicated]
+
+            if columns is None:
+                columns = {
+                    col.source: db.columns[col.target]
+                    for col in config.columns
+                    if col.source in batch_gdf.columns
+                }
+
+            ctx.load_dataframe(df=batch_gdf, columns=columns, create_geo=True)
+
+            loaded_geoids.update(batch_gdf.index)
+            for county_fips, county_geos in batch_geos_by_county.items():
+                geos_by_county[county_fips].extend(
+                    geo for geo in county_geos if geo in batch_gdf.index
+                )
+            n_loaded += len(batch_gdf)
+            log.info(
+                f"\tBatch {batch_idx + 1}: loaded {len(batch_gdf)} geographies "
+                f"in {time.perf_counter() - t_batch_start:.1f} s "
+                f"({n_loaded}/{n_total} rows, "
+                f"{time.perf_counter() - t_start:.1f} s elapsed)"
+            )
+
+        ctx.geo_layers.map_locality(
+            layer=layer, locality=root_loc, geographies=list(loaded_geoids)
+        )
+        if bulk_map:
+            map_localities_bulk(
+                namespace,
+                level,
+                fips,
+                geos_by_county,
+                import_notes,
+                user_email,
+                phase_results,
+                grid_size,
+            )
+        else:
+            map_localities(ctx, layer, fips, geos_by_county, phase_results, grid_size)
+
+
+def map_localities(
+    ctx,
+    layer,
+    fips: str,
+    geos_by_county: dict,
+    phase_results: Optional[str] = None,
+    grid_size: Optional[float] = None,
+):
+    """Maps geographies to their county localities with one API call per county."""
+    with PhaseTimer(
+        "geo_map_localities",
+        phase_results,
+        counties=len(geos_by_county),
+        grid_size=grid_size,
+    ) as timer:
         for county_fips, county_geos in geos_by_county.items():
             full_fips = fips + county_fips
             ctx.geo_layers.map_locality(
                 layer=layer, locality=full_fips, geographies=county_geos
             )
+    log.info(
+        f"\tMapped {len(geos_by_county)} counties in {timer.record['wall_s']:.1f} s"
+    )
+
+
+def map_localities_bulk(
+    namespace: str,
+    level: str,
+    fips: str,
+    geos_by_county: dict,
+    import_notes: str,
+    user_email: Optional[str] = None,
+    phase_results: Optional[str] = None,
+    grid_size: Optional[float] = None,
+):
+    """Maps geographies to their county localities in bulk, straight against the
+    database in a `DirectTransactionContext`.
+
+    The current `GeoSetVersion` of every county is retired and new versions are
+    created in one insert. All memberships are then inserted with a single
+    `INSERT ... SELECT` over unnested arrays of set versions and geography paths,
+    resolving the geographies by path in the database.
+    """
+    if crud is None:
+        raise RuntimeError("gerrydb_meta must be available for bulk locality mapping.")
+
+    set_versions = models.GeoSetVersion.__table__
+    members_table = models.GeoSetMember.__table__.fullname
+    geography_table = models.Geography.__table__.fullname
+
+    with PhaseTimer(
+        "geo_map_localities_bulk",
+        phase_results,
+        counties=len(geos_by_county),
+        grid_size=grid_size,
+    ) as timer, DirectTransactionContext(
+        notes=f"{import_notes} [counties]", email=user_email
+    ) as ctx:
+        namespace_obj = crud.namespace.get(db=ctx.db, path=namespace)
+        assert namespace_obj is not None
+        layer_obj = crud.geo_layer.get(db=ctx.db, path=level, namespace=namespace_obj)
+        assert layer_obj is not None
+
+        loc_ids = {}
+        for county_fips in geos_by_county:
+            loc = crud.locality.get_by_ref(db=ctx.db, path=fips + county_fips)
+            if loc is None:
+                raise ValueError(f'Locality "{fips + county_fips}" not found.')
+            loc_ids[county_fips] = loc.loc_id
+
+        now = datetime.now(timezone.utc)
+        ctx.db.execute(
+            update(set_versions)
+            .where(
+                set_versions.c.layer_id == layer_obj.layer_id,
+                set_versions.c.loc_id.in_(loc_ids.values()),
+                set_versions.c.valid_to.is_(None),
+            )
+            .values(valid_to=now)
+        )
+        new_versions = ctx.db.execute(
+            insert(set_versions)
+            .values(
+                [
+                    {
+                        "layer_id": layer_obj.layer_id,
+                        "loc_id": loc_id,
+                        "meta_id": ctx.meta.meta_id,
+                        "valid_from": now,
+                    }
+                    for loc_id in loc_ids.values()
+                ]
+            )
+            .returning(set_versions.c.set_version_id, set_versions.c.loc_id)
+        )
+        set_version_ids = {row.loc_id: row.set_version_id for row in new_versions}
+
+        member_set_versions = [
+            set_version_ids[loc_ids[county_fips]]
+            for county_fips, county_geos in geos_by_county.items()
+            for _ in county_geos
+        ]
+        member_paths = [path for geos in geos_by_county.values() for path in geos]
+        result = ctx.db.execute(
+            text(
+                f"""
+                INSERT INTO {members_table} (set_version_id, geo_id)
+                SELECT m.set_version_id, g.geo_id
+                FROM unnest(
+                    CAST(:set_version_ids AS integer[]), CAST(:paths AS text[])
+                ) AS m(set_version_id, path)
+                JOIN {geography_table} g
+                    ON g.path = m.path AND g.namespace_id = :namespace_id
+                """
+            ),
+            {
+                "set_version_ids": member_set_versions,
+                "paths": member_paths,
+                "namespace_id": namespace_obj.namespace_id,
+            },
+        )
+        if result.rowcount < len(member_paths):
+            raise ValueError(
+                f"Cannot map localities ({len(member_paths) - result.rowcount} "
+                "geographies not loaded)."
+            )
+
+    log.info(
+        f"\tBulk mapped {len(member_paths)} geographies to "
+        f"{len(geos_by_county)} counties in {timer.record['wall_s']:.1f} s"
+    )
+
+
+def existing_geographies(namespace: str, paths: list) -> set:
+    """Returns the subset of `paths` that already exist in `namespace`.
+
+    A read-only lookup straight against the database (`GERRYDB_DATABASE_URI`),
+    used to skip geographies committed by an earlier, interrupted load.
+    """
+    if crud is None:
+        raise RuntimeError("gerrydb_meta must be available to look up geographies.")
+
+    namespace_table = models.Namespace.__table__.fullname
+    geography_table = models.Geography.__table__.fullname
+    engine = create_engine(os.environ["GERRYDB_DATABASE_URI"])
+    with engine.connect() as conn:
+        result = conn.execute(
+            text(
+                f"""
+                SELECT g.path
+                FROM unnest(:paths) AS p(path)
+                JOIN {geography_table} g ON g.path = p.path
+                WHERE g.namespace_id = (
+                    SELECT namespace_id FROM {namespace_table} WHERE path = :namespace
+                )
+                """
+            ),
+            {"paths": list(paths), "namespace": namespace},
+        )
+        existing = {row.path for row in result}
+    engine.dispose()
+    return existing
+
+
+def _load_shard(
+    namespace: str,
+    fips: str,
+    level: str,
+    county_fips: Optional[str],
+    shard_gdf: gpd.GeoDataFrame,
+    column_targets: dict,
+    import_notes: str,
+    skip_geos: frozenset = frozenset(),
+) -> int:
+    """Loads and maps the geographies of a single shard (run in a worker process).
+
+    A shard is a county, mapped to its county locality, or a chunk of rows for
+    layers without counties. The state locality is not mapped here (that would
+    replace its geography set with this shard), but by `load_geo_parallel` once
+    all shards are in. Each shard is loaded in its own import context, which is
+    not a transaction: `load_dataframe` commits the geographies before they are
+    mapped, so a shard that fails while mapping leaves its geographies behind.
+    Geographies in `skip_geos` already exist and are only mapped, not loaded.
+    """
+    db = GerryDB(namespace=namespace)
+    layer = db.geo_layers[level]
+    columns = {source: db.columns[target] for source, target in column_targets.items()}
+    load_gdf = shard_gdf[~shard_gdf.index.isin(skip_geos)] if skip_geos else shard_gdf
+    shard_name = f"county {county_fips}" if county_fips else "chunk"
+
+    with db.context(notes=f"{import_notes} [{shard_name}]") as ctx:
+        if len(load_gdf):
+            ctx.load_dataframe(df=load_gdf, columns=columns, create_geo=True)
+        if county_fips is not None:
+            ctx.geo_layers.map_locality(
+                layer=layer,
+                locality=fips + county_fips,
+                geographies=list(shard_gdf.index),
+            )
+    return len(load_gdf)
+
+
+def load_geo_parallel(
+    fips: str,
+    level: str,
+    year: str,
+    namespace: str,
+    layer_gdf: gpd.GeoDataFrame,
+    layer_hash: str,
+    workers: int,
+    retries: int = 2,
+    prepared: bool = False,
+    manifest: Optional[LoadManifest] = None,
+    chunk_size: int = 10_000,
+):
+    """Imports base Census geographies sharded by county on a pool of `workers`.
+
+    Every county is loaded and mapped to its locality by a worker process in its
+    own import context. Layers without a county column are sharded into chunks
+    of `chunk_size` rows instead. A shard that fails is resubmitted up to
+    `retries` times; shards that still fail are reported together at the end.
+    Unlike `load_geo` the import is not all-or-nothing: shards that succeeded
+    stay loaded. The state locality is mapped to the whole layer once every
+    shard has succeeded.
+
+    A failed shard may have committed some of its geographies (see
+    `_load_shard`), so they are looked up again before every retry and only
+    mapped. The lookup needs direct database access (gerrydb_meta and
+    `GERRYDB_DATABASE_URI`); without it, retrying a shard that failed after
+    loading its geographies fails on the duplicates.
+
+    When `manifest` is given, every committed shard is recorded in it and shards
+    already recorded are skipped, so an interrupted import can be resumed. With
+    direct database access, geographies that already exist (e.g. committed
+    just before a crash) are not loaded again.
+
+    When `prepared` is set, `layer_gdf` has already been through `prepare_layer`.
+    """
+    log.info(f"LOADING GEO FOR {fips} {level} {year} WITH {workers} WORKERS")
+
+    if MissingDataset(fips=fips, level=level, year=year) in MISSING_DATASETS:
+        log.warning("Dataset not published by Census. Nothing to do.")
+        exit()
+
+    if os.getenv("GERRYDB_BULK_IMPORT") and crud is None:
+        raise RuntimeError("gerrydb_meta must be available in bulk import mode.")
+
+    db = GerryDB(namespace=namespace)
+    config = load_column_config(year)
+    layer_url = LAYER_URLS[f"{level}/{year}"].format(fips=fips)
+
+    if not prepared:
+        layer_gdf, _ = prepare_layer(fips, level, year, layer_gdf)
+
+    column_targets = {
+        col.source: col.target
+        for col in config.columns
+        if col.source in layer_gdf.columns
+    }
+    # Resolve the columns once up front so a bad config fails before any work starts.
+    for target in column_targets.values():
+        db.columns[target]
+
+    import_notes = (
+        f"Loaded by ETL script pl_geo.py from {year} U.S. Census {level} "
+        f"shapefile {layer_url} (SHA256: {layer_hash})"
+    )
+
+    # Shards are keyed by unit name ("county:<fips>" or "rows:<start>-<end>").
+    county_col = "COUNTYFP" + year[2:]
+    if county_col in layer_gdf.columns:
+        shards = {
+            f"county:{county}": (county, shard)
+            for county, shard in layer_gdf.groupby(county_col)
+        }
+    else:
+        shards = {
+            f"rows:{start}-{start + len(shard)}": (None, shard)
+            for start in range(0, len(layer_gdf), chunk_size)
+            for shard in [layer_gdf.iloc[start : start + chunk_size]]
+        }
+
+    direct_lookup = crud is not None and bool(os.getenv("GERRYDB_DATABASE_URI"))
+    existing = set()
+    if manifest is not None:
+        n_skipped = sum(unit in manifest for unit in shards)
+        shards = {unit: s for unit, s in shards.items() if unit not in manifest}
+        log.info(
+            f"\tResuming from {manifest.path}: skipping {n_skipped} committed "
+            f"shards, {len(shards)} left"
+        )
+        if direct_lookup:
+            existing = existing_geographies(
+                namespace, [geo for _, shard in shards.values() for geo in shard.index]
+            )
+            if existing:
+                log.info(f"\t{len(existing)} geographies already exist")
+        else:
+            log.info(
+                "\tNo direct database access (gerrydb_meta and GERRYDB_DATABASE_URI); "
+                "skipping committed shards only"
+            )
+
+    attempts = {unit: 0 for unit in shards}
+    failed = {}
+    n_loaded = 0
+    n_total = sum(len(shard) for _, shard in shards.values())
+    t_start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+
+        def submit(unit):
+            attempts[unit] += 1
+            county_fips, shard = shards[unit]
+            if attempts[unit] > 1 and direct_lookup:
+                # Geographies committed by the failed attempt are only mapped.
+                existing.update(existing_geographies(namespace, list(shard.index)))
+            return pool.submit(
+                _load_shard,
+                namespace,
+                fips,
+                level,
+                county_fips,
+                shard,
+                column_targets,
+                import_notes,
+                frozenset(existing.intersection(shard.index)),
+            )
+
+        pending = {}
+        for unit, (_, shard) in shards.items():
+            if existing.issuperset(shard.index):
+                manifest.mark_done(unit, rows=0, existing=len(shard))
+                continue
+            pending[submit(unit)] = unit
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = pending.pop(future)
+                try:
+                    n_shard = future.result()
+                except Exception as e:
+                    if attempts[unit] <= retries:
+                        log.warning(
+                            f"\tShard {unit} failed (attempt {attempts[unit]}), "
+                            f"retrying: {e}"
+                        )
+                        pending[submit(unit)] = unit
+                    else:
+                        failed[unit] = e
+                    continue
+
+                n_loaded += n_shard
+                if manifest is not None:
+                    manifest.mark_done(unit, rows=n_shard)
+                log.info(
+                    f"\tShard {unit}: loaded {n_shard} geographies "
+                    f"({n_loaded}/{n_total} rows, "
+                    f"{time.perf_counter() - t_start:.1f} s elapsed)"
+                )
+
+    if failed:
+        resume = f" Rerun to resume from {manifest.path}." if manifest else ""
+        raise RuntimeError(
+            f"Failed to load {len(failed)} shards after {retries} retries: "
+            + ", ".join(f"{unit} ({e})" for unit, e in sorted(failed.items()))
+            + resume
+        )
+
+    with db.context(notes=f"{import_notes} [state]") as ctx:
+        ctx.geo_layers.map_locality(
+            layer=db.geo_layers[level],
+            locality=db.localities[fips],
+            geographies=list(layer_gdf.index),
+        )
+
+
+def read_prepared_layer(
+    fips: str,
+    level: str,
+    year: str,
+    file: str,
+    layer_hash: str,
+    cache: PreprocessCache,
+) -> tuple[gpd.GeoDataFrame, dict]:
+    """Reads and prepares a layer, reusing the preprocessing cache when possible.
+
+    Entries are keyed by the layer's SHA256 (from its file name), level, year
+    and the contents of the column config.
+    """
+    key = cache_key(
+        "geo",
+        layer_hash,
+        fips=fips,
+        level=level,
+        year=year,
+        config=file_sha256(COLUMN_CONFIG_PATH),
+    )
+    cached = cache.get(key)
+    if cached is not None:
+        log.info(f"Using cached preprocessed layer {key}")
+        layer_gdf, extras = cached
+        return layer_gdf, extras["geos_by_county"]
+
+    layer_gdf, geos_by_county = prepare_layer(
+        fips, level, year, gpd.read_parquet(file)
+    )
+    cache.put(key, layer_gdf, {"geos_by_county": geos_by_county})
+    return layer_gdf, geos_by_county
+
+
+def load_column_config(year: str) -> TabularConfig:
+    """Renders the geographic column configuration for a Census vintage."""
+    with open(COLUMN_CONFIG_PATH) as config_fp:
+        config_template = Template(config_fp.read())
+    rendered_config = config_template.render(yr=year[2:], year=year)
+    return TabularConfig(**yaml.safe_load(rendered_config))
 
 
 @click.command()
 @click.option("--large", type=int, help="Run on large data set.")
 @click.option("--extreme", type=int, help="Run on extreme data set.")
-def main(large, extreme):
+@click.option(
+    "--batch-size",
+    type=int,
+    default=None,
+    help="Stream the parquet file and load geographies in batches of this many "
+    "rows (bounded client memory). Loads the whole file at once when not set.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="Load counties concurrently on this many worker processes.",
+)
+@click.option(
+    "--retries",
+    type=int,
+    default=2,
+    show_default=True,
+    help="Times a failed county is retried when loading with --workers "
+    "(geographies it already committed are looked up and skipped when "
+    "GERRYDB_DATABASE_URI is set).",
+)
+@click.option(
+    "--bulk-map",
+    is_flag=True,
+    help="Map geographies to county localities in one bulk database statement "
+    "instead of one API call per county (geographies are still loaded through "
+    "the API).",
+)
+@click.option(
+    "--phase-results",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="JSON lines phase results file to append the locality mapping time to.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Cache the preprocessed layer in this directory (keyed by the input's "
+    "SHA256) and reuse it on later runs. Not used with --batch-size.",
+)
+@click.option(
+    "--cache-max-gb",
+    type=float,
+    default=20,
+    show_default=True,
+    help="Evict least recently used cache entries beyond this size.",
+)
+@click.option(
+    "--file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Layer file, named <fips>_<level>_<year>--<sha256>.parquet "
+    "(overrides --large/--extreme).",
+)
+@click.option(
+    "--grid-size",
+    type=float,
+    default=None,
+    help="Quantize geometry coordinates to this grid size (in degrees) before "
+    "uploading, e.g. 1e-7 (about 1 cm).",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Commit county by county (chunks of rows for layers without counties), "
+    "recording progress in this JSON manifest; rerunning with the same manifest "
+    "skips committed shards and existing geographies.",
+)
+def main(
+    large,
+    extreme,
+    batch_size,
+    workers,
+    retries,
+    bulk_map,
+    phase_results,
+    cache_dir,
+    cache_max_gb,
+    file,
+    grid_size,
+    checkpoint,
+):
 
     # convert int to bool
     large = large == 1
     extreme = extreme == 1
 
-    file = "./WY_data/56_county_2010--707029ed009370e99b66c9f83300bdb6f2fe936f97be8bcb6de127a06a123d1b.parquet"
+    if file is None:
+        file = "./WY_data/56_county_2010--707029ed009370e99b66c9f83300bdb6f2fe936f97be8bcb6de127a06a123d1b.parquet"
 
-    if large:
-        file = "./WY_data/56_block_2010--ef36f7336669e0ef5a758b8fba0441ac1dfb8cfc531ad4ee14731480039c708b.parquet"
+        if large:
+            file = "./WY_data/56_block_2010--ef36f7336669e0ef5a758b8fba0441ac1dfb8cfc531ad4ee14731480039c708b.parquet"
 
-    if extreme:
-        file = "./TX_data/48_block_2010--167bc0750535ffae8f14dd3e58d921a8439fcedd86b5fe576cbe82d7eb8f8d80.parquet"
+        if extreme:
+            file = "./TX_data/48_block_2010--167bc0750535ffae8f14dd3e58d921a8439fcedd86b5fe576cbe82d7eb8f8d80.parquet"
 
     file_name = os.path.basename(file)
     fips = file_name.split("_")[0]
@@ -269,13 +914,102 @@ def main(large, extreme):
     namespace = f"census.{year}"
 
     print("\t", fips, level, year, layer_hash)
-    layer_gdf = gpd.read_parquet(file)
+
+    if batch_size is not None and workers is not None:
+        raise click.UsageError("--batch-size and --workers cannot be combined.")
+    if bulk_map and workers is not None:
+        raise click.UsageError(
+            "--bulk-map cannot be combined with --workers "
+            "(each worker maps its own county)."
+        )
+    if checkpoint is not None and (batch_size is not None or bulk_map):
+        raise click.UsageError(
+            "--checkpoint cannot be combined with --batch-size or --bulk-map "
+            "(each shard is committed and mapped on its own)."
+        )
 
     try:
-        load_geo(fips, level, year, namespace, layer_gdf, layer_hash)
+        if batch_size is not None:
+            load_geo_streaming(
+                fips,
+                level,
+                year,
+                namespace,
+                file,
+                layer_hash,
+                batch_size,
+                bulk_map=bulk_map,
+                user_email="test@test.com",
+                phase_results=phase_results,
+                grid_size=grid_size,
+            )
+        else:
+            geos_by_county = None
+            if cache_dir is not None:
+                cache = PreprocessCache(cache_dir, max_bytes=int(cache_max_gb * 2**30))
+                layer_gdf, geos_by_county = read_prepared_layer(
+                    fips, level, year, file, layer_hash, cache
+                )
+            else:
+                layer_gdf = gpd.read_parquet(file)
+
+            if grid_size:
+                layer_gdf.geometry = quantize(layer_gdf.geometry.values, grid_size)
+
+            if checkpoint is not None:
+                manifest = LoadManifest(
+                    checkpoint,
+                    {
+                        "loader": "geo",
+                        "file": file_name,
+                        "namespace": namespace,
+                        "grid_size": grid_size,
+                    },
+                )
+                load_geo_parallel(
+                    fips,
+                    level,
+                    year,
+                    namespace,
+                    layer_gdf,
+                    layer_hash,
+                    workers or 1,
+                    retries,
+                    prepared=geos_by_county is not None,
+                    manifest=manifest,
+                )
+            elif workers is not None:
+                load_geo_parallel(
+                    fips,
+                    level,
+                    year,
+                    namespace,
+                    layer_gdf,
+                    layer_hash,
+                    workers,
+                    retries,
+                    prepared=geos_by_county is not None,
+                )
+            else:
+                load_geo(
+                    fips,
+                    level,
+                    year,
+                    namespace,
+                    layer_gdf,
+                    layer_hash,
+                    bulk_map=bulk_map,
+                    user_email="test@test.com",
+                    phase_results=phase_results,
+                    geos_by_county=geos_by_county,
+                    grid_size=grid_size,
+                )
 
     except Exception as e:
-        log.error(f"ERROR loading {fips} {level} {year}\n{e}")
+        # A failed load must exit nonzero: batch_load.py and run_speed_test.sh
+        # only see the exit status.
+        log.exception(f"ERROR loading {fips} {level} {year}\n{e}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
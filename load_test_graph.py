@@ -1,9 +1,11 @@
+import json
 import os
 from datetime import datetime, timezone
 import pickle
 from gerrydb import GerryDB
 import click
 
+from graph_format import CSRGraph, graph_to_csr, load_csr, save_csr
 from states_and_territories import states_and_territories
 
 
@@ -40,24 +42,136 @@ def import_graph(graph_file_name):
     print(f"\tFinished!", flush=True)
 
 
+def iter_graph_create_body(
+    path: str,
+    locality: str,
+    layer: str,
+    description: str,
+    csr: CSRGraph,
+    chunk_size: int,
+):
+    """Yields a graph creation request body, encoding the edge list chunk by chunk.
+
+    Only one chunk of edges is ever encoded in memory, so the body of a TX block
+    graph never has to exist as a single Python object.
+    """
+    header = json.dumps(
+        {
+            "path": path,
+            "description": description,
+            "locality": locality,
+            "layer": layer,
+        }
+    )
+    yield (header[:-1] + ', "edges": [').encode()
+
+    sep = ""
+    for chunk in csr.iter_edge_chunks(chunk_size):
+        if not len(chunk):
+            continue
+        yield (
+            sep
+            + ",".join(
+                json.dumps([geoid_u, geoid_v, None])
+                for geoid_u, geoid_v in csr.geoids[chunk].tolist()
+            )
+        ).encode()
+        sep = ","
+
+    yield b"]}"
+
+
+def import_graph_csr(csr_file_name, chunk_size=100_000):
+    """Imports a graph stored in the CSR format, streaming its edges to the server."""
+    base_name = os.path.basename(csr_file_name)
+    fips = base_name.split("_")[0]
+    state = states_and_territories[fips].lower()
+    level = base_name.split("_")[1]
+    year = base_name.split("_")[2].split(".")[0]
+    namespace = f"census.{year}"
+
+    csr = load_csr(csr_file_name)
+
+    db = GerryDB(namespace=namespace)
+    root_loc = db.localities[fips]
+    layer = db.geo_layers[level]
+
+    print(
+        f"Importing graph for {base_name} ({csr.n_nodes} nodes, {csr.n_edges} edges)",
+        flush=True,
+    )
+    with db.context(
+        notes=f"Imported using the make_a_graph.py script at {datetime.now(timezone.utc)}. "
+        "Graphs were created using the gerrychain.Graph class and rook adjacency."
+    ) as ctx:
+        response = ctx.client.post(
+            f"/graphs/{namespace}",
+            content=iter_graph_create_body(
+                path=f"{state}_{level}_{year}_dual",
+                locality=root_loc.canonical_path,
+                layer=layer.path,
+                description=f"Dual graph for {state} at {level} level in {year} from raw census shapefile",
+                csr=csr,
+                chunk_size=chunk_size,
+            ),
+            headers={"Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+
+    print(f"\tFinished!", flush=True)
+
+
 @click.command()
 @click.option("--large", type=int, help="Run on large data set.")
 @click.option("--extreme", type=int, help="Run on extreme data set.")
-def main(large, extreme):
+@click.option(
+    "--format",
+    "graph_format",
+    type=click.Choice(["pickle", "csr"]),
+    default="pickle",
+    show_default=True,
+    help="Input graph format. The CSR file is created next to the pickle on "
+    "first use (see graph_format.py).",
+)
+@click.option(
+    "--chunk-size",
+    type=int,
+    default=100_000,
+    show_default=True,
+    help="Edges encoded per chunk when streaming a CSR graph.",
+)
+@click.option(
+    "--file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Pickled graph file, named <fips>_<level>_<year>.pkl "
+    "(overrides --large/--extreme).",
+)
+def main(large, extreme, graph_format, chunk_size, file):
 
     # convert int to bool
     large = large == 1
     extreme = extreme == 1
 
-    f = "./WY_data/56_county_2010.pkl"
-
-    if large:
-        f = "./WY_data/56_block_2010.pkl"
-
-    if extreme:
-        f = "./TX_data/48_block_2010.pkl"
-
-    import_graph(f)
+    f = file
+    if f is None:
+        f = "./WY_data/56_county_2010.pkl"
+
+        if large:
+            f = "./WY_data/56_block_2010.pkl"
+
+        if extreme:
+            f = "./TX_data/48_block_2010.pkl"
+
+    if graph_format == "csr":
+        csr_file = os.path.splitext(f)[0] + ".npz"
+        if not os.path.exists(csr_file):
+            print(f"Converting {f} to {csr_file}...", flush=True)
+            with open(f, "rb") as fp:
+                save_csr(graph_to_csr(pickle.load(fp)), csr_file)
+        import_graph_csr(csr_file, chunk_size=chunk_size)
+    else:
+        import_graph(f)
 
     print("Finished importing graph!", flush=True)
 
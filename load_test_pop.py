@@ -2,6 +2,7 @@
 
 import logging
 import os
+from datetime import datetime, timezone
 from typing import Optional
 
 import pandas as pd
@@ -17,21 +18,46 @@ from gerrydb_etl.bootstrap.pl_config import (
 try:
     from gerrydb_etl.db import DirectTransactionContext
     from gerrydb_meta import crud, models
-    from sqlalchemy import select
+    from sqlalchemy import (
+        BigInteger,
+        Column,
+        Integer,
+        MetaData,
+        Table,
+        insert,
+        literal,
+        select,
+        text,
+        update,
+    )
 except ImportError:
     crud = None
 
 
-import pandas as pd
+import io
+import time
 import warnings
+
 import click
+import numpy as np
+import pandas as pd
+
+from benchmark import PhaseTimer
+from checkpoint import LoadManifest
+from direct_refs import resolve_refs
+from preprocess import (
+    PreprocessCache,
+    build_geoids,
+    cache_key,
+    file_sha256,
+    sanitize_paths,
+)
 
 warnings.filterwarnings("ignore")
 
 log = logging.getLogger()
 
 TABLES = ["P1", "P2", "P3", "P4"]
-TABLES = ["P1"]
 CENTRAL_SPINE_LEVELS = (
     "block",
     # "bg",
@@ -48,40 +74,34 @@ AUXILIARY_LEVELS = (
 )
 LEVELS = CENTRAL_SPINE_LEVELS + AUXILIARY_LEVELS
 
+# Column value loading engines: the ORM path of `DirectTransactionContext` or a
+# COPY into a staging table merged set-based (`copy_column_values`).
+ENGINES = ("orm", "copy")
+
+STAGING_TABLE = "column_value_staging"
+
+# Row layout of a binary COPY into the staging table: field count, then the
+# length and value of each field, all big-endian.
+STAGING_COPY_ROW = np.dtype(
+    [
+        ("n_fields", ">i2"),
+        ("geo_id_len", ">i4"),
+        ("geo_id", ">i4"),
+        ("col_id_len", ">i4"),
+        ("col_id", ">i4"),
+        ("val_int_len", ">i4"),
+        ("val_int", ">i8"),
+    ]
+)
+PGCOPY_HEADER = b"PGCOPY\n\377\r\n\0" + b"\0" * 8
+PGCOPY_TRAILER = b"\xff\xff"
 
-def load_tables(
-    namespace: str,
-    year: str,
-    table: str,
-    level: str,
-    fips: str,
-    table_df: pd.DataFrame,
-    user_email: Optional[str] = None,
-):
-    """
-    Loads Census PL 94-171 tables P1 through P4 from the Census API.
-
-    https://www.census.gov/content/dam/Census/data/developers/api-user-guide/api-guide.pdf
-    https://api.census.gov/data.html
-
-    """
-    log.info(f"LOADING CENSUS {year} {level} {table} FOR {fips}")
-
-    if MissingDataset(fips=fips, level=level, year=year) in MISSING_DATASETS:
-        log.warning("Dataset not published by Census. Nothing to do.")
-        exit()
-
-    if fips is None:
-        raise ValueError(f'Level "{level}" requires a state FIPS code.')
-
-    if os.getenv("GERRYDB_BULK_IMPORT") and crud is None:
-        raise RuntimeError("gerrydb_meta must be available in bulk import mode.")
 
-    # Some geographies have a '/' in the geoid, which will mess up the path, so we remove it
-    # and replace all instances of '/' with '--' in the dataframe
-    table_df = table_df.applymap(
-        lambda x: x.replace("/", "--") if isinstance(x, str) else x
-    )
+def prepare_table(level: str, fips: str, table_df: pd.DataFrame) -> pd.DataFrame:
+    """Cleans a raw PL table into a frame indexed by geography path."""
+    # Some geographies have a '/' in the geoid, which will mess up the path, so we
+    # replace all instances of '/' with '--' in the string columns of the dataframe
+    table_df = sanitize_paths(table_df)
 
     if level == "block":
         id_cols = ("state", "county", "tract", "block")
@@ -106,16 +126,7 @@ def load_tables(
     else:
         raise ValueError("Unknown level.")
 
-    db = GerryDB(namespace=namespace)
-
-    table_cols = db.column_sets[table.lower()]
-
-    col_aliases = {}
-    for col in table_cols.columns:
-        for alias in col.aliases:
-            col_aliases[alias] = col
-
-    table_df["id"] = table_df[list(id_cols)].agg("".join, axis=1)
+    table_df["id"] = build_geoids(table_df, id_cols)
 
     if level in AUXILIARY_LEVELS:
         # since aiannh geographies cross state lines, the census subidivides the polygon but
@@ -129,84 +140,462 @@ def load_tables(
     table_df = table_df.rename(columns={col: col.lower() for col in table_df.columns})
     table_df = table_df.set_index("id")
 
-    table_cols = {
-        alias: col for alias, col in col_aliases.items() if alias in table_df.columns
-    }
-    for col in table_cols:
-        table_df[col] = table_df[col].astype(int)
+    return table_df
+
+
+def staging_copy_data(
+    geo_ids: np.ndarray, col_ids: np.ndarray, values: np.ndarray
+) -> bytes:
+    """Builds the binary COPY data of the staging table for a `len(geo_ids)` by
+    `len(col_ids)` array of values, without a per-row Python loop."""
+    rows = np.empty(values.size, dtype=STAGING_COPY_ROW)
+    rows["n_fields"] = 3
+    rows["geo_id_len"] = 4
+    rows["geo_id"] = np.repeat(geo_ids, len(col_ids))
+    rows["col_id_len"] = 4
+    rows["col_id"] = np.tile(col_ids, len(geo_ids))
+    rows["val_int_len"] = 8
+    rows["val_int"] = values.ravel()
+    return PGCOPY_HEADER + rows.tobytes() + PGCOPY_TRAILER
+
+
+def copy_column_values(
+    ctx, cols_by_alias: dict, geos_by_path: dict, df: pd.DataFrame
+) -> int:
+    """Loads integer column values with COPY instead of ORM inserts.
+
+    The wide frame is turned into `(geo_id, col_id, val_int)` rows and copied
+    into a temporary staging table in a single binary COPY (see
+    `staging_copy_data`). The current values of the same columns and geographies
+    are then retired and the staged values inserted, each in one set-based
+    statement.
+
+    PL values are integer counts, so only `val_int` is written. Returns the
+    number of values loaded.
+    """
+    aliases = list(cols_by_alias)
+    geo_ids = np.fromiter(
+        (geos_by_path[path].geo_id for path in df.index), dtype=np.int32, count=len(df)
+    )
+    col_ids = np.array([cols_by_alias[alias].col_id for alias in aliases], np.int32)
+    values = df[aliases].to_numpy(dtype=np.int64)
+
+    ctx.db.execute(
+        text(
+            f"""
+            CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE}
+                (geo_id integer, col_id integer, val_int bigint)
+            ON COMMIT DROP
+            """
+        )
+    )
+    ctx.db.execute(text(f"TRUNCATE {STAGING_TABLE}"))
+
+    # The session's own connection, so the COPY is part of the import transaction.
+    cursor = ctx.db.connection().connection.cursor()
+    copy_sql = f"COPY {STAGING_TABLE} (geo_id, col_id, val_int) FROM STDIN BINARY"
+    data = staging_copy_data(geo_ids, col_ids, values)
+    if hasattr(cursor, "copy"):
+        # psycopg 3
+        with cursor.copy(copy_sql) as copy:
+            copy.write(data)
+    else:
+        # psycopg2
+        cursor.copy_expert(copy_sql, io.BytesIO(data))
+
+    staging = Table(
+        STAGING_TABLE,
+        MetaData(),
+        Column("geo_id", Integer),
+        Column("col_id", Integer),
+        Column("val_int", BigInteger),
+    )
+    values_table = models.ColumnValue.__table__
+    now = datetime.now(timezone.utc)
+    ctx.db.execute(
+        update(values_table)
+        .where(
+            values_table.c.col_id == staging.c.col_id,
+            values_table.c.geo_id == staging.c.geo_id,
+            values_table.c.valid_to.is_(None),
+        )
+        .values(valid_to=now)
+    )
+    ctx.db.execute(
+        insert(values_table).from_select(
+            ["col_id", "geo_id", "meta_id", "valid_from", "val_int"],
+            select(
+                staging.c.col_id,
+                staging.c.geo_id,
+                literal(ctx.meta.meta_id),
+                literal(now),
+                staging.c.val_int,
+            ),
+        )
+    )
+    return values.size
+
+
+def load_tables(
+    namespace: str,
+    year: str,
+    table: str,
+    level: str,
+    fips: str,
+    table_df: pd.DataFrame,
+    user_email: Optional[str] = None,
+    prepared: bool = False,
+    engine: str = "orm",
+    manifest: Optional[LoadManifest] = None,
+):
+    """
+    Loads one Census PL 94-171 table (see `load_table_set`).
+
+    https://www.census.gov/content/dam/Census/data/developers/api-user-guide/api-guide.pdf
+    https://api.census.gov/data.html
+
+    """
+    load_table_set(
+        namespace,
+        year,
+        level,
+        fips,
+        {table: table_df},
+        user_email=user_email,
+        prepared=prepared,
+        engine=engine,
+        manifest=manifest,
+    )
+
+
+def load_table_set(
+    namespace: str,
+    year: str,
+    level: str,
+    fips: str,
+    tables: dict[str, pd.DataFrame],
+    user_email: Optional[str] = None,
+    prepared: bool = False,
+    chunk_size: int = 50_000,
+    engine: str = "orm",
+    phase_results: Optional[str] = None,
+    manifest: Optional[LoadManifest] = None,
+):
+    """
+    Loads several Census PL 94-171 tables (e.g. P1 through P4) in one transaction.
+
+    The geographies of all tables are resolved with a single bulk lookup and the
+    columns of all tables with a single query; values are then loaded table by
+    table in chunks of `chunk_size` rows. The frames are held in memory whole:
+    chunking bounds the size of each batch of values, not memory use.
+
+    When `prepared` is set, the frames in `tables` have already been through
+    `prepare_table` (e.g. they were read from the preprocessing cache).
+
+    `engine` selects how values are written: "orm" uses
+    `DirectTransactionContext.load_column_values`, "copy" uses
+    `copy_column_values`. The value loading is recorded as a `pop_load_values`
+    phase in `phase_results`.
+
+    When `manifest` is given, every chunk is instead committed in its own
+    transaction and recorded in the manifest, and chunks already recorded are
+    skipped, so an interrupted load can be resumed.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown engine "{engine}" (expected one of {ENGINES}).')
+
+    log.info(f"LOADING CENSUS {year} {level} {', '.join(tables)} FOR {fips}")
+
+    if MissingDataset(fips=fips, level=level, year=year) in MISSING_DATASETS:
+        log.warning("Dataset not published by Census. Nothing to do.")
+        exit()
+
+    if fips is None:
+        raise ValueError(f'Level "{level}" requires a state FIPS code.')
+
+    if os.getenv("GERRYDB_BULK_IMPORT") and crud is None:
+        raise RuntimeError("gerrydb_meta must be available in bulk import mode.")
+
+    db = GerryDB(namespace=namespace)
+
+    table_cols = {}
+    value_dfs = {}
+    for table, table_df in tables.items():
+        if not prepared:
+            table_df = prepare_table(level, fips, table_df)
+
+        col_aliases = {}
+        for col in db.column_sets[table.lower()].columns:
+            for alias in col.aliases:
+                col_aliases[alias] = col
+
+        table_cols[table] = {
+            alias: col
+            for alias, col in col_aliases.items()
+            if alias in table_df.columns
+        }
+        value_dfs[table] = table_df.astype({col: int for col in table_cols[table]})
+
+    all_geoids = pd.Index([])
+    for table_df in value_dfs.values():
+        all_geoids = all_geoids.union(table_df.index)
 
     import_notes = (
         f"ETL script {__file__}: loading data for {year} "
-        f"U.S. Census P.L. 94-171 Table {table}"
+        f"U.S. Census P.L. 94-171 Tables {', '.join(tables)}"
     )
 
-    with DirectTransactionContext(notes=import_notes, email=user_email) as ctx:
-        namespace_obj = crud.namespace.get(db=ctx.db, path=namespace)
-        assert namespace_obj is not None
+    def load_chunk(ctx, table, start, chunk_df, geos_by_path, cols_by_canonical_path):
+        cols_by_alias = {
+            alias: cols_by_canonical_path[col.canonical_path]
+            for alias, col in table_cols[table].items()
+        }
+        if engine == "copy":
+            copy_column_values(ctx, cols_by_alias, geos_by_path, chunk_df)
+        else:
+            ctx.load_column_values(cols=cols_by_alias, geos=geos_by_path, df=chunk_df)
+        log.info(
+            f"\t{table}: loaded {start + len(chunk_df)}/{len(value_dfs[table])} rows"
+        )
+        return len(chunk_df) * len(cols_by_alias)
+
+    # Units of work are keyed by name ("<table>:<start>-<end>").
+    chunks = {
+        f"{table}:{start}-{start + len(chunk_df)}": (table, start, chunk_df)
+        for table, table_df in value_dfs.items()
+        for start in range(0, len(table_df), chunk_size)
+        for chunk_df in [table_df.iloc[start : start + chunk_size]]
+    }
 
-        geographies = crud.geography.get_bulk(
-            db=ctx.db,
-            namespaced_paths=[(namespace, idx) for idx in table_df.index],
+    timer = PhaseTimer(
+        "pop_load_values",
+        phase_results,
+        engine=engine,
+        level=level,
+        fips=fips,
+        tables=list(value_dfs),
+        checkpoint=manifest is not None,
+    )
+    n_values = 0
+
+    if manifest is None:
+        with DirectTransactionContext(notes=import_notes, email=user_email) as ctx:
+            refs = resolve_refs(ctx, namespace, all_geoids, table_cols)
+            with timer:
+                t_start = time.perf_counter()
+                for table, start, chunk_df in chunks.values():
+                    n_values += load_chunk(ctx, table, start, chunk_df, *refs)
+                timer.extra["values"] = n_values
+                timer.extra["values_per_s"] = n_values / (time.perf_counter() - t_start)
+    else:
+        n_skipped = sum(unit in manifest for unit in chunks)
+        log.info(
+            f"\tResuming from {manifest.path}: skipping {n_skipped} committed "
+            f"chunks, {len(chunks) - n_skipped} left"
         )
-        if len(geographies) < len(table_df):
-            raise ValueError(
-                f"Cannot perform bulk import (expected {len(table_df)} "
-                f"geographies, found {len(geographies)})."
-            )
-
-        raw_cols = (
-            ctx.db.query(models.DataColumn)
-            .filter(
-                models.DataColumn.col_id.in_(
-                    select(models.ColumnRef.col_id).filter(
-                        models.ColumnRef.path.in_(
-                            col.path for col in table_cols.values()
-                        ),
-                        models.ColumnRef.namespace_id == namespace_obj.namespace_id,
+        # Every chunk commits on its own, so its references are resolved in its
+        # own transaction.
+        with timer:
+            t_start = time.perf_counter()
+            for unit, (table, start, chunk_df) in chunks.items():
+                if unit in manifest:
+                    continue
+                with DirectTransactionContext(
+                    notes=f"{import_notes} [{unit}]", email=user_email
+                ) as ctx:
+                    refs = resolve_refs(
+                        ctx, namespace, chunk_df.index, {table: table_cols[table]}
                     )
-                )
-            )
-            .all()
-        )
-        cols_by_canonical_path = {col.canonical_ref.path: col for col in raw_cols}
+                    n_chunk = load_chunk(ctx, table, start, chunk_df, *refs)
+                manifest.mark_done(unit, rows=len(chunk_df), values=n_chunk)
+                n_values += n_chunk
+            timer.extra["values"] = n_values
+            timer.extra["values_per_s"] = n_values / (time.perf_counter() - t_start)
 
-        cols_by_alias = {
-            alias: cols_by_canonical_path[col.canonical_path]
-            for alias, col in table_cols.items()
-        }
-        geos_by_path = {geo.path: geo for geo in geographies}
+    log.info(f"\tLoaded {n_values} values ({timer.extra['values_per_s']:.0f} values/s)")
 
-        ctx.load_column_values(cols=cols_by_alias, geos=geos_by_path, df=table_df)
+
+def read_table(
+    file: str,
+    level: str,
+    fips: str,
+    year: str,
+    table: str,
+    cache: Optional[PreprocessCache],
+) -> tuple[pd.DataFrame, bool]:
+    """Reads a PL table, through the preprocessing cache if there is one.
+
+    Returns the frame and whether it has already been through `prepare_table`.
+    """
+    if cache is None:
+        return pd.read_parquet(file), False
+
+    key = cache_key(
+        "pop", file_sha256(file), fips=fips, level=level, year=year, table=table
+    )
+    cached = cache.get(key)
+    if cached is not None:
+        log.info(f"Using cached preprocessed table {key}")
+        table_df, _ = cached
+    else:
+        table_df = prepare_table(level, fips, pd.read_parquet(file))
+        cache.put(key, table_df)
+    return table_df, True
 
 
 @click.command()
 @click.option("--large", type=int, help="Run on large data set.")
 @click.option("--extreme", type=int, help="Run on extreme data set.")
-def main(large, extreme):
+@click.option(
+    "--tables",
+    default=None,
+    help="Comma-separated PL tables to load in one transaction; all of them must "
+    f"have a file. Defaults to those of {','.join(TABLES)} that have one.",
+)
+@click.option(
+    "--chunk-size",
+    type=int,
+    default=50_000,
+    show_default=True,
+    help="Rows of a table loaded per batch of column values.",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(ENGINES),
+    default="orm",
+    show_default=True,
+    help="Column value loading engine: ORM inserts or COPY into a staging table.",
+)
+@click.option(
+    "--phase-results",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="JSON lines phase results file to append the value loading record to.",
+)
+@click.option(
+    "--file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="P1 table file, named <fips>_<level>_<year>_P1.parquet; the other "
+    "tables are read from next to it (overrides --large/--extreme).",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Commit chunk by chunk, recording progress in this JSON manifest; "
+    "rerunning with the same manifest skips committed chunks.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Cache the preprocessed table in this directory (keyed by the input's "
+    "SHA256) and reuse it on later runs.",
+)
+@click.option(
+    "--cache-max-gb",
+    type=float,
+    default=20,
+    show_default=True,
+    help="Evict least recently used cache entries beyond this size.",
+)
+def main(
+    large,
+    extreme,
+    tables,
+    chunk_size,
+    engine,
+    phase_results,
+    cache_dir,
+    cache_max_gb,
+    file,
+    checkpoint,
+):
 
     # convert int to bool
     large = large == 1
     extreme = extreme == 1
 
-    file = "./WY_data/56_county_2010_P1.parquet"
+    if file is None:
+        file = "./WY_data/56_county_2010_P1.parquet"
 
-    if large:
-        file = "./WY_data/56_block_2010_P1.parquet"
+        if large:
+            file = "./WY_data/56_block_2010_P1.parquet"
 
-    if extreme:
-        file = "./TX_data/48_block_2010_P1.parquet"
+        if extreme:
+            file = "./TX_data/48_block_2010_P1.parquet"
 
     file_name = os.path.basename(file)
     fips = file_name.split("_")[0]
     level = file_name.split("_")[1]
     year = file_name.split("_")[2]
-    table = file_name.split("_")[3].split(".")[0]
     namespace = f"census.{year}"
 
-    print(f"load_tables({namespace}, {year}, {table}, {level}, {fips}, table_df)")
-    table_df = pd.read_parquet(file)
-    load_tables(
-        namespace, year, table, level, fips, table_df, user_email="test@test.com"
+    cache = None
+    if cache_dir is not None:
+        cache = PreprocessCache(cache_dir, max_bytes=int(cache_max_gb * 2**30))
+
+    # The other tables sit next to the P1 file as <fips>_<level>_<year>_<table>.
+    table_files = {
+        table: os.path.join(
+            os.path.dirname(file), f"{fips}_{level}_{year}_{table}.parquet"
+        )
+        for table in (TABLES if tables is None else tables.split(","))
+    }
+    missing = [table for table, path in table_files.items() if not os.path.exists(path)]
+    if tables is None:
+        table_files = {
+            table: path for table, path in table_files.items() if table not in missing
+        }
+        if not table_files:
+            raise click.UsageError(f"No PL table files found next to {file}.")
+        log.info(
+            f"Loading the tables with a file next to {file}: "
+            f"{', '.join(table_files)} (no file for {', '.join(missing) or 'none'})"
+        )
+    elif missing:
+        raise click.UsageError(
+            f"No file for table(s) {', '.join(missing)}: expected "
+            f"{', '.join(table_files[table] for table in missing)}."
+        )
+
+    table_dfs = {}
+    prepared = cache is not None
+    for table, table_file in table_files.items():
+        table_dfs[table], prepared = read_table(
+            table_file, level, fips, year, table, cache
+        )
+
+    manifest = None
+    if checkpoint is not None:
+        manifest = LoadManifest(
+            checkpoint,
+            {
+                "loader": "pop",
+                "file": file_name,
+                "namespace": namespace,
+                "tables": list(table_dfs),
+                "chunk_size": chunk_size,
+            },
+        )
+
+    print(
+        f"load_table_set({namespace}, {year}, {level}, {fips}, "
+        f"[{', '.join(table_dfs)}])"
+    )
+    load_table_set(
+        namespace,
+        year,
+        level,
+        fips,
+        table_dfs,
+        user_email="test@test.com",
+        prepared=prepared,
+        chunk_size=chunk_size,
+        engine=engine,
+        phase_results=phase_results,
+        manifest=manifest,
     )
 
 
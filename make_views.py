@@ -1,14 +1,122 @@
+import os
+import time
+from datetime import datetime
+
 import gerrydb
 from gerrydb import GerryDB
-import time
-from tqdm import tqdm
 import click
 
+from benchmark import (
+    PhaseTimer,
+    format_summary,
+    parse_server_timing,
+    run_benchmark,
+    server_timing_breakdown,
+    write_results,
+)
+from compression import read_stats, summarize_stats
+from graph_cache import GraphCache
+from view_reuse import REUSE_HEADER
+
+
+MEDIUM_COLUMN_SET_COLUMNS = [
+    "name",
+    "one_race_pop",
+    "two_or_more_races_pop",
+    "area_land",
+    "area_water",
+    "nhpi_pop",
+    "other_pop",
+    "amin_pop",
+    "asian_pop",
+    "white_pop",
+    "black_pop",
+    "black_nhpi_pop",
+    "black_other_pop",
+    "black_amin_pop",
+    "black_asian_pop",
+    "white_nhpi_pop",
+    "white_other_pop",
+    "white_amin_pop",
+    "white_asian_pop",
+    "two_races_pop",
+    "white_black_pop",
+    "white_black_nhpi_pop",
+    "white_black_amin_pop",
+    "white_black_asian_pop",
+    "nhpi_other_pop",
+]
+
 
 @click.command()
 @click.option("--large", type=int, help="Run on large data set.")
 @click.option("--extreme", type=int, help="Run on extreme data set.")
-def main(large, extreme):
+@click.option(
+    "--warmup",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Untimed (cold) view creations before the timed iterations.",
+)
+@click.option(
+    "--iterations",
+    type=int,
+    default=3,
+    show_default=True,
+    help="Timed view creations per benchmark.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Results file (.json or .csv). "
+    "Defaults to ./results/views_<dataset>_<timestamp>.json.",
+)
+@click.option(
+    "--phase-results",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="JSON lines phase results file to append one record per benchmark to.",
+)
+@click.option(
+    "--graph-cache-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Fetch the graph through an on-disk cache in this directory, validated "
+    "against the server's ETag, instead of downloading it every run.",
+)
+@click.option(
+    "--compression-stats",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Compression statistics file written by the server "
+    "(uvicorn_runner.py --compression-stats). When given, the mean view size, "
+    "bytes on the wire and compression CPU time are reported per benchmark.",
+)
+@click.option(
+    "--label",
+    default=None,
+    help="Label recorded with every result, e.g. the server configuration.",
+)
+@click.option(
+    "--path-prefix",
+    default="test",
+    show_default=True,
+    help="Prefix of the column set, template and view paths created by this run. "
+    "Must differ between runs against the same database.",
+)
+def main(
+    large,
+    extreme,
+    warmup,
+    iterations,
+    output,
+    phase_results,
+    graph_cache_dir,
+    compression_stats,
+    label,
+    path_prefix,
+):
 
     # convert int to bool
     large = large == 1
@@ -16,7 +124,37 @@ def main(large, extreme):
 
     base_namespace = "census.2010"
 
+    if extreme:
+        dataset = "tx_block"
+    elif large:
+        dataset = "wy_block"
+    else:
+        dataset = "wy_county"
+
+    if output is None:
+        timestamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join("results", f"views_{dataset}_{timestamp}.json")
+
+    results = []
+
     with GerryDB(namespace=base_namespace) as db:
+        # Server-Timing headers of view creation responses, oldest first.
+        view_server_timings = []
+        # Whether each view creation skipped rendering by reusing a stored render
+        # (uvicorn_runner.py --view-reuse-dir), oldest first.
+        view_reuses = []
+
+        def capture_server_timing(response):
+            if response.request.method == "POST" and "/views/" in str(
+                response.request.url
+            ):
+                header = response.headers.get("Server-Timing")
+                if header:
+                    view_server_timings.append(parse_server_timing(header))
+                view_reuses.append(REUSE_HEADER in response.headers)
+
+        db.client.event_hooks["response"].append(capture_server_timing)
+
         if not extreme:
             locality = db.localities["wy"]
         else:
@@ -28,176 +166,159 @@ def main(large, extreme):
             layer = db.geo_layers["county"]
 
         print("Getting graph...")
-        t_start_get_graph = time.time()
-
-        if extreme:
-            graph = db.graphs["tx_block_2010_dual"]
-        elif large:
-            graph = db.graphs["wy_block_2010_dual"]
-        else:
-            graph = db.graphs["wy_county_2010_dual"]
-
-        t_end_get_graph = time.time()
-        print(f"Time to get graph: {t_end_get_graph - t_start_get_graph}")
+        graph_path = f"{dataset}_2010_dual"
+        with PhaseTimer(
+            "view_get_graph", phase_results, dataset=dataset, label=label
+        ) as timer:
+            t_start_get_graph = time.perf_counter()
+            if graph_cache_dir is not None:
+                cached_graph = GraphCache(graph_cache_dir).get(
+                    db, graph_path, namespace=base_namespace
+                )
+                timer.extra["graph_from_cache"] = cached_graph.from_cache
+                graph = cached_graph
+            else:
+                graph = db.graphs[graph_path]
+            t_get_graph = time.perf_counter() - t_start_get_graph
+        print(f"Time to get graph: {t_get_graph} s")
 
         with db.context(notes="Creating views for census.2010") as ctx:
-            columns1 = ["total_pop"]
-
-            # Time render view from single column
+            # Single column view
             template1 = ctx.view_templates.create(
-                path="test_single_column_view_template",
-                columns=columns1,
+                path=f"{path_prefix}_single_column_view_template",
+                columns=["total_pop"],
                 namespace=base_namespace,
                 description="View containing a single column.",
             )
 
-            print("Timing single column view creation...")
-            t_start_single_column = time.time()
-            ctx.views.create(
-                path=f"test_single_column_view",
-                namespace=base_namespace,
-                template=template1,
-                locality=locality,
-                graph=graph,
-                layer=layer,
-            )
-            t_end_single_column = time.time()
-            print(
-                f"Time to create first instance of column view: {(t_end_single_column - t_start_single_column)} s"
-            )
-            n_single_column_attempts = 3
-            t_start_single_column = time.time()
-            for i in tqdm(range(n_single_column_attempts)):
-                ctx.views.create(
-                    path=f"test_single_column_view_{i}",
-                    namespace=base_namespace,
-                    template=template1,
-                    locality=locality,
-                    graph=graph,
-                    layer=layer,
-                )
-            t_end_single_column = time.time()
-            print(
-                f"Average time to create single column view after first attempt: {(t_end_single_column - t_start_single_column) / n_single_column_attempts} s"
-            )
-
-            # Time render medium view from medium column set
-            column_set_columns2 = [
-                "name",
-                "one_race_pop",
-                "two_or_more_races_pop",
-                "area_land",
-                "area_water",
-                "nhpi_pop",
-                "other_pop",
-                "amin_pop",
-                "asian_pop",
-                "white_pop",
-                "black_pop",
-                "black_nhpi_pop",
-                "black_other_pop",
-                "black_amin_pop",
-                "black_asian_pop",
-                "white_nhpi_pop",
-                "white_other_pop",
-                "white_amin_pop",
-                "white_asian_pop",
-                "two_races_pop",
-                "white_black_pop",
-                "white_black_nhpi_pop",
-                "white_black_amin_pop",
-                "white_black_asian_pop",
-                "nhpi_other_pop",
-            ]
-
+            # Medium view from medium column set
             ctx.column_sets.create(
-                path="test_medium_column_set",
-                columns=column_set_columns2,
+                path=f"{path_prefix}_medium_column_set",
+                columns=MEDIUM_COLUMN_SET_COLUMNS,
                 namespace=base_namespace,
                 description="Small column set for testing.",
             )
-
-            columns2 = [
-                "total_pop",
-            ]
-
             template2 = ctx.view_templates.create(
-                path="test_medium_column_set_view_template",
-                column_sets=["test_medium_column_set"],
-                columns=columns2,
+                path=f"{path_prefix}_medium_column_set_view_template",
+                column_sets=[f"{path_prefix}_medium_column_set"],
+                columns=["total_pop"],
                 description="View containing a few columns",
             )
 
-            t_start_medium_view = time.time()
-            ctx.views.create(
-                path=f"test_medium_column_set_view",
-                namespace=base_namespace,
-                template=template2,
-                locality=locality,
-                graph=graph,
-                layer=layer,
-            )
-            t_end_medium_view = time.time()
-
-            print(
-                f"Time to create first instance of medium view: {(t_end_medium_view - t_start_medium_view)} s"
-            )
-            n_medium_view_attempts = 3
-            t_start_medium_view = time.time()
-            for i in tqdm(range(n_medium_view_attempts)):
-                ctx.views.create(
-                    path=f"test_medium_column_set_view_{i}",
-                    namespace=base_namespace,
-                    template=template2,
-                    locality=locality,
-                    graph=graph,
-                    layer=layer,
-                )
-            t_end_medium_view = time.time()
-
-            print(
-                f"Average time to create medium view after first attempt: {(t_end_medium_view - t_start_medium_view) / n_medium_view_attempts} s"
-            )
-
-            # Time render large view from large column set
+            # Large view from the P1 column set
             template3 = ctx.view_templates.create(
-                path="test_large_column_set_view_template",
+                path=f"{path_prefix}_large_column_set_view_template",
                 column_sets=["p1"],
                 namespace=base_namespace,
                 description="View containing a large column set.",
             )
 
-            t_start_large_view = time.time()
-            ctx.views.create(
-                path=f"test_large_column_set_view",
-                namespace=base_namespace,
-                template=template3,
-                locality=locality,
-                graph=graph,
-                layer=layer,
+            view_benchmarks = (
+                ("single_column_view", template1),
+                ("medium_column_set_view", template2),
+                ("large_column_set_view", template3),
             )
-            t_end_large_view = time.time()
 
-            print(
-                f"Time to create first instance of large view: {(t_end_large_view - t_start_large_view)} s"
-            )
+            for name, template in view_benchmarks:
+                view_path = f"{path_prefix}_{name}"
+                print(f"Timing {name.replace('_', ' ')} creation...", flush=True)
+
+                timed_server_timings = []
+                timed_reuses = []
+
+                def create_view(
+                    tag,
+                    view_path=view_path,
+                    template=template,
+                    timed_server_timings=timed_server_timings,
+                    timed_reuses=timed_reuses,
+                ):
+                    n_timings = len(view_server_timings)
+                    n_reuses = len(view_reuses)
+                    ctx.views.create(
+                        path=f"{view_path}_{tag}",
+                        namespace=base_namespace,
+                        template=template,
+                        locality=locality,
+                        graph=graph,
+                        layer=layer,
+                    )
+                    if not str(tag).startswith("warmup") and len(
+                        view_server_timings
+                    ) > n_timings:
+                        timed_server_timings.append(view_server_timings[-1])
+                    if not str(tag).startswith("warmup") and len(
+                        view_reuses
+                    ) > n_reuses:
+                        timed_reuses.append(view_reuses[-1])
 
-            n_large_view_attempts = 3
-            t_start_large_view = time.time()
-            for l in tqdm(range(n_large_view_attempts)):
-                ctx.views.create(
-                    path=f"test_large_column_set_view_{l}",
-                    namespace=base_namespace,
-                    template=template3,
-                    locality=locality,
-                    graph=graph,
-                    layer=layer,
+                if compression_stats is not None:
+                    _, stats_offset = read_stats(compression_stats)
+
+                with PhaseTimer(
+                    f"view_{name}", phase_results, dataset=dataset, label=label
+                ):
+                    result = run_benchmark(
+                        name,
+                        create_view,
+                        warmup=warmup,
+                        iterations=iterations,
+                        dataset=dataset,
+                        graph_fetch_s=t_get_graph,
+                    )
+                breakdown = server_timing_breakdown(
+                    result.samples, timed_server_timings
                 )
-            t_end_large_view = time.time()
+                result.extra.update(breakdown)
+                result.extra["reused_renders"] = sum(timed_reuses)
+                if compression_stats is not None:
+                    # Covers warmup and timed requests alike; the server writes
+                    # one record per view creation response.
+                    records, _ = read_stats(compression_stats, stats_offset)
+                    compression = summarize_stats(
+                        [
+                            record
+                            for record in records
+                            if record["method"] == "POST"
+                            and record["path"].startswith("/api/v1/views/")
+                        ]
+                    )
+                    result.extra.update(compression)
+                print(format_summary(result), flush=True)
+                if breakdown:
+                    network_s = breakdown.get("client_network_s", 0.0)
+                    print(
+                        "\tserver: "
+                        + ", ".join(
+                            f"{key[len('server_'):-2]} {value:.3f} s"
+                            for key, value in breakdown.items()
+                            if key.startswith("server_")
+                        )
+                        + f"; network/client {network_s:.3f} s",
+                        flush=True,
+                    )
+                if any(timed_reuses):
+                    print(
+                        f"\treused a stored render in {sum(timed_reuses)}/"
+                        f"{len(timed_reuses)} timed creations",
+                        flush=True,
+                    )
+                if compression_stats is not None and compression:
+                    print(
+                        f"\tview size {compression['body_bytes'] / 1e6:.2f} MB, "
+                        f"on the wire {compression['wire_bytes'] / 1e6:.2f} MB "
+                        f"({', '.join(compression['codecs'])}), "
+                        f"compression CPU {compression['compress_cpu_s'] * 1e3:.1f} ms",
+                        flush=True,
+                    )
+                results.append(result)
 
-            print(
-                f"Average time to create large view: {(t_end_large_view - t_start_large_view) / n_large_view_attempts} s"
-            )
+    write_results(
+        results,
+        output,
+        metadata={"dataset": dataset, "namespace": base_namespace, "label": label},
+    )
+    print(f"Wrote benchmark results to {output}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+"""SQL profiling for the speed-test database.
+
+Requires the database to run with the `docker-compose.profile.yml` override,
+which loads `pg_stat_statements` and `auto_explain`.
+
+Usage:
+
+    python pg_profile.py reset
+    python pg_profile.py dump --phase make_views --output-dir results/run/pg_profile \
+        --since 2024-01-01T12:00:00Z
+
+`reset` clears the statement statistics before a phase. `dump` writes the top
+statements by total execution time to `<phase>_statements.json` and the slowest
+plans logged by auto_explain since `--since` to `<phase>_plans.txt`.
+"""
+
+import json
+import os
+import re
+import subprocess
+
+import click
+from sqlalchemy import create_engine, text
+
+TOP_STATEMENTS_QUERY = text(
+    """
+    SELECT
+        queryid,
+        calls,
+        total_exec_time,
+        mean_exec_time,
+        max_exec_time,
+        rows,
+        shared_blks_hit,
+        shared_blks_read,
+        temp_blks_written,
+        query
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+    ORDER BY total_exec_time DESC
+    LIMIT :limit
+    """
+)
+
+# First line of an auto_explain entry, e.g.
+# "2024-01-01 12:00:00.000 UTC [123] LOG:  duration: 1234.567 ms  plan:"
+PLAN_START = re.compile(r"^\d{4}-\d\d-\d\d .*LOG:\s+duration: ([\d.]+) ms\s+plan:")
+LOG_LINE_START = re.compile(r"^\d{4}-\d\d-\d\d ")
+
+
+def get_engine():
+    return create_engine(os.environ["GERRYDB_DATABASE_URI"])
+
+
+def parse_plans(log_text: str) -> list[tuple[float, str]]:
+    """Extracts `(duration_ms, entry)` pairs of auto_explain entries from a
+    PostgreSQL server log."""
+    plans = []
+    current = None
+    for line in log_text.splitlines():
+        match = PLAN_START.match(line)
+        if match:
+            current = [float(match.group(1)), [line]]
+            plans.append(current)
+        elif current is not None and not LOG_LINE_START.match(line):
+            current[1].append(line)
+        else:
+            current = None
+    return [(duration, "\n".join(lines)) for duration, lines in plans]
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+def reset():
+    """Enables pg_stat_statements (if needed) and clears its statistics."""
+    with get_engine().begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_stat_statements"))
+        conn.execute(text("SELECT pg_stat_statements_reset()"))
+
+
+@cli.command()
+@click.option("--phase", required=True, help="Name of the profiled phase.")
+@click.option(
+    "--output-dir",
+    required=True,
+    type=click.Path(file_okay=False),
+    help="Directory to write the statement statistics and plans to.",
+)
+@click.option(
+    "--since",
+    default=None,
+    help="Start of the phase (RFC 3339); plans logged before it are ignored.",
+)
+@click.option("--top", type=int, default=25, show_default=True)
+@click.option(
+    "--service",
+    default="db",
+    show_default=True,
+    help="docker compose service running the database.",
+)
+def dump(phase, output_dir, since, top, service):
+    """Writes the top statements and slowest plans of a phase."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    with get_engine().connect() as conn:
+        statements = [
+            dict(row._mapping)
+            for row in conn.execute(TOP_STATEMENTS_QUERY, {"limit": top})
+        ]
+    statements_path = os.path.join(output_dir, f"{phase}_statements.json")
+    with open(statements_path, "w") as fp:
+        json.dump(statements, fp, indent=2, default=str)
+
+    logs_command = ["docker", "compose", "logs", "--no-log-prefix", service]
+    if since is not None:
+        logs_command[3:3] = ["--since", since]
+    logs = subprocess.run(logs_command, capture_output=True, text=True)
+    plans = sorted(parse_plans(logs.stdout + logs.stderr), reverse=True)[:top]
+
+    plans_path = os.path.join(output_dir, f"{phase}_plans.txt")
+    with open(plans_path, "w") as fp:
+        for _, entry in plans:
+            print(entry, end="\n\n", file=fp)
+
+    if statements:
+        slowest = statements[0]
+        print(
+            f"{phase}: top statement {slowest['total_exec_time'] / 1e3:.1f} s "
+            f"over {slowest['calls']} calls; {len(plans)} plans written to "
+            f"{plans_path}"
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,79 @@
+"""Runs one phase of the speed test as a subprocess and records its cost.
+
+Usage:
+
+    python phase_timer.py --phase geo_load --results results/run/phases.jsonl \
+        --log LOG_geo.log -- python load_test_geo.py --large=1
+
+The command's output is written to `--log` (instead of `/dev/null`) and a JSON
+line with wall-clock time, CPU time (user + system of the command and all of
+its children) and peak RSS of the largest child process is appended to
+`--results`, whether the command succeeds, fails or is interrupted. The exit
+code of the command is passed through.
+"""
+
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import click
+
+from benchmark import append_phase, peak_rss_mb
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option("--phase", required=True, help="Name of the phase being timed.")
+@click.option(
+    "--results",
+    required=True,
+    type=click.Path(dir_okay=False),
+    help="JSON lines file the phase record is appended to.",
+)
+@click.option(
+    "--log",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="File to write the command's stdout and stderr to.",
+)
+@click.argument("command", nargs=-1, required=True, type=click.UNPROCESSED)
+def main(phase, results, log, command):
+    started_at = datetime.now(timezone.utc)
+    wall_start = time.perf_counter()
+    returncode = None
+    status = "failed"
+
+    log_fp = open(log, "w") if log is not None else None
+    try:
+        returncode = subprocess.call(
+            command, stdout=log_fp, stderr=subprocess.STDOUT if log_fp else None
+        )
+        status = "ok" if returncode == 0 else "failed"
+    except KeyboardInterrupt:
+        status = "interrupted"
+    finally:
+        wall_s = time.perf_counter() - wall_start
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if log_fp is not None:
+            log_fp.close()
+        append_phase(
+            results,
+            {
+                "phase": phase,
+                "started_at": started_at.isoformat(),
+                "wall_s": wall_s,
+                "cpu_s": usage.ru_utime + usage.ru_stime,
+                "peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+                "status": status,
+                "returncode": returncode,
+                "command": " ".join(command),
+                "log": log,
+            },
+        )
+
+    sys.exit(returncode if returncode is not None else 130)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Vectorized preprocessing shared by the geography and population loaders.
+
+Also provides `PreprocessCache`, an on-disk cache of load-ready frames keyed by
+the content of the raw input, so repeated runs can skip preprocessing.
+"""
+
+import hashlib
+import json
+import os
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import is_object_dtype, is_string_dtype
+from pyarrow import feather
+
+try:
+    import geopandas as gpd
+except ImportError:
+    gpd = None
+
+# Bump when preprocessing changes in a way that invalidates cached frames.
+PREPROCESS_VERSION = 2
+
+
+def sanitize_paths(df: pd.DataFrame) -> pd.DataFrame:
+    """Replaces every '/' with '--' in the string values of `df`.
+
+    Some geographies have a '/' in the geoid, which will mess up the path. Only
+    object/string columns are inspected (geometry and numeric columns are left
+    alone) and columns without a '/' are skipped entirely, so in the common case
+    this costs one vectorized scan per string column and no copies.
+    """
+    df = df.copy(deep=False)
+    for col in df.columns:
+        series = df[col]
+        if not (is_object_dtype(series.dtype) or is_string_dtype(series.dtype)):
+            continue
+
+        try:
+            has_slash = series.str.contains("/", regex=False, na=False).astype(bool)
+        except AttributeError:
+            # Object column without any string values.
+            continue
+
+        if has_slash.any():
+            df[col] = series.where(
+                ~has_slash, series.str.replace("/", "--", regex=False)
+            )
+    return df
+
+
+def build_geoids(df: pd.DataFrame, id_cols: tuple) -> pd.Series:
+    """Concatenates the Census identifier columns `id_cols` into full geoids.
+
+    Equivalent to `df[list(id_cols)].agg("".join, axis=1)`, but concatenates
+    whole string arrays at once instead of joining row by row.
+    """
+    first, *rest = id_cols
+    geoids = df[first].astype(str)
+    if rest:
+        geoids = geoids.str.cat([df[col].astype(str) for col in rest])
+    return geoids
+
+
+# The Fallon Paiute-Shoshone name has an extra (Reservation/Colony) appended
+# on one of its R/T parts, so its names are allowed to differ.
+RES_TRUST_NAME_EXCEPTIONS = ("aiannh:1075:fips32", "aiannh:1070:fips32")
+
+
+def merge_res_trust_collisions(
+    layer_gdf: "gpd.GeoDataFrame", index_col: str, yr: str
+) -> "gpd.GeoDataFrame":
+    """Merges AIANNH geographies that share a geoid across their R and T parts.
+
+    Colliding pairs are dissolved per geoid: land and water areas are summed,
+    geometries are unioned and `res_trust_class` becomes "union". Every other
+    column keeps the value of the first row of the pair.
+    """
+    group_sizes = layer_gdf.groupby(index_col)[index_col].transform("size")
+    if (group_sizes > 2).any():
+        bad_geoid = layer_gdf.loc[group_sizes > 2, index_col].iloc[0]
+        raise ValueError(f"There has been a collision of 3 geoids {bad_geoid}")
+
+    collided = layer_gdf[group_sizes == 2]
+
+    name_counts = collided.groupby(index_col)[f"NAME{yr}"].nunique()
+    mismatched = name_counts[
+        (name_counts > 1) & ~name_counts.index.isin(RES_TRUST_NAME_EXCEPTIONS)
+    ]
+    if len(mismatched):
+        bad_geoid = mismatched.index[0]
+        bad_names = collided.loc[collided[index_col] == bad_geoid, f"NAME{yr}"]
+        raise ValueError(
+            f"NAME{yr} does not match across R and T land in geoid {bad_geoid} "
+            f'("{bad_names.iloc[0]}" vs. "{bad_names.iloc[1]}")'
+        )
+
+    aggfunc = {
+        col: "first"
+        for col in collided.columns
+        if col not in (index_col, collided.geometry.name)
+    }
+    aggfunc[f"ALAND{yr}"] = "sum"
+    aggfunc[f"AWATER{yr}"] = "sum"
+    merged = collided.dissolve(by=index_col, aggfunc=aggfunc).reset_index()
+    merged["res_trust_class"] = "union"
+
+    return pd.concat([layer_gdf[group_sizes == 1], merged], ignore_index=True)
+
+
+def file_sha256(path: str, chunk_size: int = 2**20) -> str:
+    """Computes the SHA256 hex digest of a file without reading it all into memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(kind: str, input_hash: str, **params) -> str:
+    """Derives a cache key from the hash of a raw input and its preprocessing params.
+
+    `params` should include everything preprocessing depends on (level, year,
+    the contents of config files, ...).
+    """
+    payload = json.dumps(
+        {
+            "kind": kind,
+            "input": input_hash,
+            "version": PREPROCESS_VERSION,
+            **params,
+        },
+        sort_keys=True,
+    )
+    return f"{kind}-{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+class PreprocessCache:
+    """On-disk cache of preprocessed, load-ready (Geo)DataFrames.
+
+    Frames are stored as uncompressed Feather (Arrow IPC) files so they can be
+    memory-mapped on read, alongside a small JSON sidecar for any extra
+    preprocessing results. Entries are evicted least-recently-used first once
+    the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 20 * 2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        base = os.path.join(self.directory, key)
+        return f"{base}.feather", f"{base}.json"
+
+    def get(self, key: str) -> Optional[tuple[pd.DataFrame, dict]]:
+        """Returns the cached frame and extras for `key`, or `None` on a miss."""
+        frame_path, extras_path = self._paths(key)
+        if not (os.path.exists(frame_path) and os.path.exists(extras_path)):
+            return None
+
+        with open(extras_path) as fp:
+            extras = json.load(fp)
+
+        if extras.pop("_geo", False):
+            df = gpd.read_feather(frame_path, memory_map=True)
+        else:
+            df = feather.read_table(frame_path, memory_map=True).to_pandas()
+
+        # Bump the modification times so LRU eviction sees this entry as used.
+        os.utime(frame_path)
+        os.utime(extras_path)
+        return df, extras
+
+    def put(self, key: str, df: pd.DataFrame, extras: Optional[dict] = None) -> None:
+        """Stores `df` (and JSON-serializable `extras`) under `key`."""
+        frame_path, extras_path = self._paths(key)
+        is_geo = gpd is not None and isinstance(df, gpd.GeoDataFrame)
+
+        # Write to temporary paths first so an interrupted write never leaves
+        # a partial entry behind.
+        if is_geo:
+            df.to_feather(f"{frame_path}.tmp", compression="uncompressed")
+        else:
+            feather.write_feather(
+                pa.Table.from_pandas(df),
+                f"{frame_path}.tmp",
+                compression="uncompressed",
+            )
+        with open(f"{extras_path}.tmp", "w") as fp:
+            json.dump({**(extras or {}), "_geo": is_geo}, fp)
+
+        os.replace(f"{frame_path}.tmp", frame_path)
+        os.replace(f"{extras_path}.tmp", extras_path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Removes least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".feather"):
+                continue
+            frame_path = os.path.join(self.directory, name)
+            stat = os.stat(frame_path)
+            entries.append((stat.st_mtime, stat.st_size, frame_path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, frame_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            extras_path = frame_path[: -len(".feather")] + ".json"
+            for path in (frame_path, extras_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
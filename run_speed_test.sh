@@ -28,6 +28,38 @@ function show_help() {
     echo "  -l, --large       Run speed test on WY Block data. (Will take ~20-30 minutes.)"
     echo "  -x, --extreme     Run speed test on TX Block data. (Will take a couple of hours.)"
     echo "                      Overwrites --large flag."
+    echo "  -b, --batch-size N  Stream the geography parquet and load it in batches of N rows."
+    echo "  -w, --geo-workers N Load geographies county by county on N worker processes."
+    echo "  -m, --bulk-map    Map geographies to counties in one bulk statement."
+    echo "  -c, --cache-dir DIR Reuse preprocessed geo and pop frames cached in DIR."
+    echo "  -k, --checkpoint  Commit the geo load county by county and the pop load chunk"
+    echo "                      by chunk, writing progress manifests to the results"
+    echo "                      directory. Rerunning this script resets the database, so"
+    echo "                      resume by rerunning the failed loader by hand with"
+    echo "                      --checkpoint=<results dir>/checkpoints/<geo|pop>_load.json."
+    echo "  -e, --pop-engine ENGINE  Column value loading engine for the pop load:"
+    echo "                      orm (default) or copy."
+    echo "  -g, --csr-graph   Load the graph from the compact CSR format with a streamed upload."
+    echo "  -W, --server-workers N  Number of API server worker processes. (Default: CPU count.)"
+    echo "  -S, --worker-sweep LIST Rerun the view benchmarks with each comma-separated"
+    echo "                      number of server workers (e.g. 1,2,4,8)."
+    echo "  -d, --dev-server  Run a single-worker API server with auto-reload instead."
+    echo "  -z, --compression-level N   Server response compression level."
+    echo "  -Z, --compression-codecs LIST  Comma-separated codecs the server may negotiate"
+    echo "                      (zstd, br, gzip), in order of preference."
+    echo "  -P, --localhost-passthrough Send responses to localhost uncompressed."
+    echo "  -r, --reuse-views Let the server reuse stored renders for identical views (same"
+    echo "                      template, locality, layer, graph and data); views are"
+    echo "                      still created, only their rendering is skipped."
+    echo "  -p, --profile-sql Run the database with pg_stat_statements and auto_explain and"
+    echo "                      write the top statements and slowest plans of every phase"
+    echo "                      to the results directory."
+    echo "  -s, --snapshot PHASE  Restore the database snapshot taken after PHASE (e.g."
+    echo "                      pop_load) and skip every phase up to it, or take the"
+    echo "                      snapshot after PHASE if none matches the current inputs."
+    echo "  -j, --snapshot-jobs N   Parallel pg_dump/pg_restore jobs. (Default: CPU count.)"
+    echo "  -t, --load-test LEVELS  Also run the concurrent view load test at these"
+    echo "                      comma-separated client counts (e.g. 1,2,4,8)."
     echo "  -h, --help        Show this help message and exit."
     echo
 }
@@ -36,6 +68,18 @@ function show_help() {
 # Default values
 large=0
 extreme=0
+geo_load_args=()
+pop_load_args=()
+graph_load_args=()
+load_test_levels=""
+server_workers=$(python -c "import os; print(os.cpu_count())")
+worker_sweep=""
+server_args=()
+profile_sql=0
+snapshot_phase=""
+checkpoint=0
+reuse_views=0
+snapshot_jobs=$(python -c "import os; print(os.cpu_count())")
 
 # Parse options
 while [[ $# -gt 0 ]]; do
@@ -48,6 +92,79 @@ while [[ $# -gt 0 ]]; do
       extreme=1
       shift
       ;;
+    -b|--batch-size)
+      geo_load_args+=("--batch-size=$2")
+      shift 2
+      ;;
+    -w|--geo-workers)
+      geo_load_args+=("--workers=$2")
+      shift 2
+      ;;
+    -m|--bulk-map)
+      geo_load_args+=("--bulk-map")
+      shift
+      ;;
+    -k|--checkpoint)
+      checkpoint=1
+      shift
+      ;;
+    -e|--pop-engine)
+      pop_load_args+=("--engine=$2")
+      shift 2
+      ;;
+    -g|--csr-graph)
+      graph_load_args+=("--format=csr")
+      shift
+      ;;
+    -W|--server-workers)
+      server_workers=$2
+      shift 2
+      ;;
+    -S|--worker-sweep)
+      worker_sweep=$2
+      shift 2
+      ;;
+    -d|--dev-server)
+      server_args+=("--dev")
+      shift
+      ;;
+    -z|--compression-level)
+      server_args+=("--compression-level=$2")
+      shift 2
+      ;;
+    -Z|--compression-codecs)
+      server_args+=("--compression-codecs=$2")
+      shift 2
+      ;;
+    -P|--localhost-passthrough)
+      server_args+=("--localhost-passthrough")
+      shift
+      ;;
+    -r|--reuse-views)
+      reuse_views=1
+      shift
+      ;;
+    -p|--profile-sql)
+      profile_sql=1
+      shift
+      ;;
+    -s|--snapshot)
+      snapshot_phase=$2
+      shift 2
+      ;;
+    -j|--snapshot-jobs)
+      snapshot_jobs=$2
+      shift 2
+      ;;
+    -t|--load-test)
+      load_test_levels=$2
+      shift 2
+      ;;
+    -c|--cache-dir)
+      geo_load_args+=("--cache-dir=$2")
+      pop_load_args+=("--cache-dir=$2")
+      shift 2
+      ;;
     -h|--help)
       show_help
       exit 0 
@@ -95,26 +212,52 @@ if [ $? -ne 0 ]; then
 fi
 
 
+RESULTS_DIR="./results/speed_test_$(date +%Y%m%dT%H%M%S)"
+RESULTS_FILE="$RESULTS_DIR/phases.jsonl"
+COMPRESSION_STATS_FILE="$RESULTS_DIR/compression.jsonl"
+mkdir -p "$RESULTS_DIR"
+if [ $checkpoint -eq 1 ]; then
+    geo_load_args+=("--checkpoint=$RESULTS_DIR/checkpoints/geo_load.json")
+    pop_load_args+=("--checkpoint=$RESULTS_DIR/checkpoints/pop_load.json")
+fi
+if [ $reuse_views -eq 1 ]; then
+    server_args+=("--view-reuse-dir=$RESULTS_DIR/view_reuse")
+fi
+
+
 # =============================
 # Getting uvicorn server set up
 # =============================
 echo 
 
-uvicorn uvicorn_runner:app --reload --port 8000 > LOG_uvicorn.log 2>&1 &
-uvicorn_pid=$!
-
-# Wait for the server to finish setting up
-sleep 3
-
-echo "Checking for uvicorn server..."
-lsof -i :8000 | grep uvicorn > /dev/null
+# Starts the API server with the given number of workers (production mode
+# unless --dev-server was passed) and waits for it to answer health checks.
+start_server() {
+    local workers=$1
+    python uvicorn_runner.py --port 8000 --workers "$workers" "${server_args[@]}" \
+        --compression-stats "$COMPRESSION_STATS_FILE" \
+        --metrics-dir "$RESULTS_DIR/metrics" > LOG_uvicorn.log 2>&1 &
+    uvicorn_pid=$!
+
+    echo "Checking for uvicorn server..."
+    for _ in $(seq 1 60); do
+        if curl -sf http://localhost:8000/health > /dev/null; then
+            echo "Found uvicorn server running on port 8000 with $workers worker(s)!"
+            return 0
+        fi
+        sleep 0.5
+    done
 
-if [ $? -ne 0 ]; then
-    echo "Could not find uvicorn server running on port 8000. Please start the server before running this script."
+    echo "Could not find uvicorn server running on port 8000. See LOG_uvicorn.log for details."
     exit 1
-fi 
+}
 
-echo "Found uvicorn server running on port 8000!"
+stop_server() {
+    kill $uvicorn_pid 2> /dev/null
+    wait $uvicorn_pid 2> /dev/null
+}
+
+start_server $server_workers
 echo 
 
 # =====================
@@ -135,7 +278,11 @@ echo "Creating docker volume for database use in speed test..."
 docker volume remove db_speed_test_data > /dev/null 2>&1
 docker volume create db_speed_test_data > /dev/null
 echo "Setting up docker containers..."
-docker compose up -d 
+compose_files=(-f docker-compose.yml)
+if [ $profile_sql -eq 1 ]; then
+    compose_files+=(-f docker-compose.profile.yml)
+fi
+docker compose "${compose_files[@]}" up -d 
 
 
 echo "Checking for docker container on port 54320..."
@@ -166,107 +313,87 @@ psql -U postgres -h localhost -p 54320 -d postgres -tc "SELECT 1 FROM pg_databas
 psql -U postgres -h localhost -p 54320 -d postgres -c "CREATE DATABASE gerrydb;"
 psql -U postgres -h localhost -p 54320 -d gerrydb -c "CREATE EXTENSION IF NOT EXISTS postgis;"
 
+echo "Writing phase results to $RESULTS_FILE"
+
+
+# ==================
+# Database snapshots
+# ==================
+# Phases already covered by a restored snapshot are skipped by run_phase.
+skipped_phases=""
+snapshot_args=(--phase "$snapshot_phase" --large=$large --extreme=$extreme)
+
+if [ -n "$snapshot_phase" ]; then
+    if python snapshot.py exists "${snapshot_args[@]}"; then
+        echo "Restoring database snapshot taken after $snapshot_phase..."
+        python snapshot.py restore "${snapshot_args[@]}" --jobs "$snapshot_jobs" || exit 1
+        skipped_phases=$(python -c "from snapshot import PHASES; \
+print(' '.join(PHASES[: PHASES.index('$snapshot_phase') + 1]))")
+
+        # The restore drops the database under the server's connection pool.
+        stop_server
+        start_server $server_workers
+    else
+        echo "No snapshot after $snapshot_phase matches the current inputs; it will be taken."
+    fi
+fi
+
+# With --profile-sql, clears the statement statistics before a phase and writes
+# the phase's top statements and slowest plans to $RESULTS_DIR/pg_profile after.
+profile_start() {
+    if [ $profile_sql -eq 1 ]; then
+        profile_since=$(date -u +%Y-%m-%dT%H:%M:%SZ)
+        python pg_profile.py reset
+    fi
+}
+
+profile_dump() {
+    if [ $profile_sql -eq 1 ]; then
+        python pg_profile.py dump --phase "$1" --output-dir "$RESULTS_DIR/pg_profile" \
+            --since "$profile_since"
+    fi
+}
+
+# Runs a phase under phase_timer.py, which appends its wall-clock, CPU time and
+# peak RSS to $RESULTS_FILE and writes its output to $RESULTS_DIR/LOG_<phase>.log
+run_phase() {
+    local phase=$1
+    shift
+    if [[ " $skipped_phases " == *" $phase "* ]]; then
+        echo "Skipping $phase (restored from snapshot)"
+        return 0
+    fi
+    profile_start
+    python phase_timer.py \
+        --phase "$phase" \
+        --results "$RESULTS_FILE" \
+        --log "$RESULTS_DIR/LOG_$phase.log" \
+        -- "$@"
+    local status=$?
+    profile_dump "$phase"
+    if [ $status -eq 0 ] && [ "$phase" == "$snapshot_phase" ]; then
+        python snapshot.py save "${snapshot_args[@]}" --jobs "$snapshot_jobs" \
+            > "$RESULTS_DIR/LOG_snapshot.log" 2>&1
+    fi
+    return $status
+}
+
 
 # =======================
 # Initialize the database
 # =======================
-python gerrydb_init.py --name=test_user --email=test@test.com --reset --use-test-key > /dev/null <<EOF
+run_phase db_init python gerrydb_init.py --name=test_user --email=test@test.com --reset --use-test-key <<EOF
 y
 EOF
 
-years=( "2010" "2020" )
-
-# Just doing the central spine levels for speed testing
-levels=(
-    "state"
-    "county"
-    "tract"
-    "bg"
-    "block"
-)
-pl_source_url="https://www2.census.gov/geo/tiger/TIGER2020PL/"
-base_dir="$( dirname -- "$0"; )"
-
 SECONDS=0
-python -m gerrydb_etl.bootstrap.pl_localities 1> LOG_localities.log 2>&1 & run_with_spinner "Bootstrapping localities..."
+run_phase localities python -m gerrydb_etl.bootstrap.pl_localities & run_with_spinner "Bootstrapping localities..."
 echo "Time to bootstrap localities: $SECONDS s"
-# pg_restore -U postgres -h localhost -p 54320 -d gerrydb -c -Ft ./wy_init.tar
 
 SECONDS=0
-(
-    for year in "${years[@]}"
-    do
-        python -m gerrydb.create namespace \
-            "census.$year" \
-            --description "$year U.S. Census PL 94-171 release" \
-            --public
-    done
-) & run_with_spinner "Bootstrapping Census namespaces..."
-echo "Time to bootstrap namespaces: $SECONDS s"
-
-
-SECONDS=0
-(
-    for year in "${years[@]}"
-    do
-        python -m gerrydb.create geo-layer \
-            block \
-            --namespace "census.$year" \
-            --description "$year U.S. Census blocks" \
-            --source-url $pl_source_url
-
-        python -m gerrydb.create geo-layer \
-            bg \
-            --namespace "census.$year" \
-            --description "$year U.S. Census block groups" \
-            --source-url $pl_source_url
-
-        python -m gerrydb.create geo-layer \
-            tract \
-            --namespace "census.$year" \
-            --description "$year U.S. Census tracts" \
-            --source-url $pl_source_url
-
-        python -m gerrydb.create geo-layer \
-            county \
-            --namespace "census.$year" \
-            --description "$year U.S. Census counties" \
-            --source-url $pl_source_url 
-
-        python -m gerrydb.create geo-layer \
-            state \
-            --namespace "census.$year" \
-            --description "$year U.S. Census states" \
-            --source-url $pl_source_url 
-    done
-) & run_with_spinner "Bootstrapping geographic layers..."
-echo "Time to bootstrap geographic layers: $SECONDS s"
-
-echo "" > LOG_geo_columns.log
-SECONDS=0
-(
-    for year in "${years[@]}"
-    do
-        python -m gerrydb_etl.bootstrap.templated_columns \
-            --namespace "census.$year" \
-            --template "./pl_geo.yaml" \
-            --yr "${year:2:2}" \
-            --year $year >> LOG_geo_columns.log 2>&1 
-    done
-) & run_with_spinner "Creating Census geographic columns... "
-echo "Time to create geographic columns: $SECONDS s"
-
-echo "" > LOG_pop_columns.log
-SECONDS=0
-(
-    for year in "${years[@]}"
-    do
-        python -m gerrydb_etl.bootstrap.pl_pop_table_columns \
-            --namespace "census.$year" \
-            --year $year > LOG_pop_columns.log 2>&1
-    done
-) & run_with_spinner "Creating Census PL 94-171 population columns..."
-echo "Time to create population columns: $SECONDS s"
+run_phase bootstrap python bootstrap.py --manifest bootstrap.yaml \
+    --phase-results "$RESULTS_FILE" & run_with_spinner "Bootstrapping Census namespaces, geographic layers and columns..."
+echo "Time to bootstrap namespaces, layers and columns: $SECONDS s"
 
 
 # ===============
@@ -276,23 +403,60 @@ echo "Time to create population columns: $SECONDS s"
 echo
 
 SECONDS=0
-python load_test_geo.py --large=$large --extreme=$extreme > /dev/null 2>&1 & run_with_spinner "Running load_wy_geo.py..."
+run_phase geo_load python load_test_geo.py --large=$large --extreme=$extreme \
+    --phase-results "$RESULTS_FILE" "${geo_load_args[@]}" & run_with_spinner "Running load_test_geo.py..."
 echo
 echo "Time to load geo: $SECONDS s"
 echo
 SECONDS=0
-python load_test_graph.py --large=$large --extreme=$extreme > /dev/null 2>&1 & run_with_spinner "Running load_wy_graph.py..."
+run_phase graph_load python load_test_graph.py --large=$large --extreme=$extreme "${graph_load_args[@]}" & run_with_spinner "Running load_test_graph.py..."
 echo
 echo "Time to load graph: $SECONDS s"
 echo
 SECONDS=0
-python load_test_pop.py --large=$large --extreme=$extreme > /dev/null 2>&1 & run_with_spinner "Running load_wy_pop.py..."
+run_phase pop_load python load_test_pop.py --large=$large --extreme=$extreme \
+    --phase-results "$RESULTS_FILE" "${pop_load_args[@]}" & run_with_spinner "Running load_test_pop.py..."
 echo
 echo "Time to load pop: $SECONDS s"
 echo
 
 
-python make_views.py --large=$large --extreme=$extreme
+profile_start
+python make_views.py --large=$large --extreme=$extreme \
+    --output "$RESULTS_DIR/views.json" \
+    --phase-results "$RESULTS_FILE" \
+    --graph-cache-dir ./.graph_cache \
+    --compression-stats "$COMPRESSION_STATS_FILE" \
+    --label "server_workers=$server_workers"
+profile_dump make_views
+
+for workers in ${worker_sweep//,/ }; do
+    echo
+    echo "Restarting server with $workers worker(s) for the worker sweep..."
+    stop_server
+    start_server $workers
+    profile_start
+    python make_views.py --large=$large --extreme=$extreme \
+        --output "$RESULTS_DIR/views_workers_$workers.json" \
+        --phase-results "$RESULTS_FILE" \
+        --graph-cache-dir ./.graph_cache \
+        --compression-stats "$COMPRESSION_STATS_FILE" \
+        --label "server_workers=$workers" \
+        --path-prefix "sweep_w$workers"
+    profile_dump "make_views_workers_$workers"
+done
+
+if [ -n "$load_test_levels" ]; then
+    profile_start
+    python view_load_test.py --large=$large --extreme=$extreme \
+        --concurrency "$load_test_levels" \
+        --output "$RESULTS_DIR/view_load.json" \
+        --phase-results "$RESULTS_FILE"
+    profile_dump view_load_test
+fi
+
+echo
+echo "Phase results written to $RESULTS_FILE"
 
 
 # ==============================
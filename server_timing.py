@@ -0,0 +1,251 @@
+"""Per-request phase timings for the API server.
+
+`ServerTimingMiddleware` tracks every request in a `RequestTimings` object held
+in a context variable. The phases are filled in from three places:
+
+    * SQL time and query count, from SQLAlchemy cursor events on every engine
+      (`install_db_listeners`),
+    * response model serialization, by wrapping FastAPI's `serialize_response`
+      (`install_serialization_timer`), and
+    * compression, reported by `compression.CompressionMiddleware` via `record`.
+
+Timings known when the response headers go out are sent in a `Server-Timing`
+header (durations in milliseconds). Complete timings, including bytes sent and
+total time, are aggregated per route in `TimingMetrics` for the `/metrics`
+endpoint. Each worker process keeps its own aggregates; given a directory shared
+by the workers, every worker persists them there and `/metrics` merges them.
+"""
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import fastapi.routing
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@dataclass
+class RequestTimings:
+    """Phase timings of a single request (seconds)."""
+
+    db_s: float = 0.0
+    db_queries: int = 0
+    serialize_s: float = 0.0
+    compress_s: float = 0.0
+    headers_s: float = 0.0
+    total_s: float = 0.0
+    bytes_out: int = 0
+
+    def header(self) -> bytes:
+        """`Server-Timing` header value for the phases known so far."""
+        other_s = max(
+            self.headers_s - self.db_s - self.serialize_s - self.compress_s, 0.0
+        )
+        return (
+            f'db;dur={self.db_s * 1e3:.3f};desc="{self.db_queries} queries", '
+            f"serialize;dur={self.serialize_s * 1e3:.3f}, "
+            f"compress;dur={self.compress_s * 1e3:.3f}, "
+            f"app;dur={other_s * 1e3:.3f}, "
+            f"total;dur={self.headers_s * 1e3:.3f}"
+        ).encode()
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def record(phase: str, seconds: float) -> None:
+    """Adds `seconds` to `phase` ("db", "serialize" or "compress") of the
+    current request, if there is one."""
+    timings = _current_timings.get()
+    if timings is not None:
+        setattr(timings, f"{phase}_s", getattr(timings, f"{phase}_s") + seconds)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.db_s += elapsed
+        timings.db_queries += 1
+
+
+def install_db_listeners() -> None:
+    """Times every SQL statement executed through any SQLAlchemy engine."""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def install_serialization_timer() -> None:
+    """Times FastAPI's response model validation and encoding.
+
+    FastAPI looks `serialize_response` up in `fastapi.routing` on every request,
+    so wrapping the module attribute covers all routes.
+    """
+    serialize_response = fastapi.routing.serialize_response
+    if getattr(serialize_response, "_timed", False):
+        return
+
+    async def timed_serialize_response(*args, **kwargs):
+        t_start = time.perf_counter()
+        try:
+            return await serialize_response(*args, **kwargs)
+        finally:
+            record("serialize", time.perf_counter() - t_start)
+
+    timed_serialize_response._timed = True
+    fastapi.routing.serialize_response = timed_serialize_response
+
+
+def metrics_config_from_env() -> dict:
+    """Reads `TimingMetrics` settings from the environment."""
+    return {"store_dir": os.getenv("GERRYDB_METRICS_DIR") or None}
+
+
+class TimingMetrics:
+    """Per-route aggregates of request timings.
+
+    Without `store_dir` the aggregates cover this worker process only. With it,
+    every worker writes its aggregates to `<store_dir>/<pid>.json` and `snapshot`
+    merges the files of all workers. Requests only update the in-memory
+    aggregates; a background thread writes them at most every `save_interval`
+    seconds (and at exit), so other workers' figures can lag by that much.
+    """
+
+    def __init__(self, store_dir: Optional[str] = None, save_interval: float = 1.0):
+        self.routes = {}
+        self.store_dir = store_dir
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._saver = None
+        if store_dir is not None:
+            os.makedirs(store_dir, exist_ok=True)
+
+    def add(self, route: str, timings: RequestTimings) -> None:
+        with self._lock:
+            totals = self.routes.setdefault(
+                route, {"requests": 0, "max_total_s": 0.0, **asdict(RequestTimings())}
+            )
+            totals["requests"] += 1
+            totals["max_total_s"] = max(totals["max_total_s"], timings.total_s)
+            for key, value in asdict(timings).items():
+                totals[key] += value
+        if self.store_dir is not None:
+            self._dirty.set()
+            if self._saver is None:
+                # Started on first use, so that it runs in the worker process.
+                self._saver = threading.Thread(target=self._save_loop, daemon=True)
+                self._saver.start()
+                atexit.register(self.save)
+
+    def _save_loop(self) -> None:
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            self.save()
+            time.sleep(self.save_interval)
+
+    def save(self) -> None:
+        """Writes this worker's aggregates atomically to the shared directory."""
+        with self._lock:
+            routes = {route: dict(totals) for route, totals in self.routes.items()}
+        path = os.path.join(self.store_dir, f"{os.getpid()}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(routes, fp)
+        os.replace(tmp_path, path)
+
+    def merged_routes(self) -> tuple[dict, int]:
+        """Aggregates of all workers that wrote to `store_dir` (or of this worker
+        alone), and the number of workers they cover."""
+        if self.store_dir is None:
+            return self.routes, 1
+        # This worker's own figures are written first, so they are current.
+        self.save()
+
+        merged = {}
+        paths = glob.glob(os.path.join(self.store_dir, "*.json"))
+        for path in paths:
+            with open(path) as fp:
+                worker_routes = json.load(fp)
+            for route, worker_totals in worker_routes.items():
+                totals = merged.setdefault(route, dict.fromkeys(worker_totals, 0))
+                for key, value in worker_totals.items():
+                    if key == "max_total_s":
+                        totals[key] = max(totals[key], value)
+                    else:
+                        totals[key] += value
+        return merged, len(paths)
+
+    def snapshot(self) -> dict:
+        """Request counts, sums and means per route."""
+        routes, _ = self.merged_routes()
+        snapshot = {}
+        for route, totals in routes.items():
+            n = totals["requests"]
+            snapshot[route] = {
+                **totals,
+                **{
+                    f"mean_{key}": totals[key] / n
+                    for key in asdict(RequestTimings())
+                },
+            }
+        return snapshot
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware recording `RequestTimings` for every HTTP request.
+
+    Must be the outermost middleware so that its timings cover the whole stack
+    and `bytes_out` counts the bytes actually sent.
+    """
+
+    def __init__(self, app, metrics: TimingMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        t_start = time.perf_counter()
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start":
+                timings.headers_s = time.perf_counter() - t_start
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"server-timing", timings.header()),
+                    ],
+                }
+            elif message["type"] == "http.response.body":
+                timings.bytes_out += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            timings.total_s = time.perf_counter() - t_start
+            _current_timings.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or scope["path"]
+            self.metrics.add(f"{scope['method']} {route_path}", timings)
@@ -0,0 +1,252 @@
+"""Database snapshots for skipping the bootstrap and load phases of the speed test.
+
+A snapshot is a `pg_dump` directory-format dump of the `gerrydb` database taken
+after a given phase of `run_speed_test.sh`. It is stored under a content key
+derived from everything that determines the database at that point: the phase,
+the dataset, the bootstrap manifest and scripts, the loader scripts, the column
+config, the input data files and the installed gerrydb packages. Changing any of
+these gives a new key, so a stale snapshot is never restored.
+
+Usage:
+
+    python snapshot.py key --phase pop_load --large=1
+    python snapshot.py save --phase pop_load --large=1 --jobs 8
+    python snapshot.py restore --phase pop_load --large=1 --jobs 8
+
+`restore` exits with status 3 if no snapshot exists for the key.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+from urllib.parse import urlparse, urlunparse
+
+import click
+
+# Phases of run_speed_test.sh, in order, after which a snapshot can be taken.
+PHASES = [
+    "db_init",
+    "localities",
+    "bootstrap",
+    "geo_load",
+    "graph_load",
+    "pop_load",
+]
+
+# Files whose contents determine what the phases write to the database.
+SOURCE_FILES = [
+    "gerrydb_init.py",
+    "bootstrap.py",
+    "bootstrap.yaml",
+    "pl_geo.yaml",
+    "load_test_geo.py",
+    "load_test_graph.py",
+    "load_test_pop.py",
+    "preprocess.py",
+    "graph_format.py",
+    "geo_encoding.py",
+    "checkpoint.py",
+]
+
+PACKAGES = ["gerrydb", "gerrydb_meta", "gerrydb_etl"]
+
+NO_SNAPSHOT_EXIT_CODE = 3
+
+
+def dataset_dir(large: bool, extreme: bool) -> str:
+    return "./TX_data" if extreme else "./WY_data"
+
+
+def snapshot_key(phase: str, large: bool, extreme: bool) -> str:
+    """Content key of the database state after `phase`."""
+    if phase not in PHASES:
+        raise click.BadParameter(f"Unknown phase {phase!r}. Choose from {PHASES}.")
+
+    key = hashlib.sha256()
+    key.update(f"phase={phase};large={large};extreme={extreme}\n".encode())
+    key.update(f"GERRYDB_SERVER_BUILD={os.getenv('GERRYDB_SERVER_BUILD')}\n".encode())
+
+    for package in PACKAGES:
+        try:
+            version = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            version = None
+        key.update(f"{package}=={version}\n".encode())
+
+    for path in SOURCE_FILES:
+        if os.path.exists(path):
+            with open(path, "rb") as fp:
+                key.update(f"{path}:".encode() + hashlib.sha256(fp.read()).digest())
+
+    # The input data files are large, so they are fingerprinted by name, size and
+    # modification time rather than hashed in full. (Generated .npz files are
+    # derived from the pickles and left out.)
+    data_dir = dataset_dir(large, extreme)
+    for name in sorted(os.listdir(data_dir)):
+        if name.endswith((".parquet", ".pkl")):
+            stat = os.stat(os.path.join(data_dir, name))
+            key.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)}\n".encode())
+
+    return f"{phase}-{key.hexdigest()[:16]}"
+
+
+def database_uri() -> str:
+    return os.environ["GERRYDB_DATABASE_URI"]
+
+
+def maintenance_uri(uri: str) -> str:
+    """The same server, connected to the `postgres` database."""
+    return urlunparse(urlparse(uri)._replace(path="/postgres"))
+
+
+def snapshot_path(directory: str, key: str) -> str:
+    return os.path.join(directory, key)
+
+
+@click.group()
+def cli():
+    pass
+
+
+def snapshot_options(fn):
+    """Options shared by all commands: which snapshot and where snapshots live."""
+    options = [
+        click.option(
+            "--phase",
+            required=True,
+            type=click.Choice(PHASES),
+            help="Phase after which the snapshot is taken.",
+        ),
+        click.option("--large", type=int, help="Snapshot of the large data set."),
+        click.option("--extreme", type=int, help="Snapshot of the extreme data set."),
+        click.option(
+            "--directory",
+            type=click.Path(file_okay=False),
+            default="./.snapshots",
+            show_default=True,
+            help="Directory holding the snapshots.",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+@cli.command(name="key")
+@snapshot_options
+def print_key(phase, large, extreme, directory):
+    """Prints the snapshot key for the current inputs."""
+    print(snapshot_key(phase, large == 1, extreme == 1))
+
+
+@cli.command()
+@snapshot_options
+def exists(phase, large, extreme, directory):
+    """Exits with status 0 if a snapshot exists for the current inputs."""
+    path = snapshot_path(directory, snapshot_key(phase, large == 1, extreme == 1))
+    sys.exit(0 if os.path.exists(path) else NO_SNAPSHOT_EXIT_CODE)
+
+
+@cli.command()
+@snapshot_options
+@click.option(
+    "--jobs",
+    type=int,
+    default=os.cpu_count(),
+    show_default=True,
+    help="Parallel pg_dump jobs.",
+)
+def save(phase, large, extreme, directory, jobs):
+    """Dumps the database into a snapshot for the current inputs."""
+    snapshot_id = snapshot_key(phase, large == 1, extreme == 1)
+    path = snapshot_path(directory, snapshot_id)
+    if os.path.exists(path):
+        print(f"Snapshot {snapshot_id} already exists.")
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+
+    t_start = time.perf_counter()
+    subprocess.run(
+        [
+            "pg_dump",
+            f"--dbname={database_uri()}",
+            "--format=directory",
+            f"--jobs={jobs}",
+            "--compress=1",
+            f"--file={tmp_path}",
+        ],
+        check=True,
+    )
+    with open(os.path.join(tmp_path, "snapshot.json"), "w") as fp:
+        json.dump(
+            {
+                "key": snapshot_id,
+                "phase": phase,
+                "large": large == 1,
+                "extreme": extreme == 1,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            },
+            fp,
+        )
+    # Only complete dumps are ever found under the key.
+    os.replace(tmp_path, path)
+    print(f"Saved snapshot {snapshot_id} in {time.perf_counter() - t_start:.1f} s")
+
+
+@cli.command()
+@snapshot_options
+@click.option(
+    "--jobs",
+    type=int,
+    default=os.cpu_count(),
+    show_default=True,
+    help="Parallel pg_restore jobs.",
+)
+def restore(phase, large, extreme, directory, jobs):
+    """Recreates the database from the snapshot for the current inputs."""
+    snapshot_id = snapshot_key(phase, large == 1, extreme == 1)
+    path = snapshot_path(directory, snapshot_id)
+    if not os.path.exists(path):
+        print(f"No snapshot {snapshot_id} to restore.")
+        sys.exit(NO_SNAPSHOT_EXIT_CODE)
+
+    uri = database_uri()
+    db_name = urlparse(uri).path.lstrip("/")
+
+    t_start = time.perf_counter()
+    # The dump recreates every object (including the PostGIS extension), so it
+    # is restored into an empty database.
+    for statement in (
+        f'DROP DATABASE IF EXISTS "{db_name}" WITH (FORCE)',
+        f'CREATE DATABASE "{db_name}"',
+    ):
+        subprocess.run(
+            ["psql", maintenance_uri(uri), "-v", "ON_ERROR_STOP=1", "-c", statement],
+            check=True,
+        )
+    subprocess.run(
+        [
+            "pg_restore",
+            f"--dbname={uri}",
+            f"--jobs={jobs}",
+            "--no-owner",
+            path,
+        ],
+        check=True,
+    )
+    print(
+        f"Restored snapshot {snapshot_id} in {time.perf_counter() - t_start:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from checkpoint import LoadManifest
+
+LOAD = {"loader": "geo", "file": "56_county_2010.parquet", "chunk_size": 10_000}
+
+
+def test_resume_skips_committed_units(tmp_path):
+    path = str(tmp_path / "checkpoints" / "geo.json")
+    manifest = LoadManifest(path, LOAD)
+    manifest.mark_done("county:001", rows=10)
+    manifest.mark_done("county:003", rows=5)
+
+    resumed = LoadManifest(path, LOAD)
+
+    assert len(resumed) == 2
+    assert "county:001" in resumed
+    assert "county:005" not in resumed
+    assert resumed.rows == 15
+    units = ["county:001", "county:003", "county:005"]
+    assert [unit for unit in units if unit not in resumed] == ["county:005"]
+
+
+def test_different_load_is_rejected(tmp_path):
+    path = str(tmp_path / "geo.json")
+    LoadManifest(path, LOAD).mark_done("county:001", rows=10)
+
+    with pytest.raises(ValueError, match="different load"):
+        LoadManifest(path, {**LOAD, "chunk_size": 5_000})
+
+
+def test_save_is_atomic(tmp_path, monkeypatch):
+    path = str(tmp_path / "geo.json")
+    manifest = LoadManifest(path, LOAD)
+    manifest.mark_done("county:001", rows=10)
+
+    def fail_dump(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(json, "dump", fail_dump)
+    with pytest.raises(OSError):
+        manifest.mark_done("county:003", rows=5)
+    monkeypatch.undo()
+
+    # The manifest on disk is the last complete one.
+    with open(path) as fp:
+        saved = json.load(fp)
+    assert list(saved["units"]) == ["county:001"]
+    assert LoadManifest(path, LOAD).rows == 10
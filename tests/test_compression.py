@@ -0,0 +1,60 @@
+import asyncio
+
+from compression import IDENTITY, CompressionMiddleware, read_stats
+
+
+def run(middleware, client="10.0.0.1", accept_encoding=b"gzip"):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/api/v1/views/census.2010",
+        "headers": [(b"accept-encoding", accept_encoding)],
+        "client": (client, 50000),
+    }
+    asyncio.run(middleware(scope, receive, send))
+    return messages
+
+
+async def chunked_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 201, "headers": []})
+    for i in range(3):
+        await send(
+            {"type": "http.response.body", "body": b"a" * 2000, "more_body": i < 2}
+        )
+
+
+def test_localhost_passthrough_is_recorded(tmp_path):
+    stats_path = str(tmp_path / "compression.jsonl")
+    middleware = CompressionMiddleware(
+        chunked_app, localhost_passthrough=True, stats_path=stats_path
+    )
+
+    messages = run(middleware, client="127.0.0.1")
+
+    assert b"".join(m.get("body", b"") for m in messages) == b"a" * 6000
+    (record,), _ = read_stats(stats_path)
+    assert record["codec"] == IDENTITY
+    assert record["bytes_in"] == record["bytes_out"] == 6000
+
+
+def test_compressed_response_is_recorded(tmp_path):
+    stats_path = str(tmp_path / "compression.jsonl")
+    middleware = CompressionMiddleware(
+        chunked_app, codecs=["gzip"], stats_path=stats_path
+    )
+
+    messages = run(middleware)
+
+    assert dict(messages[0]["headers"])[b"content-encoding"] == b"gzip"
+    (record,), _ = read_stats(stats_path)
+    assert record["codec"] == "gzip"
+    assert record["bytes_in"] == 6000
+    assert record["bytes_out"] < 6000
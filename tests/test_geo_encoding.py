@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import shapely
+
+from geo_encoding import ENCODINGS, decode, encode, quantize
+
+
+def polygon_mix():
+    square = shapely.box(-105.0, 41.0, -104.0, 42.0)
+    with_hole = shapely.Polygon(
+        [(-104.0, 41.0), (-103.0, 41.0), (-103.0, 42.0), (-104.0, 42.0)],
+        holes=[[(-103.75, 41.25), (-103.25, 41.25), (-103.25, 41.75)]],
+    )
+    two_parts = shapely.MultiPolygon(
+        [
+            shapely.box(-110.123456789, 44.987654321, -109.5, 45.0),
+            shapely.box(-109.25, 44.5, -109.0, 44.75),
+        ]
+    )
+    return np.array([square, two_parts, with_hole], dtype=object)
+
+
+@pytest.mark.parametrize("grid_size", [0, 1e-6, 1e-3])
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_round_trip(encoding, grid_size):
+    geometries = quantize(polygon_mix(), grid_size)
+
+    decoded = decode(encode(geometries, encoding), encoding)
+
+    assert len(decoded) == len(geometries)
+    assert shapely.equals(decoded, geometries).all()
+    np.testing.assert_array_equal(
+        shapely.get_coordinates(decoded), shapely.get_coordinates(geometries)
+    )
+    if encoding.startswith("geoarrow"):
+        # Polygons are promoted to single-part multipolygons.
+        assert (
+            shapely.get_type_id(decoded) == shapely.GeometryType.MULTIPOLYGON
+        ).all()
+    else:
+        assert shapely.equals_exact(decoded, geometries, tolerance=0).all()
+
+
+def test_quantize_snaps_to_grid():
+    quantized = quantize(polygon_mix(), 1e-3)
+
+    coords = shapely.get_coordinates(quantized)
+    np.testing.assert_allclose(coords, np.round(coords / 1e-3) * 1e-3, atol=1e-9)
+    assert shapely.is_valid(quantized).all()
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        encode(polygon_mix(), "geojson")
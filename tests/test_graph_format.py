@@ -0,0 +1,53 @@
+import networkx as nx
+import numpy as np
+
+from graph_format import edges_to_csr, graph_to_csr, load_csr, save_csr
+
+
+def edge_set(csr):
+    return {
+        frozenset((str(csr.geoids[u]), str(csr.geoids[v])))
+        for chunk in csr.iter_edge_chunks(2)
+        for u, v in chunk
+    }
+
+
+def test_csr_round_trip(tmp_path):
+    graph = nx.Graph()
+    graph.add_edges_from(
+        [("56001", "56003"), ("56003", "56005"), ("56001", "56005"), ("56005", "56007")]
+    )
+    graph.add_node("56009")  # isolated nodes are kept
+    path = str(tmp_path / "graph.npz")
+
+    csr = graph_to_csr(graph)
+    save_csr(csr, path)
+    loaded = load_csr(path)
+
+    np.testing.assert_array_equal(loaded.geoids, csr.geoids)
+    np.testing.assert_array_equal(loaded.offsets, csr.offsets)
+    np.testing.assert_array_equal(loaded.neighbors, csr.neighbors)
+    assert loaded.n_nodes == 5
+    assert loaded.n_edges == graph.number_of_edges()
+    assert edge_set(loaded) == {frozenset(edge) for edge in graph.edges}
+
+
+def test_graph_to_csr_geoid_attr():
+    graph = nx.Graph()
+    graph.add_node(0, GEOID10="56001")
+    graph.add_node(1, GEOID10="56003")
+    graph.add_edge(0, 1)
+
+    csr = graph_to_csr(graph, geoid_attr="GEOID10")
+
+    assert list(csr.geoids) == ["56001", "56003"]
+    assert edge_set(csr) == {frozenset(("56001", "56003"))}
+
+
+def test_edges_to_csr_matches_graph_to_csr():
+    edges = [("a", "b", {}), ("b", "c", {}), ("a", "c", {})]
+
+    csr = edges_to_csr(edges)
+
+    assert edge_set(csr) == edge_set(graph_to_csr(nx.Graph([e[:2] for e in edges])))
+    assert csr.n_edges == 3
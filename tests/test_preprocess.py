@@ -0,0 +1,66 @@
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from preprocess import PreprocessCache, build_geoids, cache_key, sanitize_paths
+
+
+def test_cache_round_trips_prepared_layer(tmp_path):
+    layer_gdf = gpd.GeoDataFrame(
+        {
+            "NAME10": ["A", "B"],
+            "COUNTYFP10": ["001", "003"],
+            "geometry": [shapely.box(0, 0, 1, 1), shapely.box(1, 1, 2, 2)],
+        },
+        index=pd.Index(["56001", "56003"], name="GEOID10"),
+        crs="EPSG:4269",
+    )
+    layer_gdf["internal_point"] = gpd.points_from_xy(
+        [0.5, 1.5], [0.5, 1.5], crs=layer_gdf.crs
+    )
+    cache = PreprocessCache(str(tmp_path))
+    key = cache_key("geo", "abc", level="county", year="2010")
+
+    cache.put(key, layer_gdf, {"geos_by_county": {"001": ["56001"]}})
+    cached_gdf, extras = cache.get(key)
+
+    assert isinstance(cached_gdf, gpd.GeoDataFrame)
+    assert extras == {"geos_by_county": {"001": ["56001"]}}
+    pd.testing.assert_index_equal(cached_gdf.index, layer_gdf.index)
+    assert cached_gdf.crs == layer_gdf.crs
+    assert list(cached_gdf["NAME10"]) == ["A", "B"]
+    assert cached_gdf.geometry.geom_equals(layer_gdf.geometry).all()
+    assert isinstance(cached_gdf["internal_point"], gpd.GeoSeries)
+    assert cached_gdf["internal_point"].geom_equals(layer_gdf["internal_point"]).all()
+
+
+def test_cache_round_trips_table(tmp_path):
+    table_df = pd.DataFrame(
+        {"P0010001": [10, 20]}, index=pd.Index(["56001", "56003"], name="geoid")
+    )
+    cache = PreprocessCache(str(tmp_path))
+
+    assert cache.get("pop-missing") is None
+    cache.put("pop-key", table_df)
+    cached_df, extras = cache.get("pop-key")
+
+    pd.testing.assert_frame_equal(cached_df, table_df)
+    assert extras == {}
+
+
+def test_cache_key_depends_on_params():
+    assert cache_key("geo", "abc", level="block") == cache_key(
+        "geo", "abc", level="block"
+    )
+    assert cache_key("geo", "abc", level="block") != cache_key(
+        "geo", "abc", level="county"
+    )
+
+
+def test_sanitize_paths_and_build_geoids():
+    df = pd.DataFrame(
+        {"name": ["a/b", "c"], "state": ["56", "56"], "county": ["1", "3"]}
+    )
+
+    assert list(sanitize_paths(df)["name"]) == ["a--b", "c"]
+    assert list(build_geoids(df, ("state", "county"))) == ["561", "563"]
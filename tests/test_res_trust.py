@@ -0,0 +1,56 @@
+import geopandas as gpd
+import pytest
+import shapely
+
+from preprocess import merge_res_trust_collisions
+
+INDEX_COL = "GEOID10"
+
+
+def aiannh_layer(names):
+    return gpd.GeoDataFrame(
+        {
+            INDEX_COL: [
+                "aiannh:0010:fips56",
+                "aiannh:0010:fips56",
+                "aiannh:0020:fips56",
+            ],
+            "NAME10": names,
+            "ALAND10": [100, 20, 50],
+            "AWATER10": [1, 2, 3],
+            "res_trust_class": ["reservation", "trust", "reservation"],
+            "geometry": [
+                shapely.box(0, 0, 1, 1),
+                shapely.box(1, 0, 2, 1),
+                shapely.box(5, 5, 6, 6),
+            ],
+        },
+        crs="EPSG:4269",
+    )
+
+
+def test_merges_colliding_pair():
+    layer_gdf = aiannh_layer(["Wind River", "Wind River", "Other"])
+
+    merged = merge_res_trust_collisions(layer_gdf, INDEX_COL, "10").set_index(
+        INDEX_COL
+    )
+
+    assert sorted(merged.index) == ["aiannh:0010:fips56", "aiannh:0020:fips56"]
+    pair = merged.loc["aiannh:0010:fips56"]
+    assert pair["res_trust_class"] == "union"
+    assert pair["NAME10"] == "Wind River"
+    assert (pair["ALAND10"], pair["AWATER10"]) == (120, 3)
+    assert pair.geometry.equals(shapely.box(0, 0, 2, 1))
+    # Rows without a collision are kept as they are.
+    single = merged.loc["aiannh:0020:fips56"]
+    assert single["res_trust_class"] == "reservation"
+    assert (single["ALAND10"], single["AWATER10"]) == (50, 3)
+    assert single.geometry.equals(shapely.box(5, 5, 6, 6))
+
+
+def test_mismatched_names_raise():
+    layer_gdf = aiannh_layer(["Wind River", "Wind River Trust", "Other"])
+
+    with pytest.raises(ValueError, match="aiannh:0010:fips56"):
+        merge_res_trust_collisions(layer_gdf, INDEX_COL, "10")
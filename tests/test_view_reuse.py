@@ -0,0 +1,174 @@
+import asyncio
+import json
+import sqlite3
+import sys
+import types
+import uuid
+from datetime import datetime, timezone
+
+import anyio
+
+import view_reuse
+from view_reuse import (
+    REUSE_HEADER,
+    RenderStore,
+    ViewReuseHeaderMiddleware,
+    _reused_view,
+    install,
+    rewrite_text,
+    view_key_and_replacements,
+)
+
+OLD_PATH = "views_1"
+NEW_PATH = "views_2"
+OLD_AT = "2010-04-01T00:00:00+00:00"
+NEW_AT = "2010-04-02T00:00:00+00:00"
+
+
+def make_gpkg(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE gpkg_contents (table_name TEXT, data_type TEXT);
+        INSERT INTO gpkg_contents VALUES ('blocks', 'features');
+        INSERT INTO gpkg_contents VALUES ('gerrydb_view_meta', 'attributes');
+        CREATE TABLE blocks (path TEXT, total_pop INTEGER);
+        CREATE TABLE gerrydb_view_meta (key TEXT, value TEXT);
+        """
+    )
+    conn.execute("INSERT INTO blocks VALUES (?, 10)", (OLD_PATH,))
+    conn.executemany(
+        "INSERT INTO gerrydb_view_meta VALUES (?, ?)",
+        [
+            ("path", OLD_PATH),
+            ("view", json.dumps({"path": OLD_PATH, "at": OLD_AT})),
+            ("other", json.dumps({"path": f"{OLD_PATH}0", "count": 3})),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def read_meta(path):
+    conn = sqlite3.connect(path)
+    meta = dict(conn.execute("SELECT key, value FROM gerrydb_view_meta"))
+    features = [row[0] for row in conn.execute("SELECT path FROM blocks")]
+    conn.close()
+    return meta, features
+
+
+def make_view(path, meta_id, email):
+    at = datetime.now(timezone.utc)
+    meta = types.SimpleNamespace(
+        meta_id=meta_id,
+        uuid=uuid.uuid4(),
+        notes=f"Creating {path}",
+        created_at=at,
+        user=types.SimpleNamespace(email=email),
+    )
+    return types.SimpleNamespace(
+        view_id=meta_id,
+        path=path,
+        template_version_id=1,
+        loc_id=2,
+        layer_id=3,
+        graph_id=None,
+        proj=None,
+        meta_id=meta_id,
+        meta=meta,
+        valid_at=at,
+        created_at=at,
+    )
+
+
+def test_views_from_different_contexts_share_a_key():
+    key, replacements = view_key_and_replacements(
+        make_view(OLD_PATH, 1, "a@test.com")
+    )
+    other_key, other_replacements = view_key_and_replacements(
+        make_view(NEW_PATH, 2, "b@test.com")
+    )
+
+    assert key == other_key
+    assert "meta_id" not in key
+    assert replacements["path"] == OLD_PATH
+    assert other_replacements["meta.created_by"] == "b@test.com"
+
+
+def test_install_wraps_the_call_site_only(tmp_path, monkeypatch):
+    def view_to_gpkg(context, db_config):
+        return None
+
+    endpoint = types.ModuleType("view_endpoint")
+    renderer = types.ModuleType("view_renderer")
+    endpoint.view_to_gpkg = renderer.view_to_gpkg = view_to_gpkg
+    monkeypatch.setitem(sys.modules, "view_endpoint", endpoint)
+    monkeypatch.setitem(sys.modules, "view_renderer", renderer)
+    monkeypatch.setattr(view_reuse, "models", types.SimpleNamespace())
+
+    install(str(tmp_path), "view_endpoint:view_to_gpkg")
+    wrapped = endpoint.view_to_gpkg
+    install(str(tmp_path), "view_endpoint:view_to_gpkg")
+
+    assert wrapped._view_reuse
+    assert endpoint.view_to_gpkg is wrapped
+    assert renderer.view_to_gpkg is view_to_gpkg
+
+
+def test_rewrite_text_replaces_view_values_only(tmp_path):
+    gpkg_path = str(tmp_path / "view.gpkg")
+    make_gpkg(gpkg_path)
+
+    rewrite_text(gpkg_path, [(OLD_PATH, NEW_PATH), (OLD_AT, NEW_AT)])
+
+    meta, features = read_meta(gpkg_path)
+    assert meta["path"] == NEW_PATH
+    assert json.loads(meta["view"]) == {"path": NEW_PATH, "at": NEW_AT}
+    # Longer values containing the path, and feature tables, are left alone.
+    assert json.loads(meta["other"])["path"] == f"{OLD_PATH}0"
+    assert features == [OLD_PATH]
+
+
+def test_store_and_reuse(tmp_path):
+    rendered_path = str(tmp_path / "rendered.gpkg")
+    make_gpkg(rendered_path)
+    store = RenderStore(str(tmp_path / "store"))
+
+    assert store.load("key") is None
+    store.store("key", rendered_path, "census.2010", {"path": OLD_PATH, "at": OLD_AT})
+    stored = store.load("key")
+    assert stored["namespace"] == "census.2010"
+    assert stored["path"] == OLD_PATH
+
+    render_id, reused_path = store.reuse(
+        "key", stored, {"path": NEW_PATH, "at": NEW_AT}
+    )
+
+    assert reused_path.name == f"{render_id.hex}.gpkg"
+    meta, _ = read_meta(reused_path)
+    assert json.loads(meta["view"]) == {"path": NEW_PATH, "at": NEW_AT}
+    # The stored render is unchanged.
+    stored_meta, _ = read_meta(str(tmp_path / "store" / "key.gpkg"))
+    assert stored_meta["path"] == OLD_PATH
+
+
+def test_header_middleware_reports_reuse_from_endpoint_thread():
+    def endpoint():
+        # Sync endpoints run in a worker thread, like the view renderer.
+        _reused_view.get()["view"] = "census.2010/views_1"
+
+    async def app(scope, receive, send):
+        await anyio.to_thread.run_sync(endpoint)
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/api/v1/views/census.2010"}
+    asyncio.run(ViewReuseHeaderMiddleware(app)(scope, None, send))
+
+    headers = dict(messages[0]["headers"])
+    assert headers[REUSE_HEADER.lower().encode()] == b"census.2010/views_1"
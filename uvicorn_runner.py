@@ -1,12 +1,17 @@
 """Entrypoint for Gerry API server."""
 
+import glob
+import os
+import shutil
+import tempfile
 from http import HTTPStatus
+from importlib.util import find_spec
+from typing import Optional
 
 from fastapi import FastAPI, Request, Response
-from starlette.responses import StreamingResponse
-from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
 
+from gerrydb_meta import models
 from gerrydb_meta.api import api_router
 from gerrydb_meta.exceptions import (
     BulkCreateError,
@@ -15,20 +20,105 @@ from gerrydb_meta.exceptions import (
     CreateValueError,
 )
 
+import click
+import uvicorn
+from sqlalchemy import create_engine, select
+from starlette.concurrency import run_in_threadpool
 from uvicorn.config import LOGGING_CONFIG, logger
 
-from io import BytesIO
-import json
-import gzip
+import hashlib
+from functools import partial
+
+from compression import CompressionMiddleware, available_codecs, config_from_env
+from server_timing import (
+    metrics_config_from_env,
+    ServerTimingMiddleware,
+    TimingMetrics,
+    install_db_listeners,
+    install_serialization_timer,
+    record,
+)
+from view_reuse import ViewReuseHeaderMiddleware
+from view_reuse import config_from_env as view_reuse_config_from_env
+from view_reuse import install as install_view_reuse
 
 API_PREFIX = "/api/v1"
 
 app = FastAPI(title="gerrydb-meta", openapi_url=f"{API_PREFIX}/openapi.json")
 
+# Longest error detail / response body prefix written to the log.
+MAX_LOGGED_ERROR_CHARS = 1024
+
+
+def set_error_context(request: Request, kind: str, detail: str, **counts):
+    """Records what an exception handler knows about an error for the error log,
+    so `ErrorLoggingMiddleware` never has to re-parse the response body."""
+    request.state.error_context = {"kind": kind, "detail": detail, **counts}
+
+
+class ErrorLoggingMiddleware:
+    """Logs 400 and 422 responses without buffering or copying their bodies.
+
+    Body chunks are passed straight through to the client. The log line uses the
+    context recorded by the exception handler (`set_error_context`) when there is
+    one and otherwise a bounded prefix of the body.
+    """
+
+    def __init__(self, app, max_chars: int = MAX_LOGGED_ERROR_CHARS):
+        self.app = app
+        self.max_chars = max_chars
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = None
+        body_prefix = bytearray()
+
+        async def send_and_log(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body" and status_code in (400, 422):
+                if len(body_prefix) < self.max_chars:
+                    body_prefix.extend(
+                        message.get("body", b"")[: self.max_chars - len(body_prefix)]
+                    )
+                if not message.get("more_body", False):
+                    self.log_error(scope, status_code, body_prefix)
+            await send(message)
+
+        await self.app(scope, receive, send_and_log)
+
+    def log_error(self, scope, status_code: int, body_prefix: bytearray):
+        context = scope.get("state", {}).get("error_context")
+        if context is not None:
+            counts = "".join(
+                f", {key.replace('_', ' ').capitalize()}: {value}"
+                for key, value in context.items()
+                if key not in ("kind", "detail")
+            )
+            detail = (
+                f"{context['kind']}: {context['detail'][: self.max_chars]}{counts}"
+            )
+        else:
+            detail = body_prefix.decode("utf-8", errors="replace")
+
+        path = scope["path"]
+        if scope.get("query_string"):
+            path += "?" + scope["query_string"].decode("latin-1")
+        logger.error(
+            f"{status_code} for Request: {scope['method']}. At: {path}, Detail: {detail}"
+        )
+
 
 @app.exception_handler(CreateValueError)
 def create_value_error(request: Request, exc: CreateValueError):
     """Handles generic object creation failures."""
+    set_error_context(
+        request, "Create value error", f"Object creation failed. Reason: {exc}"
+    )
     return JSONResponse(
         status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
         content={
@@ -41,6 +131,12 @@ def create_value_error(request: Request, exc: CreateValueError):
 @app.exception_handler(ColumnValueTypeError)
 def column_value_type_error(request: Request, exc: ColumnValueTypeError):
     """Handles generic object creation failures."""
+    set_error_context(
+        request,
+        "Column value type error",
+        "Type errors found in column values.",
+        error_count=len(exc.errors),
+    )
     return JSONResponse(
         status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
         content={
@@ -54,6 +150,12 @@ def column_value_type_error(request: Request, exc: ColumnValueTypeError):
 @app.exception_handler(BulkCreateError)
 def bulk_create_error(request: Request, exc: BulkCreateError):
     """Handles (bulk) creation conflicts."""
+    set_error_context(
+        request,
+        "Bulk create error",
+        f"Object creation failed. Reason: {exc}",
+        path_count=len(exc.paths),
+    )
     return JSONResponse(
         status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
         content={
@@ -67,6 +169,12 @@ def bulk_create_error(request: Request, exc: BulkCreateError):
 @app.exception_handler(BulkPatchError)
 def bulk_create_error(request: Request, exc: BulkCreateError):
     """Handles (bulk) creation conflicts."""
+    set_error_context(
+        request,
+        "BulkPatchError",
+        f"Object patch failed. Reason: {exc}",
+        path_count=len(exc.paths),
+    )
     return JSONResponse(
         status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
         content={
@@ -77,72 +185,254 @@ def bulk_create_error(request: Request, exc: BulkCreateError):
     )
 
 
-app.add_middleware(GZipMiddleware)
-app.include_router(api_router, prefix=API_PREFIX)
+# Registered first (innermost) so it sees bodies before they are compressed.
+app.add_middleware(ErrorLoggingMiddleware)
+
+
+_graph_version_engine = None
+
+
+def graph_etag(namespace: str, path: str) -> Optional[str]:
+    """Derives a graph's ETag from its id and object metadata, without rendering it.
+
+    Graphs are immutable once created, so `(graph_id, meta_id)` identifies the
+    content. Both come from an indexed lookup by namespace and path. Returns
+    `None` if there is no such graph.
+    """
+    global _graph_version_engine
+    if _graph_version_engine is None:
+        _graph_version_engine = create_engine(
+            os.environ["GERRYDB_DATABASE_URI"], pool_size=1
+        )
+
+    graphs = models.Graph.__table__
+    namespaces = models.Namespace.__table__
+    query = (
+        select(graphs.c.graph_id, graphs.c.meta_id)
+        .join(namespaces, namespaces.c.namespace_id == graphs.c.namespace_id)
+        .where(namespaces.c.path == namespace, graphs.c.path == path)
+    )
+    with _graph_version_engine.connect() as conn:
+        row = conn.execute(query).one_or_none()
+    if row is None:
+        return None
+    version = f"{namespace}/{path}/{row.graph_id}/{row.meta_id}"
+    return f'"{hashlib.sha256(version.encode()).hexdigest()}"'
 
 
 @app.middleware("http")
-async def log_400_errors(request: Request, call_next):
-    response = await call_next(request)
+async def graph_etags(request: Request, call_next):
+    """Adds version ETags to graph responses and answers matching conditional
+    requests with 304 Not Modified before the graph is rendered, so clients can
+    reuse cached graphs (see `graph_cache.py`)."""
+    graphs_prefix = f"{API_PREFIX}/graphs/"
+    if request.method != "GET" or not request.url.path.startswith(graphs_prefix):
+        return await call_next(request)
 
-    # Check for the specific status code
-    if response.status_code in [400, 422]:
-
-        # If the response is a StreamingResponse, you need to iterate over the body
-        # and consume it to log the content
-        if isinstance(response, StreamingResponse):
-            body_content = b""
-            # Reconstruct the response body from the stream
-            async for chunk in response.body_iterator:
-                body_content += chunk
-
-            # Need this in case the original body is encoded
-            original_body = body_content
-
-            # Handle potential gzip encoding
-            if response.headers.get("Content-Encoding") == "gzip":
-                body_content = gzip.decompress(body_content)
-
-            try:
-                json_body = json.loads(body_content.decode())
-                logger.error(
-                    f"{response.status_code} for Request: {request.method}. At: {request.url}, Detail: {json_body.get('detail', 'No detail available')}"
-                )
-            except Exception as e:
-                # Log the error with the reconstructed body content
-                logger.error(
-                    f"{response.status_code} for Request: {request.method}. At: {request.url}, Detail: {body_content.decode('utf-8', errors='replace')}"
-                )
-
-            # Create a new StreamingResponse with the consumed content
-            response = StreamingResponse(
-                BytesIO(original_body),
-                status_code=response.status_code,
-                headers=dict(response.headers),
-            )
-        else:
-            # For non-streaming responses, you can directly access the body
-            body_content = b""
-            if hasattr(response, "body"):
-                body_content = response.body
-
-            # Handle potential gzip encoding
-            if response.headers.get("Content-Encoding") == "gzip":
-                body_content = gzip.decompress(body_content)
-
-            try:
-                json_body = json.loads(body_content.decode())
-                logger.error(
-                    f"{response.status_code} for Request: {request.method}. At: {request.url}, Detail: {json_body.get('detail', 'No detail available')}"
-                )
-            except Exception as e:
-                logger.error(
-                    f"{response.status_code} for Request: {request.method}. At: {request.url}, Detail: {body_content.decode('utf-8', errors='replace')}"
-                )
+    namespace, _, path = request.url.path[len(graphs_prefix) :].partition("/")
+    etag = await run_in_threadpool(graph_etag, namespace, path.strip("/"))
+    if etag is not None and request.headers.get("If-None-Match") == etag:
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={"ETag": etag})
 
+    response = await call_next(request)
+    if etag is not None and response.status_code == HTTPStatus.OK:
+        response.headers["ETag"] = etag
     return response
 
 
+# View renders are reused inside the view creation endpoint (see `view_reuse.py`);
+# the middleware only reports reuse in a response header.
+install_view_reuse(**view_reuse_config_from_env())
+app.add_middleware(ViewReuseHeaderMiddleware, api_prefix=API_PREFIX)
+
+# Registered after `graph_etags`, so outside it. 304 responses have no body, so
+# they are below the minimum size and pass through uncompressed.
+# Settings come from the environment so that every worker process shares them.
+app.add_middleware(
+    CompressionMiddleware, record_time=partial(record, "compress"), **config_from_env()
+)
+
+# Registered last (outermost) so request timings cover the whole stack.
+timing_metrics = TimingMetrics(**metrics_config_from_env())
+install_db_listeners()
+install_serialization_timer()
+app.add_middleware(ServerTimingMiddleware, metrics=timing_metrics)
+app.include_router(api_router, prefix=API_PREFIX)
+
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
+
+
+@app.get("/metrics")
+def metrics():
+    """Request timings per route, aggregated across all workers since the server
+    started (`workers` is the number of workers that have served requests). Other
+    workers' figures can lag by up to a second (see `TimingMetrics`).
+
+    When the app is run without a metrics directory (not through `main`), only
+    the requests of the worker answering (identified by `pid`) are covered.
+    """
+    _, n_workers = timing_metrics.merged_routes()
+    return {
+        "pid": os.getpid(),
+        "workers": n_workers,
+        "shared": timing_metrics.store_dir is not None,
+        "routes": timing_metrics.snapshot(),
+    }
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8000, show_default=True)
+@click.option(
+    "--workers",
+    type=int,
+    default=os.cpu_count(),
+    show_default=True,
+    help="Number of worker processes.",
+)
+@click.option(
+    "--loop",
+    type=click.Choice(["asyncio", "uvloop"]),
+    default="uvloop" if find_spec("uvloop") else "asyncio",
+    show_default=True,
+    help="Event loop implementation (uvloop when installed).",
+)
+@click.option(
+    "--http",
+    type=click.Choice(["h11", "httptools"]),
+    default="httptools" if find_spec("httptools") else "h11",
+    show_default=True,
+    help="HTTP protocol implementation (httptools when installed).",
+)
+@click.option(
+    "--timeout-keep-alive",
+    type=int,
+    default=75,
+    show_default=True,
+    help="Seconds to keep idle connections open, so benchmark clients reuse them.",
+)
+@click.option(
+    "--backlog",
+    type=int,
+    default=4096,
+    show_default=True,
+    help="Maximum number of pending connections.",
+)
+@click.option(
+    "--compression-min-size",
+    type=int,
+    default=1024,
+    show_default=True,
+    help="Responses smaller than this many bytes are sent uncompressed.",
+)
+@click.option(
+    "--compression-level",
+    type=int,
+    default=None,
+    help="Compression level (codec default if not given).",
+)
+@click.option(
+    "--compression-codecs",
+    default=",".join(available_codecs()),
+    show_default=True,
+    help="Comma-separated codecs to negotiate, in order of preference.",
+)
+@click.option(
+    "--localhost-passthrough",
+    is_flag=True,
+    help="Send responses to localhost clients uncompressed.",
+)
+@click.option(
+    "--compression-stats",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="JSON lines file to append per-response compression statistics to.",
+)
+@click.option(
+    "--view-reuse-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Store view renders in this directory and reuse them for identical view "
+    "creations (same template, locality, layer, graph and data).",
+)
+@click.option(
+    "--metrics-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory where workers share their /metrics aggregates. Cleared on "
+    "startup; defaults to a temporary directory removed on shutdown.",
+)
+@click.option(
+    "--dev",
+    is_flag=True,
+    help="Run a single worker with auto-reload (development only).",
+)
+def main(
+    host,
+    port,
+    workers,
+    loop,
+    http,
+    timeout_keep_alive,
+    backlog,
+    compression_min_size,
+    compression_level,
+    compression_codecs,
+    localhost_passthrough,
+    compression_stats,
+    view_reuse_dir,
+    metrics_dir,
+    dev,
+):
+    """Runs the API server the way it is deployed (or in dev mode with --dev)."""
+    # Workers import the app themselves, so settings are passed on through the
+    # environment (see `compression.config_from_env`, `view_reuse.config_from_env`).
+    os.environ["GERRYDB_COMPRESSION_MIN_SIZE"] = str(compression_min_size)
+    os.environ["GERRYDB_COMPRESSION_CODECS"] = compression_codecs
+    os.environ["GERRYDB_COMPRESSION_LOCALHOST_PASSTHROUGH"] = (
+        "1" if localhost_passthrough else "0"
+    )
+    if compression_level is not None:
+        os.environ["GERRYDB_COMPRESSION_LEVEL"] = str(compression_level)
+    if compression_stats is not None:
+        os.environ["GERRYDB_COMPRESSION_STATS"] = os.path.abspath(compression_stats)
+    if view_reuse_dir is not None:
+        os.environ["GERRYDB_VIEW_REUSE_DIR"] = os.path.abspath(view_reuse_dir)
+
+    # Aggregates of a previous server run must not be merged into this one's.
+    remove_metrics_dir = metrics_dir is None
+    if metrics_dir is None:
+        metrics_dir = tempfile.mkdtemp(prefix="gerrydb_metrics_")
+    else:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(path)
+    os.environ["GERRYDB_METRICS_DIR"] = os.path.abspath(metrics_dir)
+
+    logger.info(
+        f"Starting server with {1 if dev else workers} worker(s), "
+        f"loop={loop}, http={http}, reload={dev}"
+    )
+    try:
+        uvicorn.run(
+            "uvicorn_runner:app",
+            host=host,
+            port=port,
+            workers=None if dev else workers,
+            reload=dev,
+            loop=loop,
+            http=http,
+            timeout_keep_alive=timeout_keep_alive,
+            backlog=backlog,
+            log_config=LOGGING_CONFIG,
+        )
+    finally:
+        if remove_metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
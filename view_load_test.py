@@ -0,0 +1,266 @@
+"""Load test for concurrent view creation.
+
+Runs N concurrent clients (threads, each with its own GerryDB session and write
+context, opened before the level starts) creating views against the same
+locality, layer and graph, for each concurrency level in `--concurrency`. For
+every level the throughput (views/min), latency percentiles and error rate are
+reported and written to the results file.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+
+from gerrydb import GerryDB
+import click
+
+from benchmark import (
+    BenchmarkResult,
+    PhaseTimer,
+    format_summary,
+    percentile,
+    write_results,
+)
+
+
+def open_clients(
+    concurrency: int, namespace: str, stack: ExitStack
+) -> tuple[dict, dict]:
+    """Opens a GerryDB session and write context for each client before a level
+    starts, so that setup is not timed and a failed setup cannot stall the level.
+
+    Returns the write contexts of the clients that are ready and the setup
+    errors of those that are not, by client id.
+    """
+    contexts = {}
+    setup_errors = {}
+    for client_id in range(concurrency):
+        try:
+            db = GerryDB(namespace=namespace)
+            contexts[client_id] = stack.enter_context(
+                db.context(notes=f"View load test client {client_id}")
+            )
+        except Exception as e:
+            setup_errors[client_id] = repr(e)
+    return contexts, setup_errors
+
+
+def run_client(
+    client_id: int,
+    ctx,
+    n_views: int,
+    path_prefix: str,
+    namespace: str,
+    template,
+    locality,
+    layer,
+    graph,
+    start_barrier: threading.Barrier,
+) -> tuple[list, list]:
+    """Creates `n_views` views one after another; returns latencies and errors."""
+    latencies = []
+    errors = []
+
+    start_barrier.wait()
+    for i in range(n_views):
+        t_start = time.perf_counter()
+        try:
+            ctx.views.create(
+                path=f"{path_prefix}_{client_id}_{i}",
+                namespace=namespace,
+                template=template,
+                locality=locality,
+                graph=graph,
+                layer=layer,
+            )
+        except Exception as e:
+            errors.append(repr(e))
+        else:
+            latencies.append(time.perf_counter() - t_start)
+
+    return latencies, errors
+
+
+def run_level(
+    concurrency: int,
+    views_per_client: int,
+    run_id: str,
+    dataset: str,
+    namespace: str,
+    template,
+    locality,
+    layer,
+    graph,
+) -> BenchmarkResult:
+    """Runs one concurrency level and summarizes it.
+
+    Clients that fail to set up count all of their views as errors. The wall
+    time is measured from the moment all ready clients are released.
+    """
+    path_prefix = f"load_test_{run_id}_c{concurrency}"
+    outcomes = []
+    wall_s = 0.0
+
+    with ExitStack() as stack:
+        contexts, setup_errors = open_clients(concurrency, namespace, stack)
+        outcomes.extend(
+            ([], [error] * views_per_client) for error in setup_errors.values()
+        )
+
+        if contexts:
+            released = {}
+
+            def record_release():
+                released["t"] = time.perf_counter()
+
+            start_barrier = threading.Barrier(len(contexts), action=record_release)
+            with ThreadPoolExecutor(max_workers=len(contexts)) as pool:
+                futures = [
+                    pool.submit(
+                        run_client,
+                        client_id,
+                        ctx,
+                        views_per_client,
+                        path_prefix,
+                        namespace,
+                        template,
+                        locality,
+                        layer,
+                        graph,
+                        start_barrier,
+                    )
+                    for client_id, ctx in contexts.items()
+                ]
+                outcomes.extend(future.result() for future in futures)
+            wall_s = time.perf_counter() - released["t"]
+
+    latencies = [
+        latency for client_latencies, _ in outcomes for latency in client_latencies
+    ]
+    errors = [error for _, client_errors in outcomes for error in client_errors]
+    n_requests = len(latencies) + len(errors)
+
+    return BenchmarkResult(
+        name=f"concurrency_{concurrency}",
+        dataset=dataset,
+        samples=latencies,
+        extra={
+            "concurrency": concurrency,
+            "requests": n_requests,
+            "errors": len(errors),
+            "error_rate": len(errors) / n_requests if n_requests else 0.0,
+            "wall_s": wall_s,
+            "views_per_min": 60 * len(latencies) / wall_s if wall_s else 0.0,
+            "p99": percentile(latencies, 99),
+            "error_samples": sorted(set(errors))[:5],
+        },
+    )
+
+
+@click.command()
+@click.option("--large", type=int, help="Run on large data set.")
+@click.option("--extreme", type=int, help="Run on extreme data set.")
+@click.option(
+    "--concurrency",
+    default="1,2,4,8",
+    show_default=True,
+    help="Comma-separated numbers of concurrent clients to test.",
+)
+@click.option(
+    "--views-per-client",
+    type=int,
+    default=3,
+    show_default=True,
+    help="Views each client creates per concurrency level.",
+)
+@click.option(
+    "--columns",
+    default="total_pop",
+    show_default=True,
+    help="Comma-separated columns of the view template used by the test.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Results file (.json or .csv). "
+    "Defaults to ./results/view_load_<dataset>_<timestamp>.json.",
+)
+@click.option(
+    "--phase-results",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="JSON lines phase results file to append one record per level to.",
+)
+def main(
+    large, extreme, concurrency, views_per_client, columns, output, phase_results
+):
+
+    # convert int to bool
+    large = large == 1
+    extreme = extreme == 1
+
+    base_namespace = "census.2010"
+
+    if extreme:
+        dataset = "tx_block"
+    elif large:
+        dataset = "wy_block"
+    else:
+        dataset = "wy_county"
+
+    run_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+    if output is None:
+        output = os.path.join("results", f"view_load_{dataset}_{run_id}.json")
+
+    levels = [int(level) for level in concurrency.split(",")]
+    results = []
+
+    with GerryDB(namespace=base_namespace) as db:
+        locality = db.localities["tx" if extreme else "wy"]
+        layer = db.geo_layers["block" if large or extreme else "county"]
+        graph = db.graphs[f"{dataset}_2010_dual"]
+
+        with db.context(notes="Creating view load test template") as ctx:
+            template = ctx.view_templates.create(
+                path=f"load_test_{run_id}_view_template",
+                columns=columns.split(","),
+                namespace=base_namespace,
+                description="View template for the concurrent view load test.",
+            )
+
+    for level in levels:
+        print(f"Running {level} concurrent clients...", flush=True)
+        with PhaseTimer(f"view_load_c{level}", phase_results, dataset=dataset):
+            result = run_level(
+                level,
+                views_per_client,
+                run_id,
+                dataset,
+                base_namespace,
+                template,
+                locality,
+                layer,
+                graph,
+            )
+        print(format_summary(result), flush=True)
+        print(
+            f"\t{result.extra['views_per_min']:.1f} views/min, "
+            f"error rate {result.extra['error_rate']:.1%}",
+            flush=True,
+        )
+        results.append(result)
+
+    write_results(
+        results,
+        output,
+        metadata={"dataset": dataset, "namespace": base_namespace},
+    )
+    print(f"Wrote load test results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""Reuse of view renders across identical view creations.
+
+Every `POST /views/<namespace>` renders the new view to a GeoPackage, even when
+a view with the same template, locality, layer and graph was rendered moments
+earlier from unchanged data. `install` wraps the renderer called by the view
+creation endpoint (`GERRYDB_VIEW_RENDERER`, the `view_to_gpkg` name in
+`gerrydb_meta.api.view` by default) so that renders are stored and reused. The
+renderer is only called after the caller has been authorized and the requested
+view has been created, so reuse skips the rendering and nothing else.
+
+A render is stored under a key made of what the view renders (template version,
+locality, layer, graph and projection; see `view_key_and_replacements`) and the
+version of the data it reads as of its `valid_at` (see `data_version`): the
+locality's geography set version, and the number and latest `valid_from` of the
+versions of its geographies and of the values of the template's columns. A write
+made through a context that is still open changes these too, so a stale render
+is never reused.
+
+A reused render is a copy of the stored GeoPackage in which the path,
+timestamps and write context metadata of the stored view are replaced with
+those of the new view in the text values of its non-feature tables (see
+`rewrite_text`). The response then carries an `X-View-Reuse` header naming the
+view whose render was reused, added by `ViewReuseHeaderMiddleware`.
+
+Renders are stored in a directory shared by every server worker, configured
+through `GERRYDB_VIEW_REUSE_DIR` (see `config_from_env`). Reuse is off when it
+is not set.
+"""
+
+import functools
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional
+
+try:
+    from gerrydb_meta import models
+    from sqlalchemy import func, or_, select, union
+    from sqlalchemy.orm import object_session
+except ImportError:
+    models = None
+
+REUSE_HEADER = "X-View-Reuse"
+
+DEFAULT_RENDERER = "gerrydb_meta.api.view:view_to_gpkg"
+
+# The view whose render the current request reused (set by the renderer wrapper,
+# read by `ViewReuseHeaderMiddleware`).
+_reused_view: ContextVar[Optional[dict]] = ContextVar("reused_view", default=None)
+
+
+def config_from_env() -> dict:
+    """Reads view reuse settings from the environment."""
+    return {
+        "store_dir": os.getenv("GERRYDB_VIEW_REUSE_DIR") or None,
+        "renderer": os.getenv("GERRYDB_VIEW_RENDERER") or DEFAULT_RENDERER,
+    }
+
+
+def install(store_dir: Optional[str], renderer: str = DEFAULT_RENDERER) -> None:
+    """Wraps the view renderer with render reuse.
+
+    `renderer` ("module:name") is the name under which the view creation
+    endpoint's module calls the renderer; only that name is replaced.
+    """
+    if store_dir is None:
+        return
+    if models is None:
+        raise RuntimeError("gerrydb_meta must be available for view reuse.")
+
+    module_name, _, name = renderer.partition(":")
+    module = importlib.import_module(module_name)
+    render = getattr(module, name)
+    if getattr(render, "_view_reuse", False):
+        return
+
+    store = RenderStore(store_dir)
+
+    @functools.wraps(render)
+    def render_with_reuse(*args, **kwargs):
+        context = kwargs["context"] if "context" in kwargs else args[0]
+        return store.render(context.view, render, *args, **kwargs)
+
+    render_with_reuse._view_reuse = True
+    setattr(module, name, render_with_reuse)
+
+
+def view_key_and_replacements(view) -> tuple[dict, dict]:
+    """Splits a view into what identifies its render and the text values
+    specific to the view (path, timestamps and write context metadata)."""
+    key = {
+        "template_version_id": view.template_version_id,
+        "loc_id": view.loc_id,
+        "layer_id": view.layer_id,
+        "graph_id": view.graph_id,
+        "proj": view.proj,
+    }
+    replacements = {
+        "path": view.path,
+        "valid_at": view.valid_at.isoformat(),
+        "created_at": view.created_at.isoformat(),
+        "meta.uuid": str(view.meta.uuid),
+        "meta.notes": view.meta.notes,
+        "meta.created_at": view.meta.created_at.isoformat(),
+        "meta.created_by": view.meta.user.email,
+    }
+    return key, {attr: new for attr, new in replacements.items() if new is not None}
+
+
+def data_version(db, view) -> list:
+    """Returns the version of the data `view` renders as of its `valid_at`.
+
+    Counts are included with the latest `valid_from` so that rows written by a
+    transaction that started before the last render are still noticed.
+    """
+    valid_at = view.valid_at
+    set_version_id = db.execute(
+        select(models.GeoSetVersion.set_version_id).where(
+            models.GeoSetVersion.layer_id == view.layer_id,
+            models.GeoSetVersion.loc_id == view.loc_id,
+            models.GeoSetVersion.valid_from <= valid_at,
+            or_(
+                models.GeoSetVersion.valid_to.is_(None),
+                models.GeoSetVersion.valid_to > valid_at,
+            ),
+        )
+    ).scalar_one_or_none()
+
+    geo_version = db.execute(
+        select(func.count(), func.max(models.GeoVersion.valid_from))
+        .join(
+            models.GeoSetMember,
+            models.GeoSetMember.geo_id == models.GeoVersion.geo_id,
+        )
+        .where(
+            models.GeoSetMember.set_version_id == set_version_id,
+            models.GeoVersion.valid_from <= valid_at,
+        )
+    ).one()
+
+    template_version_id = view.template_version_id
+    col_ids = union(
+        select(models.ColumnRef.col_id)
+        .join(
+            models.ViewTemplateColumnMember,
+            models.ViewTemplateColumnMember.ref_id == models.ColumnRef.ref_id,
+        )
+        .where(
+            models.ViewTemplateColumnMember.template_version_id
+            == template_version_id
+        ),
+        select(models.ColumnRef.col_id)
+        .join(
+            models.ColumnSetMember,
+            models.ColumnSetMember.ref_id == models.ColumnRef.ref_id,
+        )
+        .join(
+            models.ViewTemplateColumnSetMember,
+            models.ViewTemplateColumnSetMember.set_id == models.ColumnSetMember.set_id,
+        )
+        .where(
+            models.ViewTemplateColumnSetMember.template_version_id
+            == template_version_id
+        ),
+    )
+    value_version = db.execute(
+        select(func.count(), func.max(models.ColumnValue.valid_from)).where(
+            models.ColumnValue.col_id.in_(col_ids),
+            models.ColumnValue.valid_from <= valid_at,
+        )
+    ).one()
+
+    return [set_version_id, list(geo_version), list(value_version)]
+
+
+def rewrite_text(gpkg_path: str, replacements: list[tuple[str, str]]) -> None:
+    """Replaces text in every non-feature table of a GeoPackage.
+
+    Values equal to an old string are replaced, and so are JSON string literals
+    (`"old"`) inside longer values, so that e.g. a path is not replaced inside a
+    longer path.
+    """
+    conn = sqlite3.connect(gpkg_path)
+    try:
+        features = {
+            row[0]
+            for row in conn.execute(
+                "SELECT table_name FROM gpkg_contents WHERE data_type = 'features'"
+            )
+        }
+        tables = [
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+            if not row[0].startswith(("gpkg_", "rtree_", "sqlite_"))
+            and row[0] not in features
+        ]
+        for table in tables:
+            columns = [
+                row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')
+            ]
+            for column in columns:
+                for old, new in replacements:
+                    conn.execute(
+                        f"""
+                        UPDATE "{table}"
+                        SET "{column}" = CASE
+                            WHEN "{column}" = :old THEN :new
+                            ELSE replace("{column}", :quoted_old, :quoted_new)
+                        END
+                        WHERE typeof("{column}") = 'text'
+                            AND instr("{column}", :old) > 0
+                        """,
+                        {
+                            "old": old,
+                            "new": new,
+                            "quoted_old": json.dumps(old),
+                            "quoted_new": json.dumps(new),
+                        },
+                    )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class RenderStore:
+    """View renders stored in `store_dir`, keyed by view and data version."""
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    def render(self, view, render, *args, **kwargs):
+        """Reuses the stored render of `view` if there is one, or renders it with
+        `render(*args, **kwargs)` and stores the result."""
+        view_key, replacements = view_key_and_replacements(view)
+        version = data_version(object_session(view), view)
+        key = hashlib.sha256(
+            json.dumps([view_key, version], sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+        stored = self.load(key)
+        if stored is not None:
+            reused = _reused_view.get()
+            if reused is not None:
+                reused["view"] = f"{stored['namespace']}/{stored['path']}"
+            return self.reuse(key, stored, replacements)
+
+        render_id, gpkg_path = render(*args, **kwargs)
+        self.store(key, gpkg_path, view.namespace.path, replacements)
+        return render_id, gpkg_path
+
+    def load(self, key: str) -> Optional[dict]:
+        """Reads the metadata of a stored render (written last, so a render with
+        metadata is complete)."""
+        try:
+            with open(os.path.join(self.store_dir, f"{key}.json")) as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return None
+
+    def reuse(self, key: str, stored: dict, replacements: dict):
+        """Copies a stored render for a new view, like a fresh render."""
+        render_id = uuid.uuid4()
+        gpkg_path = Path(tempfile.mkdtemp()) / f"{render_id.hex}.gpkg"
+        shutil.copyfile(os.path.join(self.store_dir, f"{key}.gpkg"), gpkg_path)
+        rewrite_text(
+            str(gpkg_path),
+            [
+                (stored["replacements"][attr], new)
+                for attr, new in replacements.items()
+                if stored["replacements"].get(attr) not in (None, new)
+            ],
+        )
+        return render_id, gpkg_path
+
+    def store(self, key: str, gpkg_path, namespace: str, replacements: dict):
+        tmp_prefix = os.path.join(self.store_dir, f"{key}.{os.getpid()}")
+        stored_path = os.path.join(self.store_dir, key)
+        shutil.copyfile(gpkg_path, f"{tmp_prefix}.gpkg.tmp")
+        os.replace(f"{tmp_prefix}.gpkg.tmp", f"{stored_path}.gpkg")
+        with open(f"{tmp_prefix}.json.tmp", "w") as fp:
+            json.dump(
+                {
+                    "namespace": namespace,
+                    "path": replacements["path"],
+                    "replacements": replacements,
+                },
+                fp,
+            )
+        os.replace(f"{tmp_prefix}.json.tmp", f"{stored_path}.json")
+
+
+class ViewReuseHeaderMiddleware:
+    """ASGI middleware adding an `X-View-Reuse` header to view creations whose
+    render was reused."""
+
+    def __init__(self, app, api_prefix: str = "/api/v1"):
+        self.app = app
+        self.views_prefix = f"{api_prefix}/views/"
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not scope["path"].startswith(self.views_prefix)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        reused = {}
+        token = _reused_view.set(reused)
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start" and "view" in reused:
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (
+                            REUSE_HEADER.lower().encode("latin-1"),
+                            reused["view"].encode("latin-1"),
+                        ),
+                    ],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            _reused_view.reset(token)